@@ -0,0 +1,265 @@
+"""
+This is a benchmark program of the netrofunction module, run against the
+local NPA simulator (netrosimulator) so that no real token is spent
+usage : bench_netrofunction.py [-h] [--quick] [--output <file>]
+The results are printed (or written to the output file) as one json document
+so that they may be compared from one release to another.
+"""
+
+import argparse
+import json
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+import netrofunction
+import netrosimulator
+
+
+def _timings(function, repeat):
+    """Run function repeat times and return its durations (seconds)."""
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def _summary(durations):
+    """Return the statistics (microseconds) of a list of durations."""
+    durations = sorted(durations)
+    return {
+        "count": len(durations),
+        "mean_us": round(statistics.fmean(durations) * 1e6, 1),
+        "p50_us": round(durations[len(durations) // 2] * 1e6, 1),
+        "p95_us": round(durations[int(len(durations) * 0.95) - 1] * 1e6, 1),
+        "min_us": round(durations[0] * 1e6, 1),
+    }
+
+
+def bench_endpoints(simulator, repeat):
+    """Measure the duration of a call of every endpoint on a local simulator."""
+    ctrl_key = simulator.add_controller(zones=6)
+    sens_key = simulator.add_sensor()
+    client = netrofunction.NetroClient(base_url=simulator.url)
+    calls = {
+        "get_info": lambda: client.get_info(ctrl_key),
+        "get_schedules": lambda: client.get_schedules(ctrl_key),
+        "get_moistures": lambda: client.get_moistures(ctrl_key),
+        "get_sensor_data": lambda: client.get_sensor_data(sens_key),
+        "get_events": lambda: client.get_events(ctrl_key),
+        "set_status": lambda: client.set_status(ctrl_key, 1),
+        "set_moisture": lambda: client.set_moisture(ctrl_key, 50, ["1"]),
+        "water": lambda: client.water(ctrl_key, 1, ["1"]),
+        "stop_water": lambda: client.stop_water(ctrl_key),
+        "no_water": lambda: client.no_water(ctrl_key, 1),
+        "report_weather": lambda: client.report_weather(
+            ctrl_key, "2023-01-01", 1, 0, 0, 20, 10, 25, 5, 3, 50, 1010
+        ),
+    }
+    results = {}
+    for name, call in calls.items():
+        # warm the pooled connection up
+        call()
+        results[name] = _summary(_timings(call, repeat))
+    client.close()
+    return results
+
+
+def _large_payload(records, data_name):
+    """Return the json body of a sensor data or events response."""
+    if data_name == "sensor_data":
+        record = {
+            "id": 0,
+            "time": "2023-01-01T00:00:00",
+            "local_date": "2023-01-01",
+            "local_time": "01:00:00",
+            "moisture": 42,
+            "sunlight": 512,
+            "celsius": 17.5,
+            "fahrenheit": 63.5,
+            "battery_level": 0.9,
+        }
+    else:
+        record = {
+            "id": 0,
+            "event": netrofunction.NETRO_EVENT_SCHEDULESTART,
+            "time": "2023-01-01T00:00:00",
+            "message": "zone 1 watering",
+        }
+    response = {
+        "status": netrofunction.NETRO_OK,
+        "meta": {"token_limit": 2000, "token_remaining": 1999},
+        "data": {data_name: [dict(record, id=i) for i in range(records)]},
+    }
+    return json.dumps(response).encode()
+
+
+def bench_parsing(records, repeat):
+    """Measure the processing of large sensor data and events responses."""
+    decoders = {"json": json.loads}
+    try:
+        import orjson  # pylint: disable=import-outside-toplevel
+
+        decoders["orjson"] = orjson.loads
+    except ImportError:
+        pass
+    results = {}
+    for data_name in ("sensor_data", "events"):
+        body = _large_payload(records, data_name)
+        for decoder_name, decoder in decoders.items():
+            netrofunction.set_json_decoder(decoder)
+            durations = _timings(
+                lambda: netrofunction._process_response(  # pylint: disable=protected-access
+                    "bench", "GET", 200, body, None
+                ),
+                repeat,
+            )
+            results[f"{data_name}/{decoder_name}"] = dict(
+                _summary(durations), records=records, bytes=len(body)
+            )
+    netrofunction.set_json_decoder()
+    return results
+
+
+def bench_streaming(records):
+    """Measure the peak memory of processing a large sensor data response at
+    once and streamed by chunks."""
+    body = _large_payload(records, "sensor_data")
+    chunk_size = netrofunction.STREAM_CHUNK_SIZE
+
+    def one_shot():
+        result = netrofunction._process_response(  # pylint: disable=protected-access
+            "bench", "GET", 200, body, None
+        )
+        return len(result["data"]["sensor_data"])
+
+    def streamed():
+        chunks = (
+            body[position : position + chunk_size]
+            for position in range(0, len(body), chunk_size)
+        )
+        scanner = netrofunction._JsonScanner(chunks)  # pylint: disable=protected-access
+        return sum(
+            1
+            for _ in netrofunction._iter_json_records(  # pylint: disable=protected-access
+                scanner, "sensor_data", {}
+            )
+        )
+
+    results = {"records": records, "bytes": len(body)}
+    for name, function in (("one_shot", one_shot), ("stream", streamed)):
+        tracemalloc.start()
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results[name] = {
+            "seconds": round(elapsed, 3),
+            "peak_kib": round(peak / 1024, 1),
+        }
+    return results
+
+
+def bench_fleet(devices, latency):
+    """Measure the polling of a fleet serially and concurrently."""
+    simulator = netrosimulator.NetroSimulator(
+        latency=netrosimulator.constant_latency(latency)
+    )
+    url = simulator.start()
+    keys = [simulator.add_controller() for _ in range(devices)]
+    results = {"devices": devices, "latency_s": latency}
+    with netrofunction.NetroClient(base_url=url, pool_maxsize=32) as client:
+        start = time.perf_counter()
+        for key in keys:
+            client.get_info(key)
+        elapsed = time.perf_counter() - start
+        results["serial"] = {
+            "seconds": round(elapsed, 3),
+            "rps": round(devices / elapsed, 1),
+        }
+        for workers in (8, 32):
+            with netrofunction.Fleet(client, max_workers=workers) as fleet:
+                start = time.perf_counter()
+                errors = sum(
+                    1
+                    for outcome in fleet.iter("info", keys)
+                    if outcome.error is not None
+                )
+                elapsed = time.perf_counter() - start
+            results[f"fleet_{workers}"] = {
+                "seconds": round(elapsed, 3),
+                "rps": round(devices / elapsed, 1),
+                "errors": errors,
+            }
+    simulator.stop()
+    return results
+
+
+def bench_memory(simulator, days):
+    """Measure the peak memory of fetching a long sensor history."""
+    sens_key = simulator.add_sensor()
+    client = netrofunction.NetroClient(base_url=simulator.url)
+    start_date = time.strftime("%Y-%m-%d", time.gmtime(time.time() - days * 86400))
+
+    def one_shot():
+        return len(client.get_sensor_data(sens_key, start_date)["data"]["sensor_data"])
+
+    def chunked():
+        return sum(1 for _ in client.iter_sensor_data(sens_key, start_date))
+
+    results = {"days": days}
+    for name, function in (
+        ("get_sensor_data", one_shot),
+        ("iter_sensor_data", chunked),
+    ):
+        tracemalloc.start()
+        start = time.perf_counter()
+        records = function()
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results[name] = {
+            "records": records,
+            "seconds": round(elapsed, 3),
+            "peak_kib": round(peak / 1024, 1),
+        }
+    client.close()
+    return results
+
+
+def main(argv):
+    """main program"""
+    parser = argparse.ArgumentParser(description="netrofunction benchmarks")
+    parser.add_argument("--quick", action="store_true", help="fewer iterations")
+    parser.add_argument("--output", help="json file of the results")
+    args = parser.parse_args(argv)
+    repeat = 50 if args.quick else 500
+    results = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "json_decoder": getattr(netrofunction.json_decoder, "__module__", None),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime()),
+    }
+    # the endpoints are called repeat times on the same devices, far beyond
+    # the NPA daily token limit
+    with netrosimulator.NetroSimulator(token_limit=1_000_000) as simulator:
+        results["endpoints"] = bench_endpoints(simulator, repeat)
+        results["memory"] = bench_memory(simulator, 30 if args.quick else 365)
+    results["parsing"] = bench_parsing(5000 if args.quick else 50000, repeat // 10)
+    results["streaming"] = bench_streaming(5000 if args.quick else 50000)
+    results["fleet"] = bench_fleet(50 if args.quick else 300, 0.02)
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,19 @@
+"""
+pytest configuration of the netrofunction tests
+"""
+
+import pytest
+
+import netrosimulator
+
+# client programs run against the live NPA, with the keys of real devices
+collect_ignore = ["test_netrofunction.py", "test_interactive.py"]
+
+
+@pytest.fixture(name="simulator")
+def fixture_simulator():
+    """Return a simulator, served in-memory unless started, stopped after
+    the test."""
+    simulator = netrosimulator.NetroSimulator()
+    yield simulator
+    simulator.stop()
@@ -6,15 +6,99 @@ Please refer to http://www.netrohome.com/en/shop/articles/10 for further
 details
 """
 
-# requests module providing http request API that is fully used
-# in this module
+import bisect
+import codecs
+import collections
+import concurrent.futures
+import contextlib
+import dataclasses
+import datetime
+import importlib.util
+import inspect
+import json
 import logging
-
-import requests
+import operator
+import queue
+import random
+import re
+import sqlite3
+import sys
+import threading
+import time
+import urllib.parse
 
 # requests constants
 REQUESTS_TIMEOUT = 30
 
+# size (bytes) of the chunks read from a streamed NPA response
+STREAM_CHUNK_SIZE = 65536
+
+# default transport of a NetroClient and of an AsyncNetroClient
+TRANSPORT = "requests"
+ASYNC_TRANSPORT = "aiohttp"
+
+# default http connection pool of a NetroClient
+POOL_CONNECTIONS = 10
+POOL_MAXSIZE = 10
+POOL_MAX_RETRIES = 0
+
+# default aiohttp connection pool of an AsyncNetroClient
+ASYNC_POOL_LIMIT = 100
+ASYNC_POOL_LIMIT_PER_HOST = 100
+
+# default token bucket of a RateLimiter
+RATE_LIMIT_BURST = 5
+RATE_LIMIT_WRITE_RESERVE = 20
+RATE_LIMIT_MAX_WAIT = 60
+
+# default time to live (seconds) of the read responses kept by a ResponseCache
+CACHE_TTLS = {
+    "info.json": 60,
+    "schedules.json": 300,
+    "moistures.json": 300,
+}
+CACHE_MAXSIZE = 256
+
+# default RetryPolicy and CircuitBreaker
+RETRY_MAX_ATTEMPTS = 3
+RETRY_BACKOFF = 0.5
+RETRY_MAX_BACKOFF = 10
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_RESET_TIMEOUT = 60
+
+# number of recent days (today included) a HistoryStore always fetches again
+HISTORY_OPEN_DAYS = 2
+
+# default number of days fetched per request by the iter_* functions
+ITER_CHUNK_DAYS = 7
+
+# default number of concurrent requests of a Fleet
+FLEET_MAX_WORKERS = 16
+
+# default time (seconds) a CommandBatcher waits for commands to merge
+BATCH_WINDOW = 0.2
+
+# default refresh period targets (seconds) of the read endpoints of a
+# controller planned by a RefreshCoordinator, and time (seconds) over which
+# its first refreshes are staggered
+REFRESH_TARGETS = {
+    "info.json": 300,
+    "schedules.json": 1800,
+    "moistures.json": 3600,
+}
+REFRESH_STAGGER = 60
+
+# default polling of an EventWatcher: shortest and longest interval (seconds),
+# time (seconds) before a schedule start from which the shortest one is used
+# and time (seconds) the schedules of a key are kept before being fetched again
+WATCH_MIN_INTERVAL = 60
+WATCH_MAX_INTERVAL = 1800
+WATCH_SCHEDULE_LEAD = 300
+WATCH_SCHEDULE_REFRESH = 21600
+
+# default latency histogram buckets (seconds) of a MetricsRegistry
+METRICS_LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
 # configure logging very simply, only one specific logger and a null handler
 # in order to prevent the logged events in this library being output to
 # sys.stderr in the absence of logging configuration
@@ -57,6 +141,9 @@ NETRO_ERROR_CODE_INVALID_DEVICE_OR_SENSOR = 4
 NETRO_ERROR_CODE_INTERNAL_ERROR = 5
 NETRO_ERROR_CODE_PARAMETER_ERROR = 6
 
+# number of tokens granted per key and per day by the NPA
+NETRO_DAILY_TOKEN_LIMIT = 2000
+
 
 def set_netro_base_url(url: str):
     """Change the Netro Public API url."""
@@ -71,6 +158,7 @@ class NetroException(Exception):
         """Make an exception from any result error code and message."""
         self.message = result["errors"][0]["message"]
         self.code = result["errors"][0]["code"]
+        self.meta = result.get("meta")
 
     def __str__(self):
         """Return a literal error message related to the current exception."""
@@ -79,92 +167,565 @@ class NetroException(Exception):
         )
 
 
-def get_info(key):
-    """Get basic information of the device."""
-    payload = {"key": key}
-    res = requests.get(
-        netro_base_url + NETRO_GET_INFO, params=payload, timeout=REQUESTS_TIMEOUT
-    )
+class NetroRateLimitError(NetroException):
+    """NPA request refused locally as it would exceed the token budget."""
 
-    logger.info("getInfo --> url = %s", res.url)
-    logger.debug(
-        "getInfo --> GET request status code = %s, json result = %s",
-        res.status_code,
-        res.json(),
-    )
+    def __init__(self, key, message) -> None:
+        """Make an exceed limit exception for the given key."""
+        super().__init__(
+            {"errors": [{"code": NETRO_ERROR_CODE_EXCEED_LIMIT, "message": message}]}
+        )
+        self.key = key
 
-    # is there a netro error ?
-    if res.json()["status"] == NETRO_ERROR:
-        raise NetroException(res.json())
-    # is there an http error ?
-    if not res.ok:
-        res.raise_for_status()
-    # so, it seems everything is ok !
-    else:
-        return res.json()
 
+def _default_json_decoder():
+    """Return orjson.loads if orjson is installed, json.loads otherwise."""
+    try:
+        import orjson  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        return json.loads
+    return orjson.loads
 
-def set_status(key, status):
-    """Update status to online or standby."""
-    payload = {"key": key, "status": status}
-    res = requests.post(
-        netro_base_url + NETRO_POST_STATUS, data=payload, timeout=REQUESTS_TIMEOUT
-    )
 
-    logger.info("setStatus --> url = %s", res.url)
-    logger.debug("setStatus --> data = %s", payload)
-    logger.debug(
-        "setStatus --> POST request status code = %s, json result = %s",
-        res.status_code,
-        res.json(),
-    )
+# function decoding the NPA json responses (bytes -> python objects)
+json_decoder = _default_json_decoder()  # pylint: disable=invalid-name
 
-    # is there a netro error ?
-    if res.json()["status"] == NETRO_ERROR:
-        raise NetroException(res.json())
-    # is there an http error ?
-    if not res.ok:
-        res.raise_for_status()
-    # so, it seems everything is ok !
-    else:
-        return res.json()
 
+def set_json_decoder(decoder=None):
+    """Change the function decoding the NPA json responses.
+
+    The decoder is called with the raw response body (bytes) and must return
+    the python objects; the default one is restored if `decoder` is None.
+    """
+    global json_decoder  # pylint: disable=global-statement,invalid-name
+    json_decoder = decoder if decoder is not None else _default_json_decoder()
 
-def get_schedules(key, zone_ids=None, start_date="", end_date=""):
-    """Get schedules of the given zones (all zones if not specified).
-    yyyy-mm-dd is the date format."""
-    payload = {"key": key}
-    if zone_ids is not None:
-        payload["zones"] = f'[{",".join(zone_ids)}]'
-    if start_date:
-        payload["start_date"] = start_date
-    if end_date:
-        payload["end_date"] = end_date
-    res = requests.get(
-        netro_base_url + NETRO_GET_SCHEDULES, params=payload, timeout=REQUESTS_TIMEOUT
-    )
 
-    logger.info("getSchedules --> url = %s", res.url)
+def _process_response(name, method, status_code, content, raise_for_status):
+    """Decode the NPA response once, check it and return its json result.
+
+    `raise_for_status` is the http client callback raising its own http error.
+    """
+    try:
+        result = json_decoder(content)
+    except ValueError:
+        # not a NPA response, the http error if any is more meaningful
+        if status_code >= 400:
+            raise_for_status()
+        raise
     logger.debug(
-        "getSchedules --> GET request status code = %s, json result = %s",
-        res.status_code,
-        res.json(),
+        "%s --> %s request status code = %s, json result = %s",
+        name,
+        method,
+        status_code,
+        result,
     )
 
     # is there a netro error ?
-    if res.json()["status"] == NETRO_ERROR:
-        raise NetroException(res.json())
-    # is there an http error ?
-    if not res.ok:
-        res.raise_for_status()
+    npa_status = result.get("status") if isinstance(result, dict) else None
+    if npa_status == NETRO_ERROR:
+        raise NetroException(result)
+    # is there an http error ? (a gateway may answer a json body of its own)
+    if status_code >= 400:
+        raise_for_status()
+    if npa_status is None:
+        raise ValueError(f"{name} --> not a NPA response")
     # so, it seems everything is ok !
-    else:
-        return res.json()
+    return result
 
 
-def get_moistures(key, zone_ids=None, start_date="", end_date=""):
-    """Get moisture data of the given zones (all zones if not specified).
-    yyyy-mm-dd is the date format."""
+def _npa_datetime(value):
+    """Return the aware datetime of a NPA (UTC) timestamp, None if empty."""
+    if not value:
+        return None
+    timestamp = datetime.datetime.fromisoformat(value)
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=datetime.timezone.utc)
+    return timestamp
+
+
+def _npa_date(value):
+    """Return the date of a NPA yyyy-mm-dd date, None if empty."""
+    return datetime.date.fromisoformat(value) if value else None
+
+
+def _npa_time(value):
+    """Return the time of a NPA hh:mm:ss local time, None if empty."""
+    return datetime.time.fromisoformat(value) if value else None
+
+
+def _npa_str(value):
+    """Return the interned string of a NPA enumerated value."""
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class Zone:
+    """Zone of a Netro controller."""
+
+    ith: int
+    name: str
+    enabled: bool
+    smart: str
+
+    @classmethod
+    def from_npa(cls, data):
+        """Make a zone from its NPA json data."""
+        return cls(data["ith"], data["name"], data["enabled"], _npa_str(data["smart"]))
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class Device:  # pylint: disable=too-many-instance-attributes
+    """Netro controller."""
+
+    serial: str
+    name: str
+    status: str
+    version: str | None
+    sw_version: str | None
+    last_active: datetime.datetime | None
+    zone_num: int | None
+    zones: tuple[Zone, ...]
+    battery_level: float | None = None
+
+    @classmethod
+    def from_npa(cls, data):
+        """Make a controller from its NPA json data."""
+        return cls(
+            data["serial"],
+            data["name"],
+            _npa_str(data["status"]),
+            data.get("version"),
+            data.get("sw_version"),
+            _npa_datetime(data.get("last_active")),
+            data.get("zone_num"),
+            tuple(Zone.from_npa(zone) for zone in data.get("zones", ())),
+            data.get("battery_level"),
+        )
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class Sensor:
+    """Netro soil sensor."""
+
+    serial: str
+    name: str
+    status: str
+    version: str | None
+    sw_version: str | None
+    last_active: datetime.datetime | None
+    battery_level: float | None = None
+
+    @classmethod
+    def from_npa(cls, data):
+        """Make a sensor from its NPA json data."""
+        return cls(
+            data["serial"],
+            data["name"],
+            _npa_str(data["status"]),
+            data.get("version"),
+            data.get("sw_version"),
+            _npa_datetime(data.get("last_active")),
+            data.get("battery_level"),
+        )
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class Schedule:  # pylint: disable=too-many-instance-attributes
+    """Watering schedule of a zone, times are UTC and local times."""
+
+    id: int  # pylint: disable=invalid-name
+    zone: int
+    source: str
+    status: str
+    start_time: datetime.datetime
+    end_time: datetime.datetime | None
+    local_date: datetime.date | None
+    local_start_time: datetime.time | None
+    local_end_time: datetime.time | None
+
+    @classmethod
+    def from_npa(cls, data):
+        """Make a schedule from its NPA json data."""
+        return cls(
+            data["id"],
+            data["zone"],
+            _npa_str(data.get("source")),
+            _npa_str(data["status"]),
+            _npa_datetime(data["start_time"]),
+            _npa_datetime(data.get("end_time")),
+            _npa_date(data.get("local_date")),
+            _npa_time(data.get("local_start_time")),
+            _npa_time(data.get("local_end_time")),
+        )
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class Moisture:
+    """Daily moisture of a zone."""
+
+    id: int  # pylint: disable=invalid-name
+    zone: int
+    date: datetime.date
+    moisture: int
+
+    @classmethod
+    def from_npa(cls, data):
+        """Make a moisture from its NPA json data."""
+        return cls(data["id"], data["zone"], _npa_date(data["date"]), data["moisture"])
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class SensorReading:  # pylint: disable=too-many-instance-attributes
+    """Soil sensor reading, time is UTC."""
+
+    id: int  # pylint: disable=invalid-name
+    time: datetime.datetime
+    local_date: datetime.date | None
+    local_time: datetime.time | None
+    moisture: float | None
+    sunlight: float | None
+    celsius: float | None
+    fahrenheit: float | None
+    battery_level: float | None
+
+    @classmethod
+    def from_npa(cls, data):
+        """Make a sensor reading from its NPA json data."""
+        return cls(
+            data["id"],
+            _npa_datetime(data["time"]),
+            _npa_date(data.get("local_date")),
+            _npa_time(data.get("local_time")),
+            data.get("moisture"),
+            data.get("sunlight"),
+            data.get("celsius"),
+            data.get("fahrenheit"),
+            data.get("battery_level"),
+        )
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class Event:
+    """Device event, time is UTC."""
+
+    id: int  # pylint: disable=invalid-name
+    event: int
+    time: datetime.datetime
+    message: str
+
+    @classmethod
+    def from_npa(cls, data):
+        """Make an event from its NPA json data."""
+        return cls(
+            data["id"], data["event"], _npa_datetime(data["time"]), data.get("message")
+        )
+
+
+def _typed_info(result):
+    """Return the Device or Sensor of an info result."""
+    data = result["data"]
+    if data.get("device") is not None:
+        return Device.from_npa(data["device"])
+    return Sensor.from_npa(data["sensor"])
+
+
+# model and data array of the records of each NPA read endpoint
+_TYPED_RECORDS = {
+    NETRO_GET_SCHEDULES: (Schedule, "schedules"),
+    NETRO_GET_MOISTURES: (Moisture, "moistures"),
+    NETRO_GET_SENSORDATA: (SensorReading, "sensor_data"),
+    NETRO_GET_EVENTS: (Event, "events"),
+}
+
+
+def to_typed(endpoint, result):
+    """Convert the json result of a read endpoint into models.
+
+    Return a Device or a Sensor for info and a list of Schedule, Moisture,
+    SensorReading or Event for the other read endpoints.
+    """
+    if endpoint == NETRO_GET_INFO:
+        return _typed_info(result)
+    model, data_name = _TYPED_RECORDS[endpoint]
+    return [model.from_npa(record) for record in result["data"][data_name]]
+
+
+class ScheduleIndex:
+    """Per zone index of schedules sorted by start time.
+
+    Built from get_schedules results (json or typed), it answers the last
+    executed/executing run, the next valid run and the runs in progress with
+    bisect lookups, and is updated in place when schedules are added again
+    (a schedule already indexed is replaced by its new version).
+    """
+
+    _PAST_STATUSES = frozenset((NETRO_SCHEDULE_EXECUTED, NETRO_SCHEDULE_EXECUTING))
+
+    def __init__(self, schedules=()) -> None:
+        """Create an index of the given schedules."""
+        # zone -> (sorted start times, entries), an entry being
+        # (start time, end time, status, id, schedule)
+        self._zones = {}
+        # schedule id -> zone and start time of the indexed schedule
+        self._positions = {}
+        self.update(schedules)
+
+    @staticmethod
+    def _entry(schedule):
+        """Return the index entry of a json or typed schedule."""
+        if isinstance(schedule, dict):
+            return (
+                _npa_datetime(schedule["start_time"]),
+                _npa_datetime(schedule.get("end_time")),
+                schedule["status"],
+                schedule["id"],
+                schedule,
+            )
+        return (
+            schedule.start_time,
+            schedule.end_time,
+            schedule.status,
+            schedule.id,
+            schedule,
+        )
+
+    def update(self, schedules):
+        """Index new or updated schedules (a list or a get_schedules result)."""
+        if isinstance(schedules, dict):
+            schedules = schedules["data"]["schedules"]
+        for schedule in schedules:
+            zone = schedule["zone"] if isinstance(schedule, dict) else schedule.zone
+            entry = self._entry(schedule)
+            self._remove(entry[3])
+            starts, entries = self._zones.setdefault(zone, ([], []))
+            position = bisect.bisect_right(starts, entry[0])
+            starts.insert(position, entry[0])
+            entries.insert(position, entry)
+            self._positions[entry[3]] = (zone, entry[0])
+
+    def _remove(self, schedule_id):
+        """Remove the schedule of the given id if indexed."""
+        zone, start_time = self._positions.pop(schedule_id, (None, None))
+        if zone is None:
+            return
+        starts, entries = self._zones[zone]
+        position = bisect.bisect_left(starts, start_time)
+        while entries[position][3] != schedule_id:
+            position += 1
+        del starts[position]
+        del entries[position]
+
+    def zones(self):
+        """Return the zones having schedules."""
+        return sorted(self._zones)
+
+    def schedules(self, zone):
+        """Return the schedules of the zone sorted by start time."""
+        return [entry[4] for entry in self._zones.get(zone, ((), ()))[1]]
+
+    @staticmethod
+    def _now(now):
+        """Return the given time, or the current UTC time."""
+        return now if now is not None else datetime.datetime.now(datetime.timezone.utc)
+
+    def last_run(self, zone, now=None):
+        """Return the last executed/executing run of the zone, None if any."""
+        starts, entries = self._zones.get(zone, ((), ()))
+        for position in range(bisect.bisect_right(starts, self._now(now)) - 1, -1, -1):
+            if entries[position][2] in self._PAST_STATUSES:
+                return entries[position][4]
+        return None
+
+    def next_run(self, zone, now=None):
+        """Return the next valid run of the zone to be executed, None if any."""
+        starts, entries = self._zones.get(zone, ((), ()))
+        for position in range(bisect.bisect_right(starts, self._now(now)), len(starts)):
+            if entries[position][2] == NETRO_SCHEDULE_VALID:
+                return entries[position][4]
+        return None
+
+    def running(self, now=None):
+        """Return the run in progress of every zone watering now, by zone."""
+        now = self._now(now)
+        running = {}
+        for zone, (starts, entries) in self._zones.items():
+            position = bisect.bisect_right(starts, now) - 1
+            if position < 0:
+                continue
+            _, end_time, status, _, schedule = entries[position]
+            if status == NETRO_SCHEDULE_EXECUTING or (
+                end_time is not None and now < end_time
+            ):
+                running[zone] = schedule
+        return running
+
+
+def _import_numpy():
+    """Return the numpy module, needed by the columnar series only."""
+    import numpy  # pylint: disable=import-outside-toplevel
+
+    return numpy
+
+
+class SensorSeries:
+    """Columnar time series of soil sensor readings, backed by numpy arrays.
+
+    `time` holds UTC datetime64[s] timestamps and `moisture`, `temperature`
+    (celsius), `sunlight` and `battery_level` float64 values, NaN when not
+    reported. numpy is only needed by the applications using this class.
+    """
+
+    FIELDS = ("moisture", "temperature", "sunlight", "battery_level")
+
+    __slots__ = ("time",) + FIELDS
+
+    # NPA sensor data attribute of each field
+    _NPA_FIELDS = {
+        "moisture": "moisture",
+        "temperature": "celsius",
+        "sunlight": "sunlight",
+        "battery_level": "battery_level",
+    }
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self, time, moisture, temperature, sunlight, battery_level
+    ) -> None:
+        """Create a series from its (same length) arrays."""
+        self.time = time
+        self.moisture = moisture
+        self.temperature = temperature
+        self.sunlight = sunlight
+        self.battery_level = battery_level
+
+    @classmethod
+    def from_npa(cls, data):
+        """Make a series from a get_sensor_data result or from its records
+        (json or typed SensorReading)."""
+        np = _import_numpy()
+        if isinstance(data, dict):
+            data = data["data"]["sensor_data"]
+        records = data if isinstance(data, list) else list(data)
+        names = [cls._NPA_FIELDS[field] for field in cls.FIELDS]
+        if records and not isinstance(records[0], dict):
+            # aware UTC datetimes, made naive as numpy expects them
+            times = [record.time.replace(tzinfo=None) for record in records]
+            getters = [operator.attrgetter(name) for name in names]
+        else:
+            # NPA timestamps are UTC without offset, as numpy expects them
+            times = [record["time"] for record in records]
+            getters = [operator.methodcaller("get", name) for name in names]
+        time = np.array(times, dtype="datetime64[s]")
+        columns = [
+            np.fromiter(
+                (np.nan if value is None else value for value in map(getter, records)),
+                dtype=np.float64,
+                count=len(records),
+            )
+            for getter in getters
+        ]
+        return cls(time, *columns).sorted()
+
+    @classmethod
+    def concat(cls, series):
+        """Concatenate series (e.g. fetched by chunks) in time order."""
+        np = _import_numpy()
+        series = list(series)
+        if not series:
+            return cls.from_npa([])
+        return cls(
+            np.concatenate([item.time for item in series]),
+            *(
+                np.concatenate([getattr(item, field) for item in series])
+                for field in cls.FIELDS
+            ),
+        ).sorted()
+
+    def __len__(self):
+        """Return the number of readings."""
+        return len(self.time)
+
+    def _take(self, index):
+        """Return the series of the readings at the given indices."""
+        return SensorSeries(
+            self.time[index], *(getattr(self, field)[index] for field in self.FIELDS)
+        )
+
+    def sorted(self):
+        """Return the series in time order."""
+        np = _import_numpy()
+        return self._take(np.argsort(self.time, kind="stable"))
+
+    def between(self, start, end):
+        """Return the readings with start <= time < end (datetime64 or iso strings)."""
+        np = _import_numpy()
+        first, last = np.searchsorted(
+            self.time, [np.datetime64(start, "s"), np.datetime64(end, "s")]
+        )
+        return self._take(slice(first, last))
+
+    @staticmethod
+    def _groups(keys):
+        """Return the key and the first index of each group of sorted keys."""
+        np = _import_numpy()
+        if not len(keys):
+            return keys, np.zeros(0, dtype=np.intp)
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+        return keys[starts], starts
+
+    @staticmethod
+    def _reduce(values, starts):
+        """Return the min, max and mean (NaN ignored) of the groups of values."""
+        np = _import_numpy()
+        if not len(values):
+            return values, values, values
+        valid = ~np.isnan(values)
+        counts = np.add.reduceat(valid, starts)
+        sums = np.add.reduceat(np.where(valid, values, 0.0), starts)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means = sums / counts
+        return np.fmin.reduceat(values, starts), np.fmax.reduceat(values, starts), means
+
+    def resample(self, seconds):
+        """Return the series averaged over periods of the given length (seconds).
+
+        Each reading of the result is timestamped at the start of its period.
+        """
+        buckets = self.time - self.time.astype("int64") % seconds
+        time, starts = self._groups(buckets)
+        return SensorSeries(
+            time,
+            *(self._reduce(getattr(self, field), starts)[2] for field in self.FIELDS),
+        )
+
+    def daily(self):
+        """Return the daily (UTC) min, max and mean of every field.
+
+        The result maps "day" to the datetime64[D] days and "<field>_min",
+        "<field>_max", "<field>_mean" to the daily statistics.
+        """
+        days, starts = self._groups(self.time.astype("datetime64[D]"))
+        stats = {"day": days}
+        for field in self.FIELDS:
+            minimum, maximum, mean = self._reduce(getattr(self, field), starts)
+            stats[f"{field}_min"] = minimum
+            stats[f"{field}_max"] = maximum
+            stats[f"{field}_mean"] = mean
+        return stats
+
+
+def _info_payload(key):
+    """Build the parameters of an info request."""
+    return {"key": key}
+
+
+def _status_payload(key, status):
+    """Build the parameters of a set status request."""
+    return {"key": key, "status": status}
+
+
+def _zones_period_payload(key, zone_ids, start_date, end_date):
+    """Build the parameters of a schedules or moistures request."""
     payload = {"key": key}
     if zone_ids is not None:
         payload["zones"] = f'[{",".join(zone_ids)}]'
@@ -172,29 +733,10 @@ def get_moistures(key, zone_ids=None, start_date="", end_date=""):
         payload["start_date"] = start_date
     if end_date:
         payload["end_date"] = end_date
-    res = requests.get(
-        netro_base_url + NETRO_GET_MOISTURES, params=payload, timeout=REQUESTS_TIMEOUT
-    )
-
-    logger.info("getMoistures --> url = %s", res.url)
-    logger.debug(
-        "getMoistures --> GET request status code = %s, json result = %s",
-        res.status_code,
-        res.json(),
-    )
-
-    # is there a netro error ?
-    if res.json()["status"] == NETRO_ERROR:
-        raise NetroException(res.json())
-    # is there an http error ?
-    if not res.ok:
-        res.raise_for_status()
-    # so, it seems everything is ok !
-    else:
-        return res.json()
+    return payload
 
 
-def report_weather(
+def _weather_payload(
     key,
     date,
     condition,
@@ -208,7 +750,7 @@ def report_weather(
     humidity,
     pressure,
 ):
-    """Report weather."""
+    """Build the parameters of a report weather request."""
     payload = {"key": key, "date": date}
     if condition:
         payload["condition"] = condition
@@ -230,61 +772,19 @@ def report_weather(
         payload["humidity"] = humidity
     if pressure:
         payload["pressure"] = pressure
-    res = requests.post(
-        netro_base_url + NETRO_POST_REPORTWEATHER,
-        data=payload,
-        timeout=REQUESTS_TIMEOUT,
-    )
-
-    logger.info("reportWeather --> url = %s", res.url)
-    logger.debug("reportWeather --> data = %s", payload)
-    logger.debug(
-        "reportWeather --> POST request status code = %s, json result = %s",
-        res.status_code,
-        res.json(),
-    )
-
-    # is there a netro error ?
-    if res.json()["status"] == NETRO_ERROR:
-        raise NetroException(res.json())
-    # is there an http error ?
-    if not res.ok:
-        res.raise_for_status()
-    # so, it seems everything is ok !
-    else:
-        return res.json()
+    return payload
 
 
-def set_moisture(key, moisture, zone_ids=None):
-    """Set moisture to the given zones (all zones if not specified)."""
+def _moisture_payload(key, moisture, zone_ids):
+    """Build the parameters of a set moisture request."""
     payload = {"key": key, "moisture": moisture}
     if zone_ids is not None:
         payload["zones"] = f'[{",".join(zone_ids)}]'
-    res = requests.post(
-        netro_base_url + NETRO_POST_MOISTURE, data=payload, timeout=REQUESTS_TIMEOUT
-    )
-
-    logger.info("setMoisture --> url = %s", res.url)
-    logger.debug("setMoisture --> data = %s", payload)
-    logger.debug(
-        "setMoisture --> POST request status code = %s, json result = %s",
-        res.status_code,
-        res.json(),
-    )
-
-    # is there a netro error ?
-    if res.json()["status"] == NETRO_ERROR:
-        raise NetroException(res.json())
-    # is there an http error ?
-    if not res.ok:
-        res.raise_for_status()
-    # so, it seems everything is ok !
-    else:
-        return res.json()
+    return payload
 
 
-def water(key, duration, zone_ids=None, delay=0, start_time=""):
-    """Start watering of the given zones (all zones consecutively if not specified)."""
+def _water_payload(key, duration, zone_ids, delay, start_time):
+    """Build the parameters of a water request."""
     payload = {"key": key, "duration": duration}
     if zone_ids is not None:
         payload["zones"] = f'[{",".join(zone_ids)}]'
@@ -292,115 +792,34 @@ def water(key, duration, zone_ids=None, delay=0, start_time=""):
         payload["delay"] = delay
     if start_time:
         payload["start_time"] = start_time
-    res = requests.post(
-        netro_base_url + NETRO_POST_WATER, data=payload, timeout=REQUESTS_TIMEOUT
-    )
+    return payload
 
-    logger.info("water --> url = %s", res.url)
-    logger.debug("water --> data = %s", payload)
-    logger.debug(
-        "water --> POST request status code = %s, json result = %s",
-        res.status_code,
-        res.json(),
-    )
-
-    # is there a netro error ?
-    if res.json()["status"] == NETRO_ERROR:
-        raise NetroException(res.json())
-    # is there an http error ?
-    if not res.ok:
-        res.raise_for_status()
-    # so, it seems everything is ok !
-    else:
-        return res.json()
-
-
-def stop_water(key):
-    """Stop watering (all currently watering zones)."""
-    payload = {"key": key}
-    res = requests.post(
-        netro_base_url + NETRO_POST_STOPWATER, data=payload, timeout=REQUESTS_TIMEOUT
-    )
 
-    logger.info("stopWater --> url = %s", res.url)
-    logger.debug("stopWater --> data = %s", payload)
-    logger.debug(
-        "stopWater --> POST request status code = %s, json result = %s",
-        res.status_code,
-        res.json(),
-    )
-
-    # is there a netro error ?
-    if res.json()["status"] == NETRO_ERROR:
-        raise NetroException(res.json())
-    # is there an http error ?
-    if not res.ok:
-        res.raise_for_status()
-    # so, it seems everything is ok !
-    else:
-        return res.json()
+def _stop_water_payload(key):
+    """Build the parameters of a stop water request."""
+    return {"key": key}
 
 
-def no_water(key, days=None):
-    """Do not water for several days (one day if not specified)."""
+def _no_water_payload(key, days):
+    """Build the parameters of a no water request."""
     payload = {"key": key}
     if days is not None:
         payload["days"] = round(days)
-
-    res = requests.post(
-        netro_base_url + NETRO_POST_NOWATER, data=payload, timeout=REQUESTS_TIMEOUT
-    )
-
-    logger.info("noWater --> url = %s", res.url)
-    logger.debug("noWater --> data = %s", payload)
-    logger.debug(
-        "noWater --> POST request status code = %s, json result = %s",
-        res.status_code,
-        res.json(),
-    )
-
-    # is there a netro error ?
-    if res.json()["status"] == NETRO_ERROR:
-        raise NetroException(res.json())
-    # is there an http error ?
-    if not res.ok:
-        res.raise_for_status()
-    # so, it seems everything is ok !
-    else:
-        return res.json()
+    return payload
 
 
-def get_sensor_data(key, start_date="", end_date=""):
-    """Get sensor data. yyyy-mm-dd is the date format."""
+def _sensor_data_payload(key, start_date, end_date):
+    """Build the parameters of a sensor data request."""
     payload = {"key": key}
     if start_date:
         payload["start_date"] = start_date
     if end_date:
         payload["end_date"] = end_date
-    res = requests.get(
-        netro_base_url + NETRO_GET_SENSORDATA, params=payload, timeout=REQUESTS_TIMEOUT
-    )
-
-    logger.info("getSensorData --> url = %s", res.url)
-    logger.debug(
-        "getSensorData --> GET request status code = %s, json result = %s",
-        res.status_code,
-        res.json(),
-    )
-
-    # is there a netro error ?
-    if res.json()["status"] == NETRO_ERROR:
-        raise NetroException(res.json())
-    # is there an http error ?
-    if not res.ok:
-        res.raise_for_status()
-    # so, it seems everything is ok !
-    else:
-        return res.json()
+    return payload
 
 
-def get_events(key, type_of_event=0, start_date="", end_date=""):
-    """Get events (return all types of events if not specified). yyyy-mm-dd is the date format."""
+def _events_payload(key, type_of_event, start_date, end_date):
+    """Build the parameters of an events request."""
     payload = {"key": key}
     if type_of_event > 0:
         payload["event"] = type_of_event
@@ -408,23 +827,3834 @@ def get_events(key, type_of_event=0, start_date="", end_date=""):
         payload["start_date"] = start_date
     if end_date:
         payload["end_date"] = end_date
-    res = requests.get(
-        netro_base_url + NETRO_GET_EVENTS, params=payload, timeout=REQUESTS_TIMEOUT
-    )
+    return payload
 
-    logger.info("getEvents --> url = %s", res.url)
-    logger.debug(
-        "getEvents --> GET request status code = %s, json result = %s",
-        res.status_code,
-        res.json(),
-    )
 
-    # is there a netro error ?
-    if res.json()["status"] == NETRO_ERROR:
-        raise NetroException(res.json())
-    # is there an http error ?
-    if not res.ok:
-        res.raise_for_status()
-    # so, it seems everything is ok !
-    else:
-        return res.json()
+def _to_date(value):
+    """Return the date of a yyyy-mm-dd string (or of a date)."""
+    if isinstance(value, datetime.date):
+        return value
+    return datetime.date.fromisoformat(value)
+
+
+def _parse_npa_time(value):
+    """Return the epoch time of a NPA (UTC) timestamp, None if not parsable."""
+    try:
+        timestamp = datetime.datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=datetime.timezone.utc)
+    return timestamp.timestamp()
+
+
+def _next_utc_midnight(now):
+    """Return the epoch time of the next UTC midnight, when NPA tokens reset."""
+    return (now // 86400 + 1) * 86400
+
+
+class _KeyBudget:  # pylint: disable=too-few-public-methods
+    """Token budget of one key, as last reported by the NPA."""
+
+    __slots__ = ("limit", "remaining", "reset_at", "tokens", "refilled_at", "used")
+
+    def __init__(self, limit, now, burst) -> None:
+        """Create the budget of a key not seen yet."""
+        self.limit = limit
+        self.remaining = None
+        self.reset_at = _next_utc_midnight(now)
+        self.tokens = burst
+        self.refilled_at = now
+        # number of requests let through since the reset
+        self.used = 0
+
+
+class RateLimiter:
+    """Per key token bucket keeping the NPA calls within the daily quota.
+
+    The remaining budget of each key is taken from the `meta.token_remaining`
+    of every response and decremented locally for the requests in flight.
+    Reads are paced so that the remaining budget is spread until the daily
+    reset, allowing a burst of `burst` calls, and are refused once only
+    `write_reserve` tokens are left, keeping them for the priority endpoints
+    (`water` and `stop_water` by default) which are never paced. A request is
+    refused with `NetroRateLimitError` when the budget is exhausted or when it
+    would have to wait more than `max_wait` seconds.
+    """
+
+    def __init__(
+        self,
+        daily_limit=NETRO_DAILY_TOKEN_LIMIT,
+        burst=RATE_LIMIT_BURST,
+        write_reserve=RATE_LIMIT_WRITE_RESERVE,
+        max_wait=RATE_LIMIT_MAX_WAIT,
+        priority_endpoints=(NETRO_POST_WATER, NETRO_POST_STOPWATER),
+    ) -> None:
+        """Create a rate limiter."""
+        self.daily_limit = daily_limit
+        self.burst = burst
+        self.write_reserve = write_reserve
+        self.max_wait = max_wait
+        self.priority_endpoints = frozenset(priority_endpoints)
+        self._budgets = {}
+        self._lock = threading.Lock()
+
+    def _budget(self, key, now):
+        """Return the budget of the key, renewed if the reset time is past."""
+        budget = self._budgets.get(key)
+        if budget is None or budget.reset_at <= now:
+            budget = self._budgets[key] = _KeyBudget(self.daily_limit, now, self.burst)
+        return budget
+
+    def remaining(self, key):
+        """Return the estimated remaining tokens of the key, None if unknown."""
+        with self._lock:
+            return self._budget(key, time.time()).remaining
+
+    def usage(self, key):
+        """Return the token limit, the estimated remaining tokens (None if
+        unknown), the number of requests let through since the reset and the
+        epoch time of the next reset of the key, as a dict."""
+        with self._lock:
+            budget = self._budget(key, time.time())
+            return {
+                "limit": budget.limit,
+                "remaining": budget.remaining,
+                "used": budget.used,
+                "reset_at": budget.reset_at,
+            }
+
+    def _reserve_budget(self, budget, key, endpoint, now):
+        """Reserve a token of the budget of a key for a request and return
+        the delay to wait before it."""
+        if budget.remaining is not None and budget.remaining <= 0:
+            raise NetroRateLimitError(
+                key, "token budget exhausted until the next daily reset"
+            )
+        if endpoint in self.priority_endpoints or budget.remaining is None:
+            # priority request, or unknown budget that the first response
+            # will tell
+            if budget.remaining is not None:
+                budget.remaining -= 1
+            budget.used += 1
+            return 0.0
+        spendable = budget.remaining - self.write_reserve
+        if spendable <= 0:
+            raise NetroRateLimitError(
+                key, "remaining tokens are reserved for priority requests"
+            )
+        # refill the bucket so that the spendable tokens last until reset
+        rate = spendable / max(budget.reset_at - now, 1.0)
+        budget.tokens = min(
+            self.burst, budget.tokens + (now - budget.refilled_at) * rate
+        )
+        budget.refilled_at = now
+        delay = (1 - budget.tokens) / rate if budget.tokens < 1 else 0.0
+        if delay > self.max_wait:
+            raise NetroRateLimitError(
+                key, f"request would have to wait {delay:.1f}s for a token"
+            )
+        budget.tokens -= 1
+        budget.remaining -= 1
+        budget.used += 1
+        return delay
+
+    def reserve(self, key, endpoint):
+        """Reserve a token for a request and return the delay to wait before it.
+
+        Raise NetroRateLimitError if the request must not be sent.
+        """
+        now = time.time()
+        with self._lock:
+            return self._reserve_budget(self._budget(key, now), key, endpoint, now)
+
+    def acquire(self, key, endpoint):
+        """Reserve a token for a request and wait until it may be sent."""
+        delay = self.reserve(key, endpoint)
+        if delay > 0:
+            time.sleep(delay)
+
+    def record(self, key, meta):
+        """Update the budget of the key from the meta data of a NPA response."""
+        if not meta or meta.get("token_remaining") is None:
+            return
+        now = time.time()
+        with self._lock:
+            self._record_budget(self._budget(key, now), meta, now)
+
+    @staticmethod
+    def _record_budget(budget, meta, now):
+        """Update the budget of a key from the meta data of a NPA response."""
+        budget.remaining = meta["token_remaining"]
+        if meta.get("token_limit"):
+            budget.limit = meta["token_limit"]
+        reset_at = _parse_npa_time(meta.get("token_reset"))
+        if reset_at is not None and reset_at > now:
+            budget.reset_at = reset_at
+
+    def record_error(self, key, exc):
+        """Update the budget of the key from a NPA error."""
+        if exc.code == NETRO_ERROR_CODE_EXCEED_LIMIT and not isinstance(
+            exc, NetroRateLimitError
+        ):
+            with self._lock:
+                self._budget(key, time.time()).remaining = 0
+
+
+class ResponseCache:
+    """In-memory LRU cache of the NPA read responses with per endpoint TTLs.
+
+    Responses are cached per endpoint and request parameters (key, zones,
+    date range) for the time to live given by `ttls`, only the endpoints
+    listed there being cached, and the least recently used entries are
+    evicted beyond `maxsize`. All the entries of a key are invalidated when a
+    write request is sent for it through a client using the cache. Cached
+    results are shared between callers and must not be modified.
+
+    Every invalidation of a key bumps its generation: a result is only put if
+    the generation read before sending its request is still the current one,
+    so that a read completing after a concurrent write is not cached.
+    """
+
+    def __init__(self, ttls=None, maxsize=CACHE_MAXSIZE) -> None:
+        """Create a cache."""
+        self.ttls = dict(CACHE_TTLS if ttls is None else ttls)
+        self.maxsize = maxsize
+        self._entries = collections.OrderedDict()
+        # invalidations of each key and of all the keys
+        self._generations = collections.Counter()
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _entry_key(endpoint, payload):
+        """Return the cache key of a request."""
+        return (payload["key"], _request_key(endpoint, payload))
+
+    def get(self, endpoint, payload):
+        """Return the cached result of a request, None if missing or expired."""
+        if endpoint not in self.ttls:
+            return None
+        entry_key = self._entry_key(endpoint, payload)
+        with self._lock:
+            entry = self._entries.get(entry_key)
+            if entry is None:
+                return None
+            expires_at, result = entry
+            if expires_at <= time.monotonic():
+                del self._entries[entry_key]
+                return None
+            self._entries.move_to_end(entry_key)
+            return result
+
+    def generation(self, key):
+        """Return the current generation of the entries of the key."""
+        with self._lock:
+            return (self._generation, self._generations[key])
+
+    def put(self, endpoint, payload, result, generation=None):
+        """Cache the result of a request if its endpoint is cached and, if
+        given, the generation of its key is still `generation`."""
+        ttl = self.ttls.get(endpoint)
+        if not ttl:
+            return
+        entry_key = self._entry_key(endpoint, payload)
+        with self._lock:
+            if generation is not None and generation != (
+                self._generation,
+                self._generations[payload["key"]],
+            ):
+                return
+            self._entries[entry_key] = (time.monotonic() + ttl, result)
+            self._entries.move_to_end(entry_key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key=None):
+        """Drop the cached results of the key (of all the keys if None)."""
+        with self._lock:
+            if key is None:
+                self._generation += 1
+                self._entries.clear()
+                return
+            self._generations[key] += 1
+            for entry_key in [k for k in self._entries if k[0] == key]:
+                del self._entries[entry_key]
+
+
+class SharedQuota(RateLimiter):
+    """RateLimiter whose budgets are shared by the processes of a host.
+
+    The budget of every key is kept in the SQLite database file `path` and
+    updated in an exclusive transaction for every request let through and
+    every response, so that the worker processes using the same file stay
+    together within the daily quota of their keys, whatever process sends
+    the requests. It is also a response cache of the get_info results,
+    shared by the processes for `info_ttl` seconds:
+
+        quota = SharedQuota("/var/tmp/netro-quota.db")
+        client = NetroClient(rate_limiter=quota, cache=quota)
+
+    A process waits up to `timeout` seconds for the transaction of another
+    one to complete.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        path,
+        daily_limit=NETRO_DAILY_TOKEN_LIMIT,
+        burst=RATE_LIMIT_BURST,
+        write_reserve=RATE_LIMIT_WRITE_RESERVE,
+        max_wait=RATE_LIMIT_MAX_WAIT,
+        priority_endpoints=(NETRO_POST_WATER, NETRO_POST_STOPWATER),
+        info_ttl=CACHE_TTLS[NETRO_GET_INFO],
+        timeout=REQUESTS_TIMEOUT,
+    ) -> None:
+        """Create a quota shared through the given SQLite database file."""
+        super().__init__(
+            daily_limit, burst, write_reserve, max_wait, priority_endpoints
+        )
+        self.info_ttl = info_ttl
+        self._db = sqlite3.connect(
+            path, timeout=timeout, isolation_level=None, check_same_thread=False
+        )
+        self._db.execute("PRAGMA journal_mode=WAL")
+        with self._transaction():
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS budgets "
+                "(key TEXT PRIMARY KEY, token_limit INTEGER, remaining INTEGER, "
+                "reset_at REAL, tokens REAL, refilled_at REAL, used INTEGER)"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS info_snapshots "
+                "(key TEXT PRIMARY KEY, time REAL, result TEXT)"
+            )
+            # invalidations of each key, "" standing for all the keys
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS generations "
+                "(key TEXT PRIMARY KEY, generation INTEGER)"
+            )
+
+    def close(self):
+        """Close the database."""
+        self._db.close()
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        """Run a block in an exclusive transaction of the database."""
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+
+    def _budget(self, key, now):
+        """Return the stored budget of the key, renewed if the reset time is
+        past."""
+        budget = _KeyBudget(self.daily_limit, now, self.burst)
+        row = self._db.execute(
+            "SELECT token_limit, remaining, reset_at, tokens, refilled_at, used "
+            "FROM budgets WHERE key = ?",
+            (key,),
+        ).fetchone()
+        if row is not None and row[2] > now:
+            (
+                budget.limit,
+                budget.remaining,
+                budget.reset_at,
+                budget.tokens,
+                budget.refilled_at,
+                budget.used,
+            ) = row
+        return budget
+
+    def _store(self, key, budget):
+        """Store the budget of the key."""
+        self._db.execute(
+            "INSERT OR REPLACE INTO budgets VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                key,
+                budget.limit,
+                budget.remaining,
+                budget.reset_at,
+                budget.tokens,
+                budget.refilled_at,
+                budget.used,
+            ),
+        )
+
+    def reserve(self, key, endpoint):
+        """Reserve a token for a request and return the delay to wait before it.
+
+        Raise NetroRateLimitError if the request must not be sent.
+        """
+        now = time.time()
+        with self._transaction():
+            budget = self._budget(key, now)
+            delay = self._reserve_budget(budget, key, endpoint, now)
+            self._store(key, budget)
+        return delay
+
+    def record(self, key, meta):
+        """Update the budget of the key from the meta data of a NPA response."""
+        if not meta or meta.get("token_remaining") is None:
+            return
+        now = time.time()
+        with self._transaction():
+            budget = self._budget(key, now)
+            self._record_budget(budget, meta, now)
+            self._store(key, budget)
+
+    def record_error(self, key, exc):
+        """Update the budget of the key from a NPA error."""
+        if exc.code == NETRO_ERROR_CODE_EXCEED_LIMIT and not isinstance(
+            exc, NetroRateLimitError
+        ):
+            now = time.time()
+            with self._transaction():
+                budget = self._budget(key, now)
+                budget.remaining = 0
+                self._store(key, budget)
+
+    def info(self, key):
+        """Return the last get_info result of the key and its epoch time,
+        (None, None) if none."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT time, result FROM info_snapshots WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None, None
+        return json.loads(row[1]), row[0]
+
+    def get(self, endpoint, payload):
+        """Return the shared get_info result of a request, None if missing or
+        expired (response cache)."""
+        if endpoint != NETRO_GET_INFO or not self.info_ttl:
+            return None
+        result, updated_at = self.info(payload["key"])
+        if result is None or updated_at + self.info_ttl <= time.time():
+            return None
+        return result
+
+    def _generation(self, key):
+        """Return the stored generation of the key."""
+        return tuple(
+            dict(
+                self._db.execute(
+                    "SELECT key, generation FROM generations WHERE key IN ('', ?)",
+                    (key,),
+                ).fetchall()
+            ).get(name, 0)
+            for name in ("", key)
+        )
+
+    def generation(self, key):
+        """Return the current generation of the shared result of the key
+        (response cache)."""
+        with self._lock:
+            return self._generation(key)
+
+    def put(self, endpoint, payload, result, generation=None):
+        """Share the result of a get_info request if, when given, the
+        generation of its key is still `generation` (response cache)."""
+        if endpoint != NETRO_GET_INFO:
+            return
+        with self._transaction():
+            if generation is not None and generation != self._generation(
+                payload["key"]
+            ):
+                return
+            self._db.execute(
+                "INSERT OR REPLACE INTO info_snapshots VALUES (?, ?, ?)",
+                (payload["key"], time.time(), json.dumps(result)),
+            )
+
+    def invalidate(self, key=None):
+        """Drop the shared get_info result of the key (of all the keys if
+        None), the device state having changed (response cache)."""
+        with self._transaction():
+            self._db.execute(
+                "INSERT INTO generations VALUES (?, 1) "
+                "ON CONFLICT (key) DO UPDATE SET generation = generation + 1",
+                ("" if key is None else key,),
+            )
+            if key is None:
+                self._db.execute("DELETE FROM info_snapshots")
+            else:
+                self._db.execute("DELETE FROM info_snapshots WHERE key = ?", (key,))
+
+
+class NetroCircuitOpenError(ConnectionError):
+    """NPA request refused locally as the circuit breaker of its host is open."""
+
+
+class NetroHTTPError(OSError):
+    """http error status of an NPA response, raised by the transports whose
+    http client has no http error of its own."""
+
+    def __init__(self, status, url) -> None:
+        """Make an http error of the given status."""
+        super().__init__(f"{status} http error for url: {url}")
+        self.status = status
+        self.url = url
+
+
+def _module_error(exc, module_name, *names):
+    """Tell whether exc is an instance of one of the named exceptions of a
+    module.
+
+    The module is not imported by this check, its exceptions can only be
+    raised once it has been imported by a transport.
+    """
+    module = sys.modules.get(module_name)
+    return module is not None and isinstance(
+        exc, tuple(getattr(module, name) for name in names)
+    )
+
+
+def _is_not_sent_error(exc):
+    """Tell whether the request failed before being sent to the NPA."""
+    if isinstance(exc, ConnectionRefusedError) or _module_error(
+        exc, "requests", "ConnectTimeout"
+    ):
+        return True
+    if _module_error(exc, "requests", "ConnectionError") and exc.args:
+        # connection not established, urllib3 reports it as the retry reason
+        reason = getattr(exc.args[0], "reason", None)
+        return _module_error(reason, "urllib3.exceptions", "NewConnectionError")
+    if _module_error(exc, "urllib3.exceptions", "MaxRetryError"):
+        exc = exc.reason
+    return (
+        _module_error(exc, "urllib3.exceptions", "ConnectTimeoutError")
+        or _module_error(exc, "httpx", "ConnectError", "ConnectTimeout")
+        or _module_error(exc, "aiohttp", "ClientConnectorError")
+    )
+
+
+def _is_transient_error(exc):
+    """Tell whether the request failed on a timeout or connection error."""
+    return (
+        isinstance(exc, TimeoutError)
+        or _module_error(exc, "requests", "Timeout", "ConnectionError")
+        or _module_error(
+            exc, "urllib3.exceptions", "TimeoutError", "ProtocolError", "MaxRetryError"
+        )
+        or _module_error(exc, "httpx", "TransportError")
+        or _module_error(exc, "aiohttp", "ClientConnectionError")
+    )
+
+
+def _http_error_status(exc):
+    """Return the http status of an http error, None for other exceptions."""
+    if isinstance(exc, NetroHTTPError):
+        return exc.status
+    if _module_error(exc, "requests", "HTTPError") and exc.response is not None:
+        return exc.response.status_code
+    if _module_error(exc, "httpx", "HTTPStatusError"):
+        return exc.response.status_code
+    if _module_error(exc, "aiohttp", "ClientResponseError"):
+        return exc.status
+    return None
+
+
+def _is_outage(exc):
+    """Tell whether a failed request reveals an NPA outage."""
+    if isinstance(exc, NetroException):
+        return exc.code == NETRO_ERROR_CODE_INTERNAL_ERROR
+    status = _http_error_status(exc)
+    if status is not None:
+        return status >= 500
+    return _is_transient_error(exc)
+
+
+class RetryPolicy:
+    """Retries of the failed NPA requests, with exponential backoff and jitter.
+
+    NPA internal errors, http 5xx errors, timeouts and connection errors are
+    retried, other NPA errors (invalid key, parameter error, exceed limit...)
+    are not. Requests to `non_idempotent_endpoints` (water by default) are
+    only retried when they surely have not been sent, as the NPA could
+    otherwise apply them twice. The delay before the retry n is a random
+    value between 0 and min(max_backoff, backoff * 2 ** (n - 1)) seconds.
+    """
+
+    def __init__(
+        self,
+        max_attempts=RETRY_MAX_ATTEMPTS,
+        backoff=RETRY_BACKOFF,
+        max_backoff=RETRY_MAX_BACKOFF,
+        retryable_codes=(NETRO_ERROR_CODE_INTERNAL_ERROR,),
+        retryable_statuses=(500, 502, 503, 504),
+        non_idempotent_endpoints=(NETRO_POST_WATER,),
+    ) -> None:
+        """Create a retry policy."""
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.retryable_codes = frozenset(retryable_codes)
+        self.retryable_statuses = frozenset(retryable_statuses)
+        self.non_idempotent_endpoints = frozenset(non_idempotent_endpoints)
+
+    def is_retryable(self, endpoint, exc):
+        """Tell whether a request failed with exc may be sent again."""
+        if isinstance(exc, NetroCircuitOpenError):
+            return False
+        if _is_not_sent_error(exc):
+            return True
+        if endpoint in self.non_idempotent_endpoints:
+            return False
+        if isinstance(exc, NetroException):
+            return exc.code in self.retryable_codes
+        status = _http_error_status(exc)
+        if status is not None:
+            return status in self.retryable_statuses
+        return _is_transient_error(exc)
+
+    def retry_delay(self, endpoint, exc, attempt):
+        """Return the delay before retrying a request whose attempt failed.
+
+        Return None if the request must not be retried.
+        """
+        if attempt >= self.max_attempts or not self.is_retryable(endpoint, exc):
+            return None
+        return random.uniform(
+            0, min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+        )
+
+
+class CircuitBreaker:
+    """Per host circuit breaker failing fast during an NPA outage.
+
+    After `failure_threshold` consecutive outage failures (NPA internal
+    errors, http 5xx errors, timeouts, connection errors) to a host, the
+    circuit opens and the requests to it are refused with
+    NetroCircuitOpenError for `reset_timeout` seconds. A single trial request
+    is then let through, closing the circuit if it succeeds.
+    """
+
+    def __init__(
+        self,
+        failure_threshold=CIRCUIT_FAILURE_THRESHOLD,
+        reset_timeout=CIRCUIT_RESET_TIMEOUT,
+    ) -> None:
+        """Create a circuit breaker."""
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        # host -> [consecutive failures, opening time or None, trial pending]
+        self._circuits = collections.defaultdict(lambda: [0, None, False])
+        self._lock = threading.Lock()
+
+    def is_open(self, host):
+        """Tell whether the requests to the host are currently refused."""
+        with self._lock:
+            _, opened_at, trial = self._circuits[host]
+            return opened_at is not None and (
+                trial or time.monotonic() - opened_at < self.reset_timeout
+            )
+
+    def before_request(self, host):
+        """Raise NetroCircuitOpenError if a request to the host must not be sent.
+
+        Return True if the request is the trial of a half open circuit.
+        """
+        with self._lock:
+            circuit = self._circuits[host]
+            if circuit[1] is None:
+                return False
+            if circuit[2] or time.monotonic() - circuit[1] < self.reset_timeout:
+                raise NetroCircuitOpenError(
+                    f"circuit open for {host} after {circuit[0]} failures"
+                )
+            # half open, this request is the trial
+            circuit[2] = True
+            return True
+
+    def cancel_request(self, host):
+        """Give back the trial taken by before_request for a request that was
+        not sent after all, or whose outcome is unknown."""
+        with self._lock:
+            self._circuits[host][2] = False
+
+    def record(self, host, exc=None):
+        """Record the outcome of a request to the host (exc is None on success)."""
+        with self._lock:
+            circuit = self._circuits[host]
+            if exc is None or not _is_outage(exc):
+                circuit[:] = [0, None, False]
+                return
+            circuit[0] += 1
+            if circuit[2] or circuit[0] >= self.failure_threshold:
+                if circuit[1] is None or circuit[2]:
+                    logger.warning("circuit opened for %s after %s", host, exc)
+                circuit[1] = time.monotonic()
+                circuit[2] = False
+
+
+class _Admission:
+    """Passage of a request of a client through the circuit breaker of its
+    host and the token budget of its key.
+
+    An open circuit refuses the request before it is charged a token. Used
+    as a context manager around the sending of the request (`delay` seconds
+    later), it records a failure to the breaker and the limiter, the success
+    being recorded with succeeded(). The trial of a half open circuit is
+    given back if the request is cancelled or interrupted before its outcome
+    is known.
+    """
+
+    def __init__(self, client, endpoint, payload) -> None:
+        """Let a request through, raising NetroCircuitOpenError or
+        NetroRateLimitError if it must not be sent."""
+        self.breaker = client.circuit_breaker
+        self.limiter = client.rate_limiter
+        self.host = urllib.parse.urlsplit(client.base_url).netloc
+        self.key = payload["key"]
+        self.trial = self.breaker is not None and self.breaker.before_request(self.host)
+        self.delay = 0.0
+        self._recorded = False
+        if self.limiter is not None:
+            try:
+                self.delay = self.limiter.reserve(self.key, endpoint)
+            except BaseException:
+                self._release()
+                raise
+
+    def _release(self):
+        """Give back the trial of the request, if any."""
+        self._recorded = True
+        if self.trial:
+            self.breaker.cancel_request(self.host)
+
+    def succeeded(self, meta):
+        """Record the success of the request, whose response has the given
+        meta data."""
+        self._recorded = True
+        if self.breaker is not None:
+            self.breaker.record(self.host)
+        if self.limiter is not None:
+            self.limiter.record(self.key, meta)
+
+    def __enter__(self):
+        """Send the request within the context."""
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        """Record the failure of the request, or give back its trial if its
+        outcome is unknown."""
+        if self._recorded:
+            return
+        if not isinstance(exc, Exception):
+            self._release()
+            return
+        self._recorded = True
+        if self.breaker is not None:
+            self.breaker.record(self.host, exc)
+        if self.limiter is not None and isinstance(exc, NetroException):
+            self.limiter.record_error(self.key, exc)
+
+
+def _encode_request(method, url, payload):
+    """Return the url (with the query of a GET) and the form encoded body (of
+    a POST, None for a GET) of a request."""
+    if method == "GET":
+        return f"{url}?{urllib.parse.urlencode(payload)}", None
+    return url, urllib.parse.urlencode(payload).encode()
+
+
+def _request_key(endpoint, payload):
+    """Return a hashable identifier of a request."""
+    return (endpoint, tuple(sorted(payload.items())))
+
+
+class _SingleFlight:
+    """Calls shared by the threads asking for the same request at once."""
+
+    def __init__(self) -> None:
+        """Create a registry of the calls in flight."""
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, request_key, function):
+        """Return the result of function, or of the identical call in flight."""
+        with self._lock:
+            future = self._calls.get(request_key)
+            leader = future is None
+            if leader:
+                future = self._calls[request_key] = concurrent.futures.Future()
+        if not leader:
+            return future.result()
+        try:
+            result = function()
+        except BaseException as exc:
+            future.set_exception(exc)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[request_key]
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class RequestEvent:  # pylint: disable=too-many-instance-attributes
+    """Outcome of one attempt of an NPA request, as passed to the hooks.
+
+    `start_time` is the epoch time (nanoseconds) the request was sent at and
+    `duration` its round trip time (seconds). `status` and `size` are the
+    http status and body length (bytes) of the response, None if none was
+    received. `error_code` is the NPA error code, `error` the exception the
+    attempt failed with and `token_remaining` the remaining tokens of the key
+    reported by the NPA, if any.
+    """
+
+    name: str
+    method: str
+    endpoint: str
+    key: str
+    attempt: int
+    start_time: int
+    duration: float
+    status: int | None = None
+    size: int | None = None
+    error_code: int | None = None
+    error: Exception | None = None
+    token_remaining: int | None = None
+
+
+def _request_event(  # pylint: disable=too-many-arguments
+    name, method, endpoint, payload, attempt, start, response, result=None, exc=None
+):
+    """Make the event of a request attempt.
+
+    `start` is the (time_ns, perf_counter) pair taken when it was sent.
+    """
+    duration = time.perf_counter() - start[1]
+    meta = result.get("meta") if result is not None else getattr(exc, "meta", None)
+    return RequestEvent(
+        name,
+        method,
+        endpoint,
+        payload["key"],
+        attempt,
+        start[0],
+        duration,
+        response[0] if response is not None else _http_error_status(exc),
+        len(response[1]) if response is not None else None,
+        exc.code if isinstance(exc, NetroException) else None,
+        exc,
+        meta.get("token_remaining") if meta else None,
+    )
+
+
+def _notify(hooks, event):
+    """Pass the event of a request attempt to the hooks."""
+    for hook in hooks:
+        try:
+            hook(event)
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("request hook %r failed", hook)
+
+
+class _EndpointMetrics:  # pylint: disable=too-few-public-methods
+    """Metrics of the requests to one NPA endpoint."""
+
+    def __init__(self, buckets) -> None:
+        """Create empty metrics."""
+        self.requests = 0
+        self.retries = 0
+        self.latency_sum = 0.0
+        self.latency_counts = [0] * (buckets + 1)
+        self.size_sum = 0
+        self.statuses = collections.Counter()
+        self.error_codes = collections.Counter()
+
+
+class MetricsRegistry:
+    """Request hook aggregating the metrics of the NPA requests per endpoint.
+
+    Every request attempt is counted with its latency (histogram of the
+    given bucket upper bounds, seconds), response size, http status and NPA
+    error code; the attempts following a failed one are counted as retries.
+    The latest remaining tokens reported by the NPA are kept per key. A
+    registry may be shared by several clients and threads.
+    """
+
+    def __init__(self, buckets=METRICS_LATENCY_BUCKETS) -> None:
+        """Create an empty registry."""
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._endpoints = {}
+        self._token_remaining = {}
+
+    def __call__(self, event):
+        """Record the event of a request attempt."""
+        with self._lock:
+            metrics = self._endpoints.get(event.endpoint)
+            if metrics is None:
+                metrics = self._endpoints[event.endpoint] = _EndpointMetrics(
+                    len(self.buckets)
+                )
+            metrics.requests += 1
+            if event.attempt > 1:
+                metrics.retries += 1
+            metrics.latency_sum += event.duration
+            metrics.latency_counts[
+                bisect.bisect_left(self.buckets, event.duration)
+            ] += 1
+            if event.size is not None:
+                metrics.size_sum += event.size
+            metrics.statuses[event.status] += 1
+            if event.error_code is not None:
+                metrics.error_codes[event.error_code] += 1
+            if event.token_remaining is not None:
+                self._token_remaining[event.key] = event.token_remaining
+
+    def token_remaining(self, key):
+        """Return the latest remaining tokens reported for key, None if unknown."""
+        with self._lock:
+            return self._token_remaining.get(key)
+
+    def snapshot(self):
+        """Return the metrics recorded so far as a json serializable dict.
+
+        The latency histogram of an endpoint lists the cumulative number of
+        requests not longer than each bucket bound, the last bound being
+        "+Inf". Requests without http response have a "none" status.
+        """
+        with self._lock:
+            endpoints = {}
+            for endpoint, metrics in self._endpoints.items():
+                cumulated = 0
+                histogram = []
+                for bound, count in zip(
+                    self.buckets + ("+Inf",), metrics.latency_counts
+                ):
+                    cumulated += count
+                    histogram.append([bound, cumulated])
+                endpoints[endpoint] = {
+                    "requests": metrics.requests,
+                    "retries": metrics.retries,
+                    "latency_sum": metrics.latency_sum,
+                    "latency_histogram": histogram,
+                    "size_sum": metrics.size_sum,
+                    "statuses": {
+                        str(status).lower(): count
+                        for status, count in metrics.statuses.items()
+                    },
+                    "error_codes": {
+                        str(code): count for code, count in metrics.error_codes.items()
+                    },
+                }
+            return {
+                "endpoints": endpoints,
+                "token_remaining": dict(self._token_remaining),
+            }
+
+    def reset(self):
+        """Forget the metrics recorded so far."""
+        with self._lock:
+            self._endpoints.clear()
+            self._token_remaining.clear()
+
+
+class TracingHook:  # pylint: disable=too-few-public-methods
+    """Request hook emitting one client span per NPA request attempt.
+
+    `tracer` is an OpenTelemetry tracer, or any object with the same
+    `start_span(name, kind=..., attributes=..., start_time=...)` method whose
+    spans have `record_exception`, `set_status` and `end(end_time=...)`. The
+    tracer of the "netrofunction" instrumentation is used if not given, which
+    requires the opentelemetry-api package. The device keys are not recorded.
+    """
+
+    def __init__(self, tracer=None) -> None:
+        """Create a hook emitting the spans to tracer."""
+        try:
+            from opentelemetry import trace  # pylint: disable=import-outside-toplevel
+        except ImportError:
+            if tracer is None:
+                raise
+            self._kind = self._error_status = None
+        else:
+            if tracer is None:
+                tracer = trace.get_tracer(__name__)
+            self._kind = trace.SpanKind.CLIENT
+            self._error_status = trace.Status(trace.StatusCode.ERROR)
+        self.tracer = tracer
+
+    def __call__(self, event):
+        """Emit the span of the event of a request attempt."""
+        attributes = {
+            "http.request.method": event.method,
+            "netro.endpoint": event.endpoint,
+            "netro.attempt": event.attempt,
+        }
+        if event.status is not None:
+            attributes["http.response.status_code"] = event.status
+            attributes["http.response.body.size"] = event.size
+        if event.error_code is not None:
+            attributes["netro.error_code"] = event.error_code
+        if event.token_remaining is not None:
+            attributes["netro.token_remaining"] = event.token_remaining
+        kwargs = {"kind": self._kind} if self._kind is not None else {}
+        span = self.tracer.start_span(
+            f"NPA {event.name}",
+            attributes=attributes,
+            start_time=event.start_time,
+            **kwargs,
+        )
+        if event.error is not None:
+            span.record_exception(event.error)
+            if self._error_status is not None:
+                span.set_status(self._error_status)
+        span.end(end_time=event.start_time + int(event.duration * 1e9))
+
+
+def _date_windows(start_date, end_date, chunk_days):
+    """Split a period (end date is today if empty) in windows of chunk_days days."""
+    start = _to_date(start_date)
+    end = _to_date(end_date) if end_date else datetime.date.today()
+    windows = []
+    while start <= end:
+        window_end = min(start + datetime.timedelta(days=chunk_days - 1), end)
+        windows.append((start.isoformat(), window_end.isoformat()))
+        start = window_end + datetime.timedelta(days=1)
+    return windows
+
+
+def _iter_windows(fetch, data_name, windows, prefetch, model=None):
+    """Yield the records (as models if given) of every window, fetching the
+    next one meanwhile."""
+    if not windows:
+        return
+    if model is not None:
+        records = _iter_windows(fetch, data_name, windows, prefetch)
+        yield from (model.from_npa(record) for record in records)
+        return
+    if not prefetch:
+        for window in windows:
+            yield from fetch(*window)["data"][data_name]
+        return
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    try:
+        pending = executor.submit(fetch, *windows[0])
+        for next_window in windows[1:] + [None]:
+            records = pending.result()["data"][data_name]
+            pending = executor.submit(fetch, *next_window) if next_window else None
+            yield from records
+    finally:
+        # the consumer may stop early, the prefetched window is then dropped
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+# blanks between json tokens
+_JSON_BLANKS = re.compile(r"[ \t\n\r]*")
+
+# characters going on with a json number
+_JSON_NUMBER_PARTS = frozenset(".eE+-0123456789")
+
+
+class _JsonScanner:
+    """Incremental scanner of a json document read by chunks (bytes)."""
+
+    def __init__(self, chunks) -> None:
+        """Create a scanner reading the chunks iterable."""
+        self._chunks = iter(chunks)
+        self._text = codecs.getincrementaldecoder("utf-8")()
+        self._decoder = json.JSONDecoder()
+        self._buffer = ""
+        self._position = 0
+        self._exhausted = False
+        # number of bytes read
+        self.size = 0
+
+    def _read(self):
+        """Append the next chunk to the buffer, False if there is none."""
+        if self._exhausted:
+            return False
+        # drop what is scanned already
+        self._buffer = self._buffer[self._position :]
+        self._position = 0
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            self._exhausted = True
+            self._buffer += self._text.decode(b"", True)
+            return False
+        self.size += len(chunk)
+        self._buffer += self._text.decode(chunk)
+        return True
+
+    def peek(self):
+        """Return the next character (blanks skipped), None at the end."""
+        while True:
+            self._position = _JSON_BLANKS.match(self._buffer, self._position).end()
+            if self._position < len(self._buffer):
+                return self._buffer[self._position]
+            if not self._read():
+                return None
+
+    def expect(self, characters):
+        """Consume and return the next character, one of characters."""
+        character = self.peek()
+        if character is None or character not in characters:
+            raise ValueError(
+                f"expecting one of {characters!r} at the json document byte "
+                f"{self.size - len(self._buffer) + self._position}"
+            )
+        self._position += 1
+        return character
+
+    def value(self):
+        """Consume and return the next json value."""
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._position)
+            except json.JSONDecodeError:
+                if not self._read():
+                    raise
+                continue
+            # a number may go on in the next chunk, be it cut at its end or
+            # just after its dot or exponent ("1.", "1.5e")
+            if (
+                isinstance(value, (int, float))
+                and (
+                    end == len(self._buffer) or self._buffer[end] in _JSON_NUMBER_PARTS
+                )
+                and self._read()
+            ):
+                continue
+            self._position = end
+            return value
+
+    def members(self):
+        """Yield the member names of the object starting here, the caller
+        consuming the value of each one."""
+        self.expect("{")
+        if self.peek() == "}":
+            self._position += 1
+            return
+        while True:
+            name = self.value()
+            self.expect(":")
+            yield name
+            if self.expect(",}") == "}":
+                return
+
+    def items(self):
+        """Yield the items of the array starting here."""
+        self.expect("[")
+        if self.peek() == "]":
+            self._position += 1
+            return
+        while True:
+            yield self.value()
+            if self.expect(",]") == "]":
+                return
+
+
+def _iter_json_records(scanner, data_name, envelope):
+    """Yield the records of the data_name array of a NPA json response as
+    they are read by the scanner.
+
+    The other members of the response are decoded in envelope, which is
+    complete once the records are exhausted.
+    """
+    for name in scanner.members():
+        if name != "data" or scanner.peek() != "{":
+            envelope[name] = scanner.value()
+            continue
+        data = envelope["data"] = {}
+        for data_member in scanner.members():
+            if data_member == data_name and scanner.peek() == "[":
+                yield from scanner.items()
+            else:
+                data[data_member] = scanner.value()
+    if scanner.peek() is not None:
+        raise ValueError("extra data after the json document")
+
+
+# header of the form encoded body of the POST requests
+_FORM_HEADERS = {"Content-Type": "application/x-www-form-urlencoded"}
+
+
+class RequestsTransport:
+    """Transport sending the NPA requests with a pooled `requests.Session`.
+
+    `pool_connections` is the number of per-host pools kept alive,
+    `pool_maxsize` the number of connections kept alive per host and
+    `max_retries` the number of connection-level retries; `pool_block` makes
+    `pool_maxsize` a hard per-host limit instead of a keep-alive limit. An
+    already configured `session` may be provided instead.
+    """
+
+    def __init__(
+        self,
+        pool_connections=POOL_CONNECTIONS,
+        pool_maxsize=POOL_MAXSIZE,
+        max_retries=POOL_MAX_RETRIES,
+        pool_block=False,
+        session=None,
+    ) -> None:
+        """Create a transport, importing requests."""
+        # pylint: disable=import-outside-toplevel
+        import requests
+        import requests.adapters
+
+        if session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=pool_connections,
+                pool_maxsize=pool_maxsize,
+                max_retries=max_retries,
+                pool_block=pool_block,
+            )
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+        self.session = session
+
+    def send(self, method, url, body, timeout):
+        """Send a request and return the http status, body and
+        raise_for_status callback of its response.
+
+        `body` is the form encoded body of a POST request, None for a GET.
+        """
+        res = self.session.request(
+            method,
+            url,
+            data=body,
+            headers=_FORM_HEADERS if body is not None else None,
+            timeout=timeout,
+        )
+        return res.status_code, res.content, res.raise_for_status
+
+    @contextlib.contextmanager
+    def stream(self, method, url, body, timeout):
+        """Send a request and return the http status, body chunks iterator
+        and raise_for_status callback of its response, released on exit."""
+        with self.session.request(
+            method,
+            url,
+            data=body,
+            headers=_FORM_HEADERS if body is not None else None,
+            timeout=timeout,
+            stream=True,
+        ) as res:
+            yield res.status_code, res.iter_content(
+                STREAM_CHUNK_SIZE
+            ), res.raise_for_status
+
+    def close(self):
+        """Close the session and its pooled connections."""
+        self.session.close()
+
+
+class HttpxTransport:
+    """Transport sending the NPA requests with a pooled `httpx.Client`.
+
+    With `http2` (which requires the h2 package, see httpx[http2]; by
+    default if it is installed) the concurrent requests are multiplexed over
+    a single connection to the NPA host. `pool_maxsize` is the number of connections kept alive and, with
+    `pool_block`, the maximum number of connections; `max_retries` is the
+    number of connection retries and `pool_connections` is not used. An
+    already configured `client` may be provided instead.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        pool_connections=POOL_CONNECTIONS,
+        pool_maxsize=POOL_MAXSIZE,
+        max_retries=POOL_MAX_RETRIES,
+        pool_block=False,
+        client=None,
+        http2=None,
+    ) -> None:
+        """Create a transport, importing httpx."""
+        del pool_connections
+        import httpx  # pylint: disable=import-outside-toplevel
+
+        if http2 is None:
+            http2 = importlib.util.find_spec("h2") is not None
+        if client is None:
+            limits = httpx.Limits(
+                max_connections=pool_maxsize if pool_block else None,
+                max_keepalive_connections=pool_maxsize,
+            )
+            client = httpx.Client(
+                transport=httpx.HTTPTransport(
+                    http2=http2, limits=limits, retries=max_retries
+                )
+            )
+        self.client = client
+
+    def send(self, method, url, body, timeout):
+        """Send a request and return the http status, body and
+        raise_for_status callback of its response.
+
+        `body` is the form encoded body of a POST request, None for a GET.
+        """
+        res = self.client.request(
+            method,
+            url,
+            content=body,
+            headers=_FORM_HEADERS if body is not None else None,
+            timeout=timeout,
+        )
+        return res.status_code, res.content, res.raise_for_status
+
+    @contextlib.contextmanager
+    def stream(self, method, url, body, timeout):
+        """Send a request and return the http status, body chunks iterator
+        and raise_for_status callback of its response, released on exit."""
+        with self.client.stream(
+            method,
+            url,
+            content=body,
+            headers=_FORM_HEADERS if body is not None else None,
+            timeout=timeout,
+        ) as res:
+            yield res.status_code, res.iter_bytes(
+                STREAM_CHUNK_SIZE
+            ), res.raise_for_status
+
+    def close(self):
+        """Close the client and its pooled connections."""
+        self.client.close()
+
+
+class Urllib3Transport:
+    """Transport sending the NPA requests with a `urllib3.PoolManager`.
+
+    The pool parameters are those of RequestsTransport, the http errors are
+    raised as NetroHTTPError. An already configured `pool_manager` may be
+    provided instead.
+    """
+
+    def __init__(
+        self,
+        pool_connections=POOL_CONNECTIONS,
+        pool_maxsize=POOL_MAXSIZE,
+        max_retries=POOL_MAX_RETRIES,
+        pool_block=False,
+        pool_manager=None,
+    ) -> None:
+        """Create a transport, importing urllib3."""
+        import urllib3  # pylint: disable=import-outside-toplevel
+
+        if pool_manager is None:
+            pool_manager = urllib3.PoolManager(
+                num_pools=pool_connections,
+                maxsize=pool_maxsize,
+                block=pool_block,
+                retries=urllib3.Retry(max_retries, read=False),
+            )
+        self.pool_manager = pool_manager
+
+    def send(self, method, url, body, timeout):
+        """Send a request and return the http status, body and
+        raise_for_status callback of its response.
+
+        `body` is the form encoded body of a POST request, None for a GET.
+        """
+        res = self.pool_manager.request(
+            method,
+            url,
+            body=body,
+            headers=_FORM_HEADERS if body is not None else None,
+            timeout=timeout,
+        )
+        return res.status, res.data, _http_error_raiser(res.status, url)
+
+    @contextlib.contextmanager
+    def stream(self, method, url, body, timeout):
+        """Send a request and return the http status, body chunks iterator
+        and raise_for_status callback of its response, released on exit."""
+        res = self.pool_manager.request(
+            method,
+            url,
+            body=body,
+            headers=_FORM_HEADERS if body is not None else None,
+            timeout=timeout,
+            preload_content=False,
+        )
+        try:
+            yield res.status, res.stream(STREAM_CHUNK_SIZE), _http_error_raiser(
+                res.status, url
+            )
+        finally:
+            res.release_conn()
+
+    def close(self):
+        """Close the pooled connections."""
+        self.pool_manager.clear()
+
+
+def _http_error_raiser(status, url):
+    """Return the raise_for_status callback of a response of a transport
+    without http error of its own."""
+
+    def raise_for_status():
+        if status >= 400:
+            raise NetroHTTPError(status, url)
+
+    return raise_for_status
+
+
+class MemoryTransport:
+    """Transport answering the NPA requests in memory, for tests.
+
+    `handler` is called with the method, the url without query and the
+    parameters (str values, as decoded by an NPA server) of every request,
+    and returns the http status and the body of its response: bytes, str or
+    an object encoded in json. The requests are kept in `requests` as
+    (method, url, parameters) tuples.
+    """
+
+    def __init__(self, handler) -> None:
+        """Create a transport answering with handler."""
+        self.handler = handler
+        self.requests = []
+
+    def _decode(self, method, url, body):
+        """Return the url without query and the parameters of a request."""
+        url, _, query = url.partition("?")
+        params = dict(urllib.parse.parse_qsl(body.decode() if body else query))
+        self.requests.append((method, url, params))
+        return url, params
+
+    @staticmethod
+    def _encode(url, status, response):
+        """Return the response tuple of a handler response."""
+        if isinstance(response, str):
+            response = response.encode()
+        elif not isinstance(response, bytes):
+            response = json.dumps(response).encode()
+        return status, response, _http_error_raiser(status, url)
+
+    def send(self, method, url, body, timeout):
+        """Answer a request and return the http status, body and
+        raise_for_status callback of its response."""
+        del timeout
+        url, params = self._decode(method, url, body)
+        return self._encode(url, *self.handler(method, url, params))
+
+    @contextlib.contextmanager
+    def stream(self, method, url, body, timeout):
+        """Answer a request and return the http status, body chunks iterator
+        and raise_for_status callback of its response."""
+        status, content, raise_for_status = self.send(method, url, body, timeout)
+        yield status, (
+            content[position : position + STREAM_CHUNK_SIZE]
+            for position in range(0, len(content), STREAM_CHUNK_SIZE)
+        ), raise_for_status
+
+    def close(self):
+        """Nothing to release."""
+
+
+# transports of a NetroClient, by name
+_TRANSPORTS = {
+    "requests": RequestsTransport,
+    "httpx": HttpxTransport,
+    "urllib3": Urllib3Transport,
+}
+
+
+class NetroClient:
+    """Netro Public API client sharing one pooled keep-alive http session.
+
+    Every NPA call made through the same client reuses the connections of its
+    transport (a `requests.Session` by default), so the TCP+TLS handshake is
+    only paid once per pooled connection instead of once per call.
+    """
+
+    def __init__(
+        self,
+        base_url=None,
+        timeout=REQUESTS_TIMEOUT,
+        pool_connections=POOL_CONNECTIONS,
+        pool_maxsize=POOL_MAXSIZE,
+        max_retries=POOL_MAX_RETRIES,
+        pool_block=False,
+        session=None,
+        rate_limiter=None,
+        cache=None,
+        coalesce=False,
+        typed=False,
+        retry_policy=None,
+        circuit_breaker=None,
+        hooks=(),
+        transport=None,
+    ) -> None:
+        """Create a client.
+
+        The requests are sent by `transport`, a transport object (see
+        RequestsTransport, HttpxTransport, Urllib3Transport and
+        MemoryTransport) or the name of one ("requests", "httpx" or
+        "urllib3", TRANSPORT by default) then created with the pool
+        parameters: `pool_connections` is the number of per-host pools kept
+        alive, `pool_maxsize` the number of connections kept alive per host
+        and `max_retries` the number of connection-level retries;
+        `pool_block` makes `pool_maxsize` a hard per-host limit instead of a
+        keep-alive limit. An already configured requests `session` may be
+        provided instead. The module level `netro_base_url` is used if
+        `base_url` is not given.
+        Requests are paced and checked against the token budget of their key
+        by the optional `rate_limiter`, read responses are kept by the
+        optional `cache`. With `coalesce`, identical reads sent concurrently
+        from several threads share a single request and its outcome. With
+        `typed`, the read endpoints return models (see to_typed) instead of
+        the json results. Failed requests are retried as allowed by the
+        optional `retry_policy` and refused while the optional
+        `circuit_breaker` of the NPA host is open. Every request attempt is
+        passed as a RequestEvent to the callables of `hooks` (see
+        MetricsRegistry and TracingHook), which may be changed afterwards.
+        """
+        self._base_url = base_url
+        self.timeout = timeout
+        if session is not None:
+            transport = RequestsTransport(session=session)
+        elif transport is None or isinstance(transport, str):
+            transport = _TRANSPORTS[transport or TRANSPORT](
+                pool_connections, pool_maxsize, max_retries, pool_block
+            )
+        self.transport = transport
+        self.rate_limiter = rate_limiter
+        self.cache = cache
+        self.typed = typed
+        self.retry_policy = retry_policy
+        self.circuit_breaker = circuit_breaker
+        self.hooks = list(hooks)
+        self._single_flight = _SingleFlight() if coalesce else None
+
+    @property
+    def base_url(self) -> str:
+        """Return the NPA url used by this client."""
+        return self._base_url if self._base_url is not None else netro_base_url
+
+    @property
+    def session(self):
+        """Return the requests session of a requests transport, None otherwise."""
+        return getattr(self.transport, "session", None)
+
+    def close(self):
+        """Close the transport and its pooled connections."""
+        self.transport.close()
+
+    def __enter__(self):
+        """Use the client as a context manager."""
+        return self
+
+    def __exit__(self, *exc_info):
+        """Release the pooled connections when leaving the context."""
+        self.close()
+
+    def _get(self, name, endpoint, payload):
+        """Send a GET request to the given NPA endpoint."""
+        return self._request("GET", name, endpoint, payload)
+
+    def _post(self, name, endpoint, payload):
+        """Send a POST request to the given NPA endpoint."""
+        return self._request("POST", name, endpoint, payload)
+
+    def _request(self, method, name, endpoint, payload):
+        """Send a request, sharing the cached or in-flight identical reads."""
+        if method == "GET":
+            if self.cache is not None:
+                result = self.cache.get(endpoint, payload)
+                if result is not None:
+                    logger.debug("%s --> cached result", name)
+                    return result
+            if self._single_flight is not None:
+                return self._single_flight.do(
+                    _request_key(endpoint, payload),
+                    lambda: self._call(method, name, endpoint, payload),
+                )
+        return self._call(method, name, endpoint, payload)
+
+    def _call(self, method, name, endpoint, payload):
+        """Send a request, retried as allowed by the retry policy."""
+        cache = self.cache
+        if cache is not None and method == "GET":
+            # a concurrent write invalidating the key voids this result
+            generation = cache.generation(payload["key"])
+        attempt = 1
+        try:
+            while True:
+                try:
+                    result = self._attempt(method, name, endpoint, payload, attempt)
+                    break
+                except Exception as exc:  # pylint: disable=broad-except
+                    if self.retry_policy is None:
+                        raise
+                    delay = self.retry_policy.retry_delay(endpoint, exc, attempt)
+                    if delay is None:
+                        raise
+                    logger.warning(
+                        "%s --> attempt #%s failed (%s), retrying in %.1fs",
+                        name,
+                        attempt,
+                        exc,
+                        delay,
+                    )
+                    time.sleep(delay)
+                    attempt += 1
+        finally:
+            # the device state may have changed, whatever the outcome
+            if cache is not None and method == "POST":
+                cache.invalidate(payload["key"])
+        if cache is not None and method == "GET":
+            cache.put(endpoint, payload, result, generation)
+        return result
+
+    def _attempt(  # pylint: disable=too-many-arguments
+        self, method, name, endpoint, payload, attempt=1
+    ):
+        """Send a request within the token budget of its key and the circuit
+        breaker of the NPA host."""
+        hooks = self.hooks
+        response = None
+        with _Admission(self, endpoint, payload) as admission:
+            if admission.delay > 0:
+                time.sleep(admission.delay)
+            if hooks:
+                start = (time.time_ns(), time.perf_counter())
+            try:
+                response = self._send(method, name, endpoint, payload)
+                result = _process_response(name, method, *response)
+            except Exception as exc:
+                if hooks:
+                    event = _request_event(
+                        name,
+                        method,
+                        endpoint,
+                        payload,
+                        attempt,
+                        start,
+                        response,
+                        exc=exc,
+                    )
+                    _notify(hooks, event)
+                raise
+            admission.succeeded(result.get("meta"))
+        if hooks:
+            event = _request_event(
+                name, method, endpoint, payload, attempt, start, response, result=result
+            )
+            _notify(hooks, event)
+        return result
+
+    def _send(self, method, name, endpoint, payload):
+        """Send the http request and return the http status, body and
+        raise_for_status callback of its response."""
+        url, body = _encode_request(method, self.base_url + endpoint, payload)
+        logger.info("%s --> url = %s", name, url)
+        if body is not None:
+            logger.debug("%s --> data = %s", name, payload)
+        return self.transport.send(method, url, body, self.timeout)
+
+    def _stream(self, name, endpoint, payload):
+        """Send a GET request and yield the records of its data array as they
+        are received.
+
+        A streamed request is paced by the rate limiter, guarded by the
+        circuit breaker and passed to the hooks but it is neither cached,
+        coalesced nor retried.
+        """
+        model, data_name = _TYPED_RECORDS[endpoint]
+        hooks = self.hooks
+        url, _ = _encode_request("GET", self.base_url + endpoint, payload)
+        response = scanner = None
+        envelope = {}
+        with _Admission(self, endpoint, payload) as admission:
+            if admission.delay > 0:
+                time.sleep(admission.delay)
+            if hooks:
+                start = (time.time_ns(), time.perf_counter())
+            logger.info("%s --> url = %s (streamed)", name, url)
+            try:
+                with self.transport.stream("GET", url, None, self.timeout) as (
+                    status,
+                    chunks,
+                    raise_for_status,
+                ):
+                    response = (status, b"")
+                    if status >= 400:
+                        # an error response, small enough to be read at once
+                        response = (status, b"".join(chunks))
+                        _process_response(name, "GET", *response, raise_for_status)
+                    scanner = _JsonScanner(chunks)
+                    for record in _iter_json_records(scanner, data_name, envelope):
+                        yield model.from_npa(record) if self.typed else record
+                if envelope.get("status") == NETRO_ERROR:
+                    raise NetroException(envelope)
+            except GeneratorExit:
+                # closed by the caller before the end of the records: the
+                # host did answer
+                admission.succeeded(envelope.get("meta"))
+                raise
+            except Exception as exc:
+                if hooks:
+                    event = _request_event(
+                        name, "GET", endpoint, payload, 1, start, response, exc=exc
+                    )
+                    if scanner is not None:
+                        event = dataclasses.replace(event, size=scanner.size)
+                    _notify(hooks, event)
+                raise
+            admission.succeeded(envelope.get("meta"))
+        if hooks:
+            event = _request_event(
+                name, "GET", endpoint, payload, 1, start, response, result=envelope
+            )
+            _notify(hooks, dataclasses.replace(event, size=scanner.size))
+
+    def get_info(self, key):
+        """Get basic information of the device."""
+        result = self._get("getInfo", NETRO_GET_INFO, _info_payload(key))
+        return to_typed(NETRO_GET_INFO, result) if self.typed else result
+
+    def set_status(self, key, status):
+        """Update status to online or standby."""
+        return self._post("setStatus", NETRO_POST_STATUS, _status_payload(key, status))
+
+    def get_schedules(self, key, zone_ids=None, start_date="", end_date=""):
+        """Get schedules of the given zones (all zones if not specified).
+        yyyy-mm-dd is the date format."""
+        payload = _zones_period_payload(key, zone_ids, start_date, end_date)
+        result = self._get("getSchedules", NETRO_GET_SCHEDULES, payload)
+        return to_typed(NETRO_GET_SCHEDULES, result) if self.typed else result
+
+    def get_moistures(self, key, zone_ids=None, start_date="", end_date=""):
+        """Get moisture data of the given zones (all zones if not specified).
+        yyyy-mm-dd is the date format."""
+        payload = _zones_period_payload(key, zone_ids, start_date, end_date)
+        result = self._get("getMoistures", NETRO_GET_MOISTURES, payload)
+        return to_typed(NETRO_GET_MOISTURES, result) if self.typed else result
+
+    def report_weather(
+        self,
+        key,
+        date,
+        condition,
+        rain,
+        rain_prob,
+        temp,
+        t_min,
+        t_max,
+        t_dew,
+        wind_speed,
+        humidity,
+        pressure,
+    ):
+        """Report weather."""
+        payload = _weather_payload(
+            key,
+            date,
+            condition,
+            rain,
+            rain_prob,
+            temp,
+            t_min,
+            t_max,
+            t_dew,
+            wind_speed,
+            humidity,
+            pressure,
+        )
+        return self._post("reportWeather", NETRO_POST_REPORTWEATHER, payload)
+
+    def set_moisture(self, key, moisture, zone_ids=None):
+        """Set moisture to the given zones (all zones if not specified)."""
+        payload = _moisture_payload(key, moisture, zone_ids)
+        return self._post("setMoisture", NETRO_POST_MOISTURE, payload)
+
+    def water(self, key, duration, zone_ids=None, delay=0, start_time=""):
+        """Start watering of the given zones (all zones consecutively if not specified)."""
+        payload = _water_payload(key, duration, zone_ids, delay, start_time)
+        return self._post("water", NETRO_POST_WATER, payload)
+
+    def stop_water(self, key):
+        """Stop watering (all currently watering zones)."""
+        return self._post("stopWater", NETRO_POST_STOPWATER, _stop_water_payload(key))
+
+    def no_water(self, key, days=None):
+        """Do not water for several days (one day if not specified)."""
+        return self._post("noWater", NETRO_POST_NOWATER, _no_water_payload(key, days))
+
+    def get_sensor_data(self, key, start_date="", end_date="", stream=False):
+        """Get sensor data. yyyy-mm-dd is the date format.
+        With stream, return an iterator of the records parsed as they are
+        received instead of the whole result."""
+        payload = _sensor_data_payload(key, start_date, end_date)
+        if stream:
+            return self._stream("getSensorData", NETRO_GET_SENSORDATA, payload)
+        result = self._get("getSensorData", NETRO_GET_SENSORDATA, payload)
+        return to_typed(NETRO_GET_SENSORDATA, result) if self.typed else result
+
+    def get_events(
+        self, key, type_of_event=0, start_date="", end_date="", stream=False
+    ):
+        """Get events (return all types of events if not specified). yyyy-mm-dd is the date format.
+        With stream, return an iterator of the records parsed as they are
+        received instead of the whole result."""
+        payload = _events_payload(key, type_of_event, start_date, end_date)
+        if stream:
+            return self._stream("getEvents", NETRO_GET_EVENTS, payload)
+        result = self._get("getEvents", NETRO_GET_EVENTS, payload)
+        return to_typed(NETRO_GET_EVENTS, result) if self.typed else result
+
+    def iter_sensor_data(
+        self, key, start_date, end_date="", chunk_days=ITER_CHUNK_DAYS, prefetch=True
+    ):
+        """Yield the sensor data records of a period, fetched chunk_days at a time.
+        yyyy-mm-dd is the date format, the end date is today if not specified.
+        The next window is fetched while the records are consumed if prefetch.
+        """
+        return _iter_windows(
+            lambda start, end: self._get(
+                "getSensorData",
+                NETRO_GET_SENSORDATA,
+                _sensor_data_payload(key, start, end),
+            ),
+            "sensor_data",
+            _date_windows(start_date, end_date, chunk_days),
+            prefetch,
+            SensorReading if self.typed else None,
+        )
+
+    def iter_moistures(
+        self,
+        key,
+        start_date,
+        end_date="",
+        zone_ids=None,
+        chunk_days=ITER_CHUNK_DAYS,
+        prefetch=True,
+    ):
+        """Yield the moisture records of the given zones (all zones if not
+        specified) for a period, fetched chunk_days at a time.
+        yyyy-mm-dd is the date format, the end date is today if not specified.
+        The next window is fetched while the records are consumed if prefetch.
+        """
+        return _iter_windows(
+            lambda start, end: self._get(
+                "getMoistures",
+                NETRO_GET_MOISTURES,
+                _zones_period_payload(key, zone_ids, start, end),
+            ),
+            "moistures",
+            _date_windows(start_date, end_date, chunk_days),
+            prefetch,
+            Moisture if self.typed else None,
+        )
+
+    def iter_events(
+        self,
+        key,
+        start_date,
+        end_date="",
+        type_of_event=0,
+        chunk_days=ITER_CHUNK_DAYS,
+        prefetch=True,
+    ):
+        """Yield the events (all types of events if not specified) of a period,
+        fetched chunk_days at a time.
+        yyyy-mm-dd is the date format, the end date is today if not specified.
+        The next window is fetched while the records are consumed if prefetch.
+        """
+        return _iter_windows(
+            lambda start, end: self._get(
+                "getEvents",
+                NETRO_GET_EVENTS,
+                _events_payload(key, type_of_event, start, end),
+            ),
+            "events",
+            _date_windows(start_date, end_date, chunk_days),
+            prefetch,
+            Event if self.typed else None,
+        )
+
+
+class AiohttpTransport:
+    """asyncio transport sending the NPA requests with an aiohttp session.
+
+    `limit` is the total number of simultaneous connections of the pool and
+    `limit_per_host` the number of simultaneous connections to the NPA host.
+    aiohttp is imported when the first request is sent, so it is only needed
+    by the applications actually using this transport. An already opened
+    `aiohttp.ClientSession` may be provided instead, it is then left open by
+    `close`.
+    """
+
+    def __init__(
+        self,
+        limit=ASYNC_POOL_LIMIT,
+        limit_per_host=ASYNC_POOL_LIMIT_PER_HOST,
+        session=None,
+    ) -> None:
+        """Create a transport."""
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self._session = session
+        self._owns_session = session is None
+        self._timeouts = {}
+
+    def _get_session(self):
+        """Return the aiohttp session, opening it on first use."""
+        if self._session is None:
+            import aiohttp  # pylint: disable=import-outside-toplevel
+
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=self.limit, limit_per_host=self.limit_per_host
+                )
+            )
+        return self._session
+
+    def _timeout(self, timeout):
+        """Return the aiohttp timeout of a request."""
+        client_timeout = self._timeouts.get(timeout)
+        if client_timeout is None:
+            import aiohttp  # pylint: disable=import-outside-toplevel
+
+            client_timeout = self._timeouts[timeout] = aiohttp.ClientTimeout(
+                total=timeout
+            )
+        return client_timeout
+
+    async def send(self, method, url, body, timeout):
+        """Send a request and return the http status, body and
+        raise_for_status callback of its response.
+
+        `body` is the form encoded body of a POST request, None for a GET.
+        """
+        async with self._get_session().request(
+            method,
+            url,
+            data=body,
+            headers=_FORM_HEADERS if body is not None else None,
+            timeout=self._timeout(timeout),
+        ) as res:
+            return res.status, await res.read(), res.raise_for_status
+
+    async def close(self):
+        """Close the session and its pooled connections."""
+        if self._session is not None and self._owns_session:
+            await self._session.close()
+            self._session = None
+
+
+class AsyncHttpxTransport:
+    """asyncio transport sending the NPA requests with an `httpx.AsyncClient`.
+
+    With `http2` (which requires the h2 package, see httpx[http2]; by
+    default if it is installed) the concurrent requests are multiplexed over
+    a single connection to the NPA host. `limit` is the total number of simultaneous connections and
+    `limit_per_host` is not used. An already configured `client` may be
+    provided instead.
+    """
+
+    def __init__(
+        self,
+        limit=ASYNC_POOL_LIMIT,
+        limit_per_host=ASYNC_POOL_LIMIT_PER_HOST,
+        client=None,
+        http2=None,
+    ) -> None:
+        """Create a transport, importing httpx."""
+        del limit_per_host
+        import httpx  # pylint: disable=import-outside-toplevel
+
+        if http2 is None:
+            http2 = importlib.util.find_spec("h2") is not None
+        if client is None:
+            client = httpx.AsyncClient(
+                http2=http2,
+                limits=httpx.Limits(
+                    max_connections=limit, max_keepalive_connections=limit
+                ),
+            )
+        self.client = client
+
+    async def send(self, method, url, body, timeout):
+        """Send a request and return the http status, body and
+        raise_for_status callback of its response.
+
+        `body` is the form encoded body of a POST request, None for a GET.
+        """
+        res = await self.client.request(
+            method,
+            url,
+            content=body,
+            headers=_FORM_HEADERS if body is not None else None,
+            timeout=timeout,
+        )
+        return res.status_code, res.content, res.raise_for_status
+
+    async def close(self):
+        """Close the client and its pooled connections."""
+        await self.client.aclose()
+
+
+class AsyncMemoryTransport(MemoryTransport):
+    """asyncio transport answering the NPA requests in memory, for tests.
+
+    `handler` is called as for a MemoryTransport, its result may also be
+    awaitable.
+    """
+
+    async def send(  # pylint: disable=invalid-overridden-method
+        self, method, url, body, timeout
+    ):
+        """Answer a request and return the http status, body and
+        raise_for_status callback of its response."""
+        del timeout
+        url, params = self._decode(method, url, body)
+        response = self.handler(method, url, params)
+        if inspect.isawaitable(response):
+            response = await response
+        return self._encode(url, *response)
+
+    async def close(self):  # pylint: disable=invalid-overridden-method
+        """Nothing to release."""
+
+
+# transports of an AsyncNetroClient, by name
+_ASYNC_TRANSPORTS = {
+    "aiohttp": AiohttpTransport,
+    "httpx": AsyncHttpxTransport,
+}
+
+
+class AsyncNetroClient:
+    """asyncio Netro Public API client sharing one connection pool.
+
+    The http client of its transport (aiohttp by default) is imported by the
+    transport, so it is only needed by the applications actually using it.
+    """
+
+    def __init__(
+        self,
+        base_url=None,
+        timeout=REQUESTS_TIMEOUT,
+        limit=ASYNC_POOL_LIMIT,
+        limit_per_host=ASYNC_POOL_LIMIT_PER_HOST,
+        session=None,
+        rate_limiter=None,
+        cache=None,
+        coalesce=False,
+        typed=False,
+        retry_policy=None,
+        circuit_breaker=None,
+        hooks=(),
+        transport=None,
+    ) -> None:
+        """Create a client.
+
+        The requests are sent by `transport`, a transport object (see
+        AiohttpTransport, AsyncHttpxTransport and AsyncMemoryTransport) or
+        the name of one ("aiohttp" or "httpx", ASYNC_TRANSPORT by default)
+        then created with the pool parameters: `limit` is the total number of
+        simultaneous connections of the pool and `limit_per_host` the number
+        of simultaneous connections to the NPA host. An already opened
+        `aiohttp.ClientSession` may be provided instead, it is then left
+        open by `close`. Requests are paced and
+        checked against the token budget of their key by the optional
+        `rate_limiter`, read responses are kept by the optional `cache`. With
+        `coalesce`, identical reads awaited concurrently share a single
+        request and its outcome. With `typed`, the read endpoints return
+        models (see to_typed) instead of the json results. Failed requests
+        are retried as allowed by the optional `retry_policy` and refused
+        while the optional `circuit_breaker` of the NPA host is open. Every
+        request attempt is passed as a RequestEvent to the callables of
+        `hooks` (see MetricsRegistry and TracingHook), which may be changed
+        afterwards.
+        """
+        self._base_url = base_url
+        self.timeout = timeout
+        if session is not None:
+            transport = AiohttpTransport(session=session)
+        elif transport is None or isinstance(transport, str):
+            transport = _ASYNC_TRANSPORTS[transport or ASYNC_TRANSPORT](
+                limit, limit_per_host
+            )
+        self.transport = transport
+        self.rate_limiter = rate_limiter
+        self.cache = cache
+        self.typed = typed
+        self.retry_policy = retry_policy
+        self.circuit_breaker = circuit_breaker
+        self.hooks = list(hooks)
+        self._in_flight = {} if coalesce else None
+
+    @property
+    def base_url(self) -> str:
+        """Return the NPA url used by this client."""
+        return self._base_url if self._base_url is not None else netro_base_url
+
+    async def close(self):
+        """Close the transport and its pooled connections."""
+        await self.transport.close()
+
+    async def __aenter__(self):
+        """Use the client as an async context manager."""
+        return self
+
+    async def __aexit__(self, *exc_info):
+        """Release the pooled connections when leaving the context."""
+        await self.close()
+
+    async def _get(self, name, endpoint, payload):
+        """Send a GET request to the given NPA endpoint."""
+        return await self._request("GET", name, endpoint, payload)
+
+    async def _post(self, name, endpoint, payload):
+        """Send a POST request to the given NPA endpoint."""
+        return await self._request("POST", name, endpoint, payload)
+
+    async def _request(self, method, name, endpoint, payload):
+        """Send a request, sharing the cached or in-flight identical reads."""
+        if method == "GET":
+            if self.cache is not None:
+                result = self.cache.get(endpoint, payload)
+                if result is not None:
+                    logger.debug("%s --> cached result", name)
+                    return result
+            if self._in_flight is not None:
+                return await self._coalesced_call(method, name, endpoint, payload)
+        return await self._call(method, name, endpoint, payload)
+
+    async def _coalesced_call(self, method, name, endpoint, payload):
+        """Send a read request, or wait for the identical one in flight."""
+        import asyncio  # pylint: disable=import-outside-toplevel
+
+        request_key = _request_key(endpoint, payload)
+        task = self._in_flight.get(request_key)
+        if task is not None:
+            logger.debug("%s --> waiting for the identical request in flight", name)
+        else:
+            # a task of its own, so that the cancellation of a caller does not
+            # cancel the request for the others
+            task = self._in_flight[request_key] = asyncio.ensure_future(
+                self._call(method, name, endpoint, payload)
+            )
+
+            def done(task):
+                if self._in_flight.get(request_key) is task:
+                    del self._in_flight[request_key]
+                # the exception is raised to the callers, whether or not some
+                # still wait for it
+                if not task.cancelled():
+                    task.exception()
+
+            task.add_done_callback(done)
+        return await asyncio.shield(task)
+
+    async def _call(self, method, name, endpoint, payload):
+        """Send a request, retried as allowed by the retry policy."""
+        import asyncio  # pylint: disable=import-outside-toplevel
+
+        cache = self.cache
+        if cache is not None and method == "GET":
+            # a concurrent write invalidating the key voids this result
+            generation = cache.generation(payload["key"])
+        attempt = 1
+        try:
+            while True:
+                try:
+                    result = await self._attempt(
+                        method, name, endpoint, payload, attempt
+                    )
+                    break
+                except Exception as exc:  # pylint: disable=broad-except
+                    if self.retry_policy is None:
+                        raise
+                    delay = self.retry_policy.retry_delay(endpoint, exc, attempt)
+                    if delay is None:
+                        raise
+                    logger.warning(
+                        "%s --> attempt #%s failed (%s), retrying in %.1fs",
+                        name,
+                        attempt,
+                        exc,
+                        delay,
+                    )
+                    await asyncio.sleep(delay)
+                    attempt += 1
+        finally:
+            # the device state may have changed, whatever the outcome
+            if cache is not None and method == "POST":
+                cache.invalidate(payload["key"])
+        if cache is not None and method == "GET":
+            cache.put(endpoint, payload, result, generation)
+        return result
+
+    async def _attempt(  # pylint: disable=too-many-arguments
+        self, method, name, endpoint, payload, attempt=1
+    ):
+        """Send a request within the token budget of its key and the circuit
+        breaker of the NPA host."""
+        import asyncio  # pylint: disable=import-outside-toplevel
+
+        hooks = self.hooks
+        response = None
+        with _Admission(self, endpoint, payload) as admission:
+            if admission.delay > 0:
+                await asyncio.sleep(admission.delay)
+            if hooks:
+                start = (time.time_ns(), time.perf_counter())
+            try:
+                response = await self._send(method, name, endpoint, payload)
+                result = _process_response(name, method, *response)
+            except Exception as exc:
+                if hooks:
+                    event = _request_event(
+                        name,
+                        method,
+                        endpoint,
+                        payload,
+                        attempt,
+                        start,
+                        response,
+                        exc=exc,
+                    )
+                    _notify(hooks, event)
+                raise
+            admission.succeeded(result.get("meta"))
+        if hooks:
+            event = _request_event(
+                name, method, endpoint, payload, attempt, start, response, result=result
+            )
+            _notify(hooks, event)
+        return result
+
+    async def _send(self, method, name, endpoint, payload):
+        """Send the http request and return the http status, body and
+        raise_for_status callback of its response."""
+        url, body = _encode_request(method, self.base_url + endpoint, payload)
+        logger.info("%s --> url = %s", name, url)
+        if body is not None:
+            logger.debug("%s --> data = %s", name, payload)
+        return await self.transport.send(method, url, body, self.timeout)
+
+    async def get_info(self, key):
+        """Get basic information of the device."""
+        result = await self._get("getInfo", NETRO_GET_INFO, _info_payload(key))
+        return to_typed(NETRO_GET_INFO, result) if self.typed else result
+
+    async def set_status(self, key, status):
+        """Update status to online or standby."""
+        payload = _status_payload(key, status)
+        return await self._post("setStatus", NETRO_POST_STATUS, payload)
+
+    async def get_schedules(self, key, zone_ids=None, start_date="", end_date=""):
+        """Get schedules of the given zones (all zones if not specified).
+        yyyy-mm-dd is the date format."""
+        payload = _zones_period_payload(key, zone_ids, start_date, end_date)
+        result = await self._get("getSchedules", NETRO_GET_SCHEDULES, payload)
+        return to_typed(NETRO_GET_SCHEDULES, result) if self.typed else result
+
+    async def get_moistures(self, key, zone_ids=None, start_date="", end_date=""):
+        """Get moisture data of the given zones (all zones if not specified).
+        yyyy-mm-dd is the date format."""
+        payload = _zones_period_payload(key, zone_ids, start_date, end_date)
+        result = await self._get("getMoistures", NETRO_GET_MOISTURES, payload)
+        return to_typed(NETRO_GET_MOISTURES, result) if self.typed else result
+
+    async def report_weather(
+        self,
+        key,
+        date,
+        condition,
+        rain,
+        rain_prob,
+        temp,
+        t_min,
+        t_max,
+        t_dew,
+        wind_speed,
+        humidity,
+        pressure,
+    ):
+        """Report weather."""
+        payload = _weather_payload(
+            key,
+            date,
+            condition,
+            rain,
+            rain_prob,
+            temp,
+            t_min,
+            t_max,
+            t_dew,
+            wind_speed,
+            humidity,
+            pressure,
+        )
+        return await self._post("reportWeather", NETRO_POST_REPORTWEATHER, payload)
+
+    async def set_moisture(self, key, moisture, zone_ids=None):
+        """Set moisture to the given zones (all zones if not specified)."""
+        payload = _moisture_payload(key, moisture, zone_ids)
+        return await self._post("setMoisture", NETRO_POST_MOISTURE, payload)
+
+    async def water(self, key, duration, zone_ids=None, delay=0, start_time=""):
+        """Start watering of the given zones (all zones consecutively if not specified)."""
+        payload = _water_payload(key, duration, zone_ids, delay, start_time)
+        return await self._post("water", NETRO_POST_WATER, payload)
+
+    async def stop_water(self, key):
+        """Stop watering (all currently watering zones)."""
+        payload = _stop_water_payload(key)
+        return await self._post("stopWater", NETRO_POST_STOPWATER, payload)
+
+    async def no_water(self, key, days=None):
+        """Do not water for several days (one day if not specified)."""
+        payload = _no_water_payload(key, days)
+        return await self._post("noWater", NETRO_POST_NOWATER, payload)
+
+    async def get_sensor_data(self, key, start_date="", end_date=""):
+        """Get sensor data. yyyy-mm-dd is the date format."""
+        payload = _sensor_data_payload(key, start_date, end_date)
+        result = await self._get("getSensorData", NETRO_GET_SENSORDATA, payload)
+        return to_typed(NETRO_GET_SENSORDATA, result) if self.typed else result
+
+    async def get_events(self, key, type_of_event=0, start_date="", end_date=""):
+        """Get events (return all types of events if not specified). yyyy-mm-dd is the date format."""
+        payload = _events_payload(key, type_of_event, start_date, end_date)
+        result = await self._get("getEvents", NETRO_GET_EVENTS, payload)
+        return to_typed(NETRO_GET_EVENTS, result) if self.typed else result
+
+
+# client shared by the module level functions, created on first use
+_default_client = None  # pylint: disable=invalid-name
+_default_client_lock = threading.Lock()
+
+
+def get_default_client() -> NetroClient:
+    """Return the client used by the module level functions."""
+    global _default_client  # pylint: disable=global-statement,invalid-name
+    if _default_client is None:
+        with _default_client_lock:
+            if _default_client is None:
+                _default_client = NetroClient()
+    return _default_client
+
+
+def set_default_client(client: NetroClient):
+    """Replace the client used by the module level functions."""
+    global _default_client  # pylint: disable=global-statement,invalid-name
+    _default_client = client
+
+
+def get_info(key):
+    """Get basic information of the device."""
+    return get_default_client().get_info(key)
+
+
+def set_status(key, status):
+    """Update status to online or standby."""
+    return get_default_client().set_status(key, status)
+
+
+def get_schedules(key, zone_ids=None, start_date="", end_date=""):
+    """Get schedules of the given zones (all zones if not specified).
+    yyyy-mm-dd is the date format."""
+    return get_default_client().get_schedules(key, zone_ids, start_date, end_date)
+
+
+def get_moistures(key, zone_ids=None, start_date="", end_date=""):
+    """Get moisture data of the given zones (all zones if not specified).
+    yyyy-mm-dd is the date format."""
+    return get_default_client().get_moistures(key, zone_ids, start_date, end_date)
+
+
+def report_weather(
+    key,
+    date,
+    condition,
+    rain,
+    rain_prob,
+    temp,
+    t_min,
+    t_max,
+    t_dew,
+    wind_speed,
+    humidity,
+    pressure,
+):
+    """Report weather."""
+    return get_default_client().report_weather(
+        key,
+        date,
+        condition,
+        rain,
+        rain_prob,
+        temp,
+        t_min,
+        t_max,
+        t_dew,
+        wind_speed,
+        humidity,
+        pressure,
+    )
+
+
+def set_moisture(key, moisture, zone_ids=None):
+    """Set moisture to the given zones (all zones if not specified)."""
+    return get_default_client().set_moisture(key, moisture, zone_ids)
+
+
+def water(key, duration, zone_ids=None, delay=0, start_time=""):
+    """Start watering of the given zones (all zones consecutively if not specified)."""
+    return get_default_client().water(key, duration, zone_ids, delay, start_time)
+
+
+def stop_water(key):
+    """Stop watering (all currently watering zones)."""
+    return get_default_client().stop_water(key)
+
+
+def no_water(key, days=None):
+    """Do not water for several days (one day if not specified)."""
+    return get_default_client().no_water(key, days)
+
+
+def get_sensor_data(key, start_date="", end_date="", stream=False):
+    """Get sensor data. yyyy-mm-dd is the date format.
+    With stream, return an iterator of the records parsed as they are
+    received instead of the whole result."""
+    return get_default_client().get_sensor_data(key, start_date, end_date, stream)
+
+
+def get_events(key, type_of_event=0, start_date="", end_date="", stream=False):
+    """Get events (return all types of events if not specified). yyyy-mm-dd is the date format.
+    With stream, return an iterator of the records parsed as they are
+    received instead of the whole result."""
+    return get_default_client().get_events(
+        key, type_of_event, start_date, end_date, stream
+    )
+
+
+def iter_sensor_data(
+    key, start_date, end_date="", chunk_days=ITER_CHUNK_DAYS, prefetch=True
+):
+    """Yield the sensor data records of a period, fetched chunk_days at a time.
+    yyyy-mm-dd is the date format."""
+    return get_default_client().iter_sensor_data(
+        key, start_date, end_date, chunk_days, prefetch
+    )
+
+
+def iter_moistures(
+    key,
+    start_date,
+    end_date="",
+    zone_ids=None,
+    chunk_days=ITER_CHUNK_DAYS,
+    prefetch=True,
+):
+    """Yield the moisture records of the given zones (all zones if not specified)
+    for a period, fetched chunk_days at a time. yyyy-mm-dd is the date format."""
+    return get_default_client().iter_moistures(
+        key, start_date, end_date, zone_ids, chunk_days, prefetch
+    )
+
+
+def iter_events(
+    key,
+    start_date,
+    end_date="",
+    type_of_event=0,
+    chunk_days=ITER_CHUNK_DAYS,
+    prefetch=True,
+):
+    """Yield the events (all types of events if not specified) of a period,
+    fetched chunk_days at a time. yyyy-mm-dd is the date format."""
+    return get_default_client().iter_events(
+        key, start_date, end_date, type_of_event, chunk_days, prefetch
+    )
+
+
+# data array and local day field of the history records of each NPA endpoint,
+# None if the records have no local day (they are then fetched day by day and
+# filed under the day they are requested for)
+_HISTORY_KINDS = {
+    NETRO_GET_SENSORDATA: ("sensor_data", lambda record: record["local_date"]),
+    NETRO_GET_MOISTURES: ("moistures", lambda record: record["date"]),
+    NETRO_GET_EVENTS: ("events", None),
+}
+
+
+class HistoryStore:
+    """Local SQLite history of sensor data, moistures and events.
+
+    The store remembers the days of each key already fetched from the NPA and
+    only requests the missing ones, grouped in as few calls as possible, so
+    that range queries are then served locally. The last `open_days` days
+    (today included) may still change and are fetched again on each query.
+
+    Events only have a UTC time while the NPA dates are local ones, so they
+    are requested one day per call to be filed under their local day.
+    """
+
+    def __init__(self, path=":memory:", client=None, open_days=HISTORY_OPEN_DAYS):
+        """Create a store in the given SQLite database file.
+
+        The NPA is queried through `client`, the default client if None.
+        """
+        self.client = client
+        self.open_days = open_days
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS fetched_days "
+                "(kind TEXT, key TEXT, day TEXT, PRIMARY KEY (kind, key, day))"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS records "
+                "(kind TEXT, key TEXT, id, day TEXT, record TEXT, "
+                "PRIMARY KEY (kind, key, id))"
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS records_by_day ON records (kind, key, day)"
+            )
+
+    def close(self):
+        """Close the database."""
+        self._db.close()
+
+    def _client(self):
+        """Return the client used to query the NPA."""
+        return self.client if self.client is not None else get_default_client()
+
+    def _missing_periods(self, kind, key, start, end):
+        """Return the (start, end) periods of the days not fetched yet."""
+        fetched = {
+            row[0]
+            for row in self._db.execute(
+                "SELECT day FROM fetched_days "
+                "WHERE kind = ? AND key = ? AND day BETWEEN ? AND ?",
+                (kind, key, start.isoformat(), end.isoformat()),
+            )
+        }
+        periods = []
+        day = start
+        while day <= end:
+            if day.isoformat() not in fetched:
+                if periods and periods[-1][1] == day - datetime.timedelta(days=1):
+                    periods[-1][1] = day
+                else:
+                    periods.append([day, day])
+            day += datetime.timedelta(days=1)
+        return periods
+
+    def _request(self, endpoint, key, start, end):
+        """Request the json records of a period from the NPA."""
+        # the json result is needed, whether the client is typed or not
+        # pylint: disable=protected-access
+        client = self._client()
+        if endpoint == NETRO_GET_SENSORDATA:
+            payload = _sensor_data_payload(key, start.isoformat(), end.isoformat())
+            result = client._get("getSensorData", endpoint, payload)
+        elif endpoint == NETRO_GET_MOISTURES:
+            payload = _zones_period_payload(
+                key, None, start.isoformat(), end.isoformat()
+            )
+            result = client._get("getMoistures", endpoint, payload)
+        else:
+            payload = _events_payload(key, 0, start.isoformat(), end.isoformat())
+            result = client._get("getEvents", endpoint, payload)
+        return result["data"][_HISTORY_KINDS[endpoint][0]]
+
+    def _fetch(self, endpoint, key, start, end):
+        """Fetch a period from the NPA and store its records."""
+        day_of = _HISTORY_KINDS[endpoint][1]
+        if day_of is not None:
+            rows = [
+                (endpoint, key, record["id"], day_of(record), json.dumps(record))
+                for record in self._request(endpoint, key, start, end)
+            ]
+        else:
+            rows = []
+            day = start
+            while day <= end:
+                rows.extend(
+                    (endpoint, key, record["id"], day.isoformat(), json.dumps(record))
+                    for record in self._request(endpoint, key, day, day)
+                )
+                day += datetime.timedelta(days=1)
+        last_closed = datetime.date.today() - datetime.timedelta(days=self.open_days)
+        closed_days = []
+        day = start
+        while day <= min(end, last_closed):
+            closed_days.append((endpoint, key, day.isoformat()))
+            day += datetime.timedelta(days=1)
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?, ?)", rows
+            )
+            self._db.executemany(
+                "INSERT OR IGNORE INTO fetched_days VALUES (?, ?, ?)", closed_days
+            )
+
+    def _query(self, endpoint, key, start_date, end_date):
+        """Return the records of the period, fetching the missing days first."""
+        start = _to_date(start_date)
+        end = _to_date(end_date) if end_date else datetime.date.today()
+        with self._lock:
+            periods = self._missing_periods(endpoint, key, start, end)
+        for period_start, period_end in periods:
+            self._fetch(endpoint, key, period_start, period_end)
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT record FROM records "
+                "WHERE kind = ? AND key = ? AND day BETWEEN ? AND ? "
+                "ORDER BY day, id",
+                (endpoint, key, start.isoformat(), end.isoformat()),
+            ).fetchall()
+        return [json_decoder(row[0]) for row in rows]
+
+    def _records(self, endpoint, records):
+        """Return the records as models if the client is typed."""
+        if not self._client().typed:
+            return records
+        model = _TYPED_RECORDS[endpoint][0]
+        return [model.from_npa(record) for record in records]
+
+    def get_sensor_data(self, key, start_date, end_date=""):
+        """Get the sensor data records of the period. yyyy-mm-dd is the date format."""
+        records = self._query(NETRO_GET_SENSORDATA, key, start_date, end_date)
+        return self._records(NETRO_GET_SENSORDATA, records)
+
+    def get_moistures(self, key, start_date, end_date="", zone_ids=None):
+        """Get the moisture records of the given zones (all zones if not specified).
+        yyyy-mm-dd is the date format."""
+        records = self._query(NETRO_GET_MOISTURES, key, start_date, end_date)
+        if zone_ids is not None:
+            zones = {int(zone_id) for zone_id in zone_ids}
+            records = [record for record in records if record["zone"] in zones]
+        return self._records(NETRO_GET_MOISTURES, records)
+
+    def get_events(self, key, start_date, end_date="", type_of_event=0):
+        """Get the event records (all types of events if not specified).
+        yyyy-mm-dd is the date format."""
+        records = self._query(NETRO_GET_EVENTS, key, start_date, end_date)
+        if type_of_event > 0:
+            records = [record for record in records if record["event"] == type_of_event]
+        return self._records(NETRO_GET_EVENTS, records)
+
+
+# client methods of the read endpoints, by NPA endpoint and short name
+_FLEET_METHODS = {
+    NETRO_GET_INFO: "get_info",
+    NETRO_GET_SCHEDULES: "get_schedules",
+    NETRO_GET_MOISTURES: "get_moistures",
+    NETRO_GET_SENSORDATA: "get_sensor_data",
+    NETRO_GET_EVENTS: "get_events",
+    "info": "get_info",
+    "schedules": "get_schedules",
+    "moistures": "get_moistures",
+    "sensor_data": "get_sensor_data",
+    "events": "get_events",
+}
+
+FleetResult = collections.namedtuple("FleetResult", ["key", "result", "error"])
+FleetResult.__doc__ = (
+    """Outcome of a fleet request: its key and its result or exception."""
+)
+
+
+class Fleet:
+    """Concurrent execution of one read endpoint over many device keys.
+
+    Requests run in a bounded thread pool sharing the connection pool of the
+    client, at most `per_key_limit` at a time for a given key (the next ones
+    wait in a queue of the key, not in a worker), and every key gets its own
+    result or exception so that a slow or failing device does not hold back
+    the others.
+    """
+
+    def __init__(
+        self, client=None, max_workers=FLEET_MAX_WORKERS, per_key_limit=1
+    ) -> None:
+        """Create a fleet querying the NPA through `client` (default client if None)."""
+        self.client = client
+        self.per_key_limit = per_key_limit
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="netro-fleet"
+        )
+        # key -> requests running, and requests queued behind them
+        self._running = collections.Counter()
+        self._waiting = collections.defaultdict(collections.deque)
+        self._lock = threading.Lock()
+
+    def close(self):
+        """Shut the thread pool down, cancelling the requests not started."""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        with self._lock:
+            for waiting in self._waiting.values():
+                for future, _, _ in waiting:
+                    future.cancel()
+            self._waiting.clear()
+
+    def __enter__(self):
+        """Use the fleet as a context manager."""
+        return self
+
+    def __exit__(self, *exc_info):
+        """Shut the thread pool down when leaving the context."""
+        self.close()
+
+    def _run(self, key, future, method, params):
+        """Call the client method for key, then for the requests of key
+        queued behind it, in a worker of the pool."""
+        client = self.client if self.client is not None else get_default_client()
+        while future is not None:
+            if future.set_running_or_notify_cancel():
+                try:
+                    result = getattr(client, method)(key, **params)
+                except BaseException as exc:  # pylint: disable=broad-except
+                    # as the thread pool does, so that the key is not stuck
+                    future.set_exception(exc)
+                else:
+                    future.set_result(result)
+            with self._lock:
+                if self._waiting.get(key):
+                    future, method, params = self._waiting[key].popleft()
+                else:
+                    future = None
+                    self._waiting.pop(key, None)
+                    self._running[key] -= 1
+                    if not self._running[key]:
+                        del self._running[key]
+
+    def _submit(self, method, key, params):
+        """Submit a request of key, queued without holding a worker if key
+        has already `per_key_limit` requests running, and return its future."""
+        future = concurrent.futures.Future()
+        with self._lock:
+            if self._running[key] >= self.per_key_limit:
+                self._waiting[key].append((future, method, params))
+                return future
+            self._running[key] += 1
+
+        def cancelled(task):
+            # not started before the pool was shut down
+            if task.cancelled():
+                future.cancel()
+
+        self._executor.submit(self._run, key, future, method, params).add_done_callback(
+            cancelled
+        )
+        return future
+
+    def submit(self, endpoint, keys, **params):
+        """Submit the requests and return the futures by key."""
+        method = _FLEET_METHODS[endpoint]
+        return {self._submit(method, key, params): key for key in keys}
+
+    def iter(self, endpoint, keys, timeout=None, **params):
+        """Yield a FleetResult per key as soon as its request completes.
+
+        `endpoint` is a read endpoint (info, schedules, moistures, sensor_data,
+        events) and `params` the extra arguments of the related client method.
+        The keys not completed within `timeout` seconds get a TimeoutError.
+        """
+        futures = self.submit(endpoint, keys, **params)
+        try:
+            for future in concurrent.futures.as_completed(futures, timeout=timeout):
+                error = future.exception()
+                yield FleetResult(
+                    futures[future], None if error else future.result(), error
+                )
+        except concurrent.futures.TimeoutError:
+            for future, key in futures.items():
+                if not future.done():
+                    future.cancel()
+                    yield FleetResult(key, None, TimeoutError(f"{key} timed out"))
+
+    def fetch(self, endpoint, keys, timeout=None, **params):
+        """Return the FleetResult of every key, by key."""
+        return {
+            outcome.key: outcome
+            for outcome in self.iter(endpoint, keys, timeout=timeout, **params)
+        }
+
+
+class CommandBatcher:
+    """Batching of the per zone write commands sent to the same device.
+
+    The set_moisture and water commands submitted for the same key within
+    `window` seconds with compatible parameters (same moisture, or same
+    duration, delay and start time) are merged into a single NPA request
+    over all their zones. Every submitter gets a future resolved with the
+    result of the merged request, or failing with its exception: the NPA
+    does not tell the outcome of each zone, so the same result is shared by
+    all the zones of the merged request.
+    """
+
+    def __init__(self, client=None, window=BATCH_WINDOW) -> None:
+        """Create a batcher sending the commands through `client` (default
+        client if None)."""
+        self.client = client
+        self.window = window
+        # (command, key, parameters) -> [(zone id, future)]
+        self._pending = {}
+        self._timers = {}
+        self._lock = threading.Lock()
+
+    def _submit(self, batch_key, zone_id):
+        """Add a zone to a batch, starting its timer if new, and return its future.
+
+        Raise ValueError if the zone id is not a zone number.
+        """
+        # normalised so that "1" and 1 are the same zone
+        zone_id = str(int(zone_id))
+        future = concurrent.futures.Future()
+        with self._lock:
+            self._pending.setdefault(batch_key, []).append((zone_id, future))
+            if batch_key not in self._timers:
+                timer = threading.Timer(self.window, self._flush_batch, (batch_key,))
+                timer.daemon = True
+                self._timers[batch_key] = timer
+                timer.start()
+        return future
+
+    def set_moisture(self, key, moisture, zone_id):
+        """Submit a set moisture command for one zone and return its future."""
+        return self._submit(("set_moisture", key, (moisture,)), zone_id)
+
+    def water(self, key, duration, zone_id, delay=0, start_time=""):
+        """Submit a water command for one zone and return its future."""
+        return self._submit(("water", key, (duration, delay, start_time)), zone_id)
+
+    def _flush_batch(self, batch_key):
+        """Send the merged request of a batch and resolve its futures."""
+        with self._lock:
+            self._timers.pop(batch_key, None)
+            commands = self._pending.pop(batch_key, None)
+        if not commands:
+            return
+        command, key, params = batch_key
+        try:
+            zone_ids = sorted({zone_id for zone_id, _ in commands}, key=int)
+            client = self.client if self.client is not None else get_default_client()
+            logger.debug("%s --> %s zones merged for %s", command, len(zone_ids), key)
+            if command == "set_moisture":
+                result = client.set_moisture(key, params[0], zone_ids)
+            else:
+                result = client.water(key, params[0], zone_ids, params[1], params[2])
+        except Exception as exc:  # pylint: disable=broad-except
+            for _, future in commands:
+                future.set_exception(exc)
+        else:
+            for _, future in commands:
+                future.set_result(result)
+
+    def flush(self):
+        """Send all the pending batches now."""
+        with self._lock:
+            batch_keys = list(self._timers)
+            for batch_key in batch_keys:
+                self._timers[batch_key].cancel()
+        for batch_key in batch_keys:
+            self._flush_batch(batch_key)
+
+    def close(self):
+        """Send the pending batches and stop batching."""
+        self.flush()
+
+    def __enter__(self):
+        """Use the batcher as a context manager."""
+        return self
+
+    def __exit__(self, *exc_info):
+        """Send the pending batches when leaving the context."""
+        self.close()
+
+
+class _WatchedKey:  # pylint: disable=too-few-public-methods
+    """Watch state of one key of an EventWatcher."""
+
+    def __init__(self, since) -> None:
+        """Create the state of a key whose events are dispatched from since."""
+        self.since = since
+        self.polled_at = since
+        # event id -> time of the events seen, kept while they may be fetched
+        self.seen = {}
+        self.last_event = None
+        self.idle_polls = 0
+        # monotonic times of the next poll and of the schedules fetch
+        self.next_poll = 0.0
+        self.schedules = None
+        self.schedules_at = None
+
+
+class EventWatcher:  # pylint: disable=too-many-instance-attributes
+    """Change feed of the device events of several keys, polled adaptively.
+
+    Each poll of a key only asks for the events since its previous poll (with
+    one day of margin, the NPA dates being local ones); the events already
+    seen are dropped and the new ones are passed as Event, oldest first, to
+    the subscribed callbacks. A key is polled every `min_interval` seconds
+    while one of its zones is watering or within `schedule_lead` seconds of
+    the start of its next schedule (fetched every `schedule_refresh`
+    seconds, never if None), and less and less often as its polls return no
+    event otherwise, up to every `max_interval` seconds. Schedule starts and
+    ends are so detected quickly without spending tokens while nothing
+    happens. The keys are polled by `poll`, or in a background thread once
+    the watcher is started.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        client=None,
+        min_interval=WATCH_MIN_INTERVAL,
+        max_interval=WATCH_MAX_INTERVAL,
+        schedule_lead=WATCH_SCHEDULE_LEAD,
+        schedule_refresh=WATCH_SCHEDULE_REFRESH,
+    ) -> None:
+        """Create a watcher polling through `client` (default client if None)."""
+        self.client = client
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.schedule_lead = schedule_lead
+        self.schedule_refresh = schedule_refresh
+        self._keys = {}
+        self._subscribers = []
+        self._lock = threading.RLock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def subscribe(self, callback, event_types=None):
+        """Call callback(key, event) for every new event (of the given types,
+        NETRO_EVENT_* values, or of all types) and return callback."""
+        event_types = frozenset(event_types) if event_types is not None else None
+        with self._lock:
+            self._subscribers.append((callback, event_types))
+        return callback
+
+    def unsubscribe(self, callback):
+        """Stop calling callback."""
+        with self._lock:
+            self._subscribers = [
+                subscriber
+                for subscriber in self._subscribers
+                if subscriber[0] != callback
+            ]
+
+    def watch(self, key, since=None):
+        """Watch the events of key occurring from since (a UTC datetime, the
+        current second by default, the NPA times being in seconds)."""
+        if since is None:
+            since = datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0)
+        with self._lock:
+            self._keys[key] = _WatchedKey(since)
+        self._wakeup.set()
+
+    def unwatch(self, key):
+        """Stop watching the events of key."""
+        with self._lock:
+            self._keys.pop(key, None)
+
+    def last_event(self, key):
+        """Return the last event seen of key, None if any."""
+        with self._lock:
+            return self._keys[key].last_event
+
+    def next_interval(self, key, now=None):
+        """Return the time (seconds) to wait before polling key again."""
+        if now is None:
+            now = datetime.datetime.now(datetime.timezone.utc)
+        with self._lock:
+            state = self._keys[key]
+            interval = min(self.max_interval, self.min_interval * 2**state.idle_polls)
+            index = state.schedules
+        if index is None:
+            return interval
+        if index.running(now):
+            return self.min_interval
+        starts = [
+            run.start_time
+            for run in (index.next_run(zone, now) for zone in index.zones())
+            if run is not None
+        ]
+        if starts:
+            until_lead = (min(starts) - now).total_seconds() - self.schedule_lead
+            interval = min(interval, max(until_lead, self.min_interval))
+        return interval
+
+    def _client(self):
+        """Return the client of the watcher."""
+        return self.client if self.client is not None else get_default_client()
+
+    def _refresh_schedules(self, key):
+        """Fetch the schedules of key, used to adapt its polling interval."""
+        try:
+            schedules = self._client().get_schedules(key)
+        except Exception as exc:  # pylint: disable=broad-except
+            logger.warning("getSchedules --> %s not refreshed (%s)", key, exc)
+            schedules = None
+        if isinstance(schedules, dict):
+            schedules = to_typed(NETRO_GET_SCHEDULES, schedules)
+        with self._lock:
+            state = self._keys.get(key)
+            if state is not None:
+                state.schedules_at = time.monotonic()
+                if schedules is not None:
+                    state.schedules = ScheduleIndex(schedules)
+
+    def poll(self, key):
+        """Poll the events of key now, dispatch the new ones and return them."""
+        now = datetime.datetime.now(datetime.timezone.utc)
+        with self._lock:
+            state = self._keys[key]
+            start_date = (state.polled_at - datetime.timedelta(days=1)).date()
+            refresh = self.schedule_refresh is not None and (
+                state.schedules_at is None
+                or time.monotonic() - state.schedules_at >= self.schedule_refresh
+            )
+        result = self._client().get_events(
+            key,
+            start_date=start_date.isoformat(),
+            end_date=(now + datetime.timedelta(days=1)).date().isoformat(),
+        )
+        events = (
+            result if isinstance(result, list) else to_typed(NETRO_GET_EVENTS, result)
+        )
+        if refresh:
+            self._refresh_schedules(key)
+        new_events = []
+        with self._lock:
+            state = self._keys.get(key)
+            if state is None:
+                return new_events
+            for event in sorted(events, key=lambda event: (event.time, event.id)):
+                if event.id in state.seen:
+                    continue
+                state.seen[event.id] = event.time
+                state.last_event = event
+                if event.time >= state.since:
+                    new_events.append(event)
+            # the next polls fetch the events from the day before this one
+            horizon = now - datetime.timedelta(days=3)
+            state.seen = {
+                event_id: event_time
+                for event_id, event_time in state.seen.items()
+                if event_time >= horizon
+            }
+            state.polled_at = now
+            state.idle_polls = 0 if new_events else min(state.idle_polls + 1, 32)
+            state.next_poll = time.monotonic() + self.next_interval(key, now)
+        self._dispatch(key, new_events)
+        return new_events
+
+    def _dispatch(self, key, events):
+        """Pass the new events of key to the subscribed callbacks."""
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for event in events:
+            for callback, event_types in subscribers:
+                if event_types is not None and event.event not in event_types:
+                    continue
+                try:
+                    callback(key, event)
+                except Exception:  # pylint: disable=broad-except
+                    logger.exception("event callback %r failed", callback)
+
+    def _poll_due(self):
+        """Poll the keys due and return the time (seconds) until the next one."""
+        with self._lock:
+            now = time.monotonic()
+            due = [key for key, state in self._keys.items() if state.next_poll <= now]
+        for key in due:
+            if self._stopping.is_set():
+                break
+            try:
+                self.poll(key)
+            except Exception as exc:  # pylint: disable=broad-except
+                logger.warning("getEvents --> %s not polled (%s)", key, exc)
+                exceeded = (
+                    isinstance(exc, NetroException)
+                    and exc.code == NETRO_ERROR_CODE_EXCEED_LIMIT
+                )
+                with self._lock:
+                    if key in self._keys:
+                        self._keys[key].next_poll = time.monotonic() + (
+                            self.max_interval if exceeded else self.next_interval(key)
+                        )
+        with self._lock:
+            next_poll = min(
+                (state.next_poll for state in self._keys.values()),
+                default=time.monotonic() + self.max_interval,
+            )
+        return max(next_poll - time.monotonic(), 0)
+
+    def _run(self):
+        """Poll the watched keys until stopped."""
+        while not self._stopping.is_set():
+            self._wakeup.clear()
+            self._wakeup.wait(self._poll_due())
+
+    def start(self):
+        """Poll the watched keys in a background thread."""
+        if self._thread is None:
+            self._stopping.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="netro-event-watcher", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self):
+        """Stop the background polling."""
+        if self._thread is not None:
+            self._stopping.set()
+            self._wakeup.set()
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        """Start the watcher as a context manager."""
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        """Stop the watcher when leaving the context."""
+        self.stop()
+
+
+# fractional part of the golden ratio, spreading evenly any number of phases
+_GOLDEN_FRACTION = 0.6180339887498949
+
+
+class RefreshCoordinator:  # pylint: disable=too-many-instance-attributes
+    """Periodic refresh of the read endpoints of a fleet within its token
+    budget.
+
+    Every key added is refreshed, endpoint by endpoint, at the periods of
+    its plan: the target periods (seconds, by read endpoint) when its
+    remaining tokens, spread until the daily reset, allow them, and
+    otherwise the target periods stretched by the same factor so that
+    `reserve` tokens are kept for the other requests; the refreshes of a key
+    are suspended until the reset once only the reserve is left. The plan is
+    computed again before each refresh from the latest `meta.token_remaining`
+    of the key, seen through a hook of the client, so freshness degrades
+    gradually as the budget falls. The first refreshes are staggered over
+    `stagger` seconds and keep their phase, so that the requests do not come
+    in bursts. The outcome of every refresh is passed as a FleetResult to
+    `callback(endpoint, outcome)`. The refreshes are sent by `refresh_due`,
+    or in a background thread once the coordinator is started.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        client=None,
+        callback=None,
+        reserve=RATE_LIMIT_WRITE_RESERVE,
+        stagger=REFRESH_STAGGER,
+        daily_limit=NETRO_DAILY_TOKEN_LIMIT,
+    ) -> None:
+        """Create a coordinator refreshing through `client` (default client
+        if None)."""
+        self.client = client if client is not None else get_default_client()
+        self.callback = callback
+        self.reserve = reserve
+        self.stagger = stagger
+        self.daily_limit = daily_limit
+        # key -> target periods, by endpoint
+        self._targets = {}
+        # key -> latest remaining tokens reported by the NPA
+        self._remaining = {}
+        # (key, endpoint) -> epoch time of the next refresh, and phase (0-1)
+        self._due = {}
+        self._phases = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self.client.hooks.append(self._record)
+
+    def _record(self, event):
+        """Keep the remaining tokens of the coordinated keys (client hook)."""
+        if event.key not in self._targets:
+            return
+        with self._lock:
+            if event.token_remaining is not None:
+                self._remaining[event.key] = event.token_remaining
+            elif event.error_code == NETRO_ERROR_CODE_EXCEED_LIMIT:
+                self._remaining[event.key] = 0
+
+    def add(self, key, targets=None):
+        """Refresh the endpoints of key at the target periods (REFRESH_TARGETS
+        by default, {"info.json": 600, "sensor_data.json": 3600} for
+        instance for a sensor)."""
+        targets = dict(targets if targets is not None else REFRESH_TARGETS)
+        now = time.time()
+        with self._lock:
+            self._targets[key] = targets
+            for endpoint, period in targets.items():
+                phase = (len(self._phases) * _GOLDEN_FRACTION) % 1
+                self._phases[key, endpoint] = phase
+                self._due[key, endpoint] = now + phase * min(period, self.stagger)
+        self._wakeup.set()
+
+    def remove(self, key):
+        """Stop refreshing key."""
+        with self._lock:
+            for endpoint in self._targets.pop(key, ()):
+                del self._due[key, endpoint]
+                del self._phases[key, endpoint]
+            self._remaining.pop(key, None)
+
+    def remaining(self, key):
+        """Return the latest remaining tokens reported for key, None if unknown."""
+        with self._lock:
+            return self._remaining.get(key)
+
+    def periods(self, key, now=None):
+        """Return the planned refresh periods (seconds) of the endpoints of
+        key, None for the endpoints suspended until the daily reset."""
+        now = time.time() if now is None else now
+        with self._lock:
+            targets = self._targets[key]
+            remaining = self._remaining.get(key)
+        until_reset = _next_utc_midnight(now) - now
+        if remaining is None:
+            # unknown until the first response, assume an even daily use
+            remaining = self.daily_limit * until_reset / 86400
+        spendable = remaining - self.reserve
+        if spendable < 1:
+            return dict.fromkeys(targets)
+        demand = sum(until_reset / period for period in targets.values())
+        factor = max(1.0, demand / spendable)
+        return {endpoint: period * factor for endpoint, period in targets.items()}
+
+    def plan(self, now=None):
+        """Return the planned refresh periods of every key, by key."""
+        with self._lock:
+            keys = list(self._targets)
+        return {key: self.periods(key, now) for key in keys}
+
+    def _schedule(self, key, endpoint, now):
+        """Schedule the next refresh of an endpoint of key at its planned
+        period, or after the daily reset if it is suspended."""
+        try:
+            period = self.periods(key, now)[endpoint]
+        except KeyError:
+            # key removed meanwhile
+            return
+        with self._lock:
+            if (key, endpoint) in self._due:
+                self._due[key, endpoint] = (
+                    now + period
+                    if period is not None
+                    else _next_utc_midnight(now)
+                    + self._phases[key, endpoint] * self.stagger
+                )
+
+    def _refresh(self, key, endpoint):
+        """Refresh an endpoint of key and schedule its next refresh."""
+        try:
+            result = getattr(self.client, _FLEET_METHODS[endpoint])(key)
+        except Exception as exc:  # pylint: disable=broad-except
+            logger.warning("%s --> %s not refreshed (%s)", endpoint, key, exc)
+            outcome = FleetResult(key, None, exc)
+        else:
+            outcome = FleetResult(key, result, None)
+        self._schedule(key, endpoint, time.time())
+        if self.callback is not None:
+            try:
+                self.callback(endpoint, outcome)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("refresh callback %r failed", self.callback)
+        return outcome
+
+    def refresh_due(self, now=None):
+        """Send the refreshes due and return their (endpoint, FleetResult)."""
+        now = time.time() if now is None else now
+        with self._lock:
+            due = sorted(
+                (due_time, key_endpoint)
+                for key_endpoint, due_time in self._due.items()
+                if due_time <= now
+            )
+        outcomes = []
+        for _, (key, endpoint) in due:
+            if self._stopping.is_set():
+                break
+            try:
+                period = self.periods(key, now)[endpoint]
+            except KeyError:
+                # key removed meanwhile
+                continue
+            if period is None:
+                # only the reserve is left, wait for the daily reset
+                self._schedule(key, endpoint, now)
+                continue
+            outcomes.append((endpoint, self._refresh(key, endpoint)))
+        return outcomes
+
+    def next_due(self):
+        """Return the time (seconds) until the next refresh, None if any."""
+        with self._lock:
+            if not self._due:
+                return None
+            return max(min(self._due.values()) - time.time(), 0)
+
+    def _run(self):
+        """Refresh the keys until stopped."""
+        while not self._stopping.is_set():
+            self._wakeup.clear()
+            try:
+                self.refresh_due()
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("refresh of the keys failed")
+            delay = self.next_due()
+            self._wakeup.wait(delay if delay is not None else self.stagger)
+
+    def start(self):
+        """Refresh the keys in a background thread."""
+        if self._thread is None:
+            self._stopping.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="netro-refresh-coordinator", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self):
+        """Stop the background refreshes."""
+        if self._thread is not None:
+            self._stopping.set()
+            self._wakeup.set()
+            self._thread.join()
+            self._thread = None
+
+    def close(self):
+        """Stop the background refreshes and unhook from the client."""
+        self.stop()
+        if self._record in self.client.hooks:
+            self.client.hooks.remove(self._record)
+
+    def __enter__(self):
+        """Start the coordinator as a context manager."""
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        """Stop the coordinator when leaving the context."""
+        self.close()
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class DesiredState:
+    """Desired state of a controller, None fields being left as they are.
+
+    `enabled` tells whether the controller is online (True) or in standby
+    (False), `no_water_days` the number of days from today without watering
+    and `moistures` the moisture (%) of today by zone.
+    """
+
+    enabled: bool | None = None
+    no_water_days: int | None = None
+    moistures: dict[int, int] | None = None
+
+
+ReconcileCall = collections.namedtuple(
+    "ReconcileCall",
+    ["key", "method", "params", "result", "error"],
+    defaults=(None, None),
+)
+ReconcileCall.__doc__ = """Write call of a reconciliation: the client method
+and its parameters, and once sent its result or exception."""
+
+
+class Reconciler:
+    """Reconciliation of the controllers with their desired state.
+
+    The desired state of every controller is compared with its current
+    state, read through the client (from its ResponseCache if it has one),
+    and only the write calls needed are sent: set_status if the status
+    differs (any status but STANDBY being online), one set_moisture per
+    moisture value over all the zones whose moisture of today differs, and
+    no_water if the desired period goes beyond the one last sent by this
+    reconciler, the NPA not reporting it. `plan` returns the calls without
+    sending them (dry run).
+    """
+
+    def __init__(self, client=None) -> None:
+        """Create a reconciler using `client` (default client if None)."""
+        self.client = client
+        self._desired = {}
+        # key -> last day without watering requested by this reconciler
+        self._no_water_until = {}
+        self._lock = threading.Lock()
+
+    def _client(self):
+        """Return the client of the reconciler."""
+        return self.client if self.client is not None else get_default_client()
+
+    def declare(self, key, desired):
+        """Set the DesiredState of the controller of key."""
+        with self._lock:
+            self._desired[key] = desired
+
+    def forget(self, key):
+        """Stop reconciling the controller of key."""
+        with self._lock:
+            self._desired.pop(key, None)
+            self._no_water_until.pop(key, None)
+
+    def _enabled(self, key):
+        """Tell whether the controller of key is online."""
+        device = self._client().get_info(key)
+        if isinstance(device, dict):
+            device = _typed_info(device)
+        return device.status != NETRO_STATUS_STANDBY
+
+    def _moistures(self, key, zones, today):
+        """Return the latest moisture of the given zones, by zone."""
+        result = self._client().get_moistures(
+            key,
+            [str(zone) for zone in sorted(zones)],
+            # the NPA dates are local ones
+            (today - datetime.timedelta(days=1)).isoformat(),
+            (today + datetime.timedelta(days=1)).isoformat(),
+        )
+        if isinstance(result, dict):
+            result = to_typed(NETRO_GET_MOISTURES, result)
+        latest = {}
+        for moisture in sorted(result, key=lambda moisture: moisture.date):
+            latest[moisture.zone] = moisture.moisture
+        return latest
+
+    def plan(self, key):
+        """Return the ReconcileCall needed by the controller of key."""
+        with self._lock:
+            desired = self._desired[key]
+            no_water_until = self._no_water_until.get(key)
+        today = datetime.datetime.now(datetime.timezone.utc).date()
+        calls = []
+        if desired.enabled is not None and desired.enabled != self._enabled(key):
+            status = NETRO_STATUS_ENABLE if desired.enabled else NETRO_STATUS_DISABLE
+            calls.append(ReconcileCall(key, "set_status", {"status": status}))
+        if desired.no_water_days:
+            until = today + datetime.timedelta(days=desired.no_water_days - 1)
+            if no_water_until is None or until > no_water_until:
+                calls.append(
+                    ReconcileCall(key, "no_water", {"days": desired.no_water_days})
+                )
+        if desired.moistures:
+            current = self._moistures(key, desired.moistures, today)
+            zones_by_moisture = {}
+            for zone, moisture in sorted(desired.moistures.items()):
+                if current.get(zone) != moisture:
+                    zones_by_moisture.setdefault(moisture, []).append(str(zone))
+            calls.extend(
+                ReconcileCall(
+                    key, "set_moisture", {"moisture": moisture, "zone_ids": zone_ids}
+                )
+                for moisture, zone_ids in sorted(zones_by_moisture.items())
+            )
+        # go to standby once the other settings are sent
+        calls.sort(key=lambda call: call.params.get("status") == NETRO_STATUS_DISABLE)
+        return calls
+
+    def reconcile(self, key, dry_run=False):
+        """Send the calls needed by the controller of key and return them
+        with their result or exception, or only return them if dry_run."""
+        calls = self.plan(key)
+        if dry_run:
+            return calls
+        client = self._client()
+        sent = []
+        for call in calls:
+            try:
+                result = getattr(client, call.method)(key, **call.params)
+            except Exception as exc:  # pylint: disable=broad-except
+                logger.warning("%s --> %s not reconciled (%s)", call.method, key, exc)
+                sent.append(call._replace(error=exc))
+                continue
+            if call.method == "no_water":
+                with self._lock:
+                    self._no_water_until[key] = datetime.datetime.now(
+                        datetime.timezone.utc
+                    ).date() + datetime.timedelta(days=call.params["days"] - 1)
+            sent.append(call._replace(result=result))
+        return sent
+
+    def reconcile_all(self, dry_run=False):
+        """Reconcile every controller and return its calls (see reconcile), or
+        the exception its state could not be read with, by key."""
+        with self._lock:
+            keys = list(self._desired)
+        outcomes = {}
+        for key in keys:
+            try:
+                outcomes[key] = self.reconcile(key, dry_run)
+            except Exception as exc:  # pylint: disable=broad-except
+                logger.warning("%s not reconciled (%s)", key, exc)
+                outcomes[key] = exc
+        return outcomes
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class WeatherForecast:  # pylint: disable=too-many-instance-attributes
+    """Local weather of a day to report to the NPA, see report_weather.
+
+    The fields left to None (or 0) are not reported.
+    """
+
+    date: datetime.date | str
+    condition: int | None = None
+    rain: float | None = None
+    rain_prob: int | None = None
+    temp: float | None = None
+    t_min: float | None = None
+    t_max: float | None = None
+    t_dew: float | None = None
+    wind_speed: float | None = None
+    humidity: int | None = None
+    pressure: float | None = None
+
+    def arguments(self):
+        """Return the report_weather arguments of the forecast, key excepted."""
+        return (
+            str(self.date),
+            self.condition,
+            self.rain,
+            self.rain_prob,
+            self.temp,
+            self.t_min,
+            self.t_max,
+            self.t_dew,
+            self.wind_speed,
+            self.humidity,
+            self.pressure,
+        )
+
+
+class WeatherReporter:
+    """Reporting of local weather forecasts to many controllers.
+
+    The payload last reported with success is kept per key and per date, so
+    that a forecast identical to it is not reported again. The other ones
+    are sent concurrently, in a bounded thread pool sharing the connection
+    pool and the rate limiter of the client, the forecasts of a key being
+    sent one after the other.
+    """
+
+    def __init__(self, client=None, max_workers=FLEET_MAX_WORKERS) -> None:
+        """Create a reporter sending through `client` (default client if None)."""
+        self.client = client
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="netro-weather"
+        )
+        # (key, date) -> payload last reported
+        self._reported = {}
+        self._lock = threading.Lock()
+
+    def close(self):
+        """Shut the thread pool down."""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def __enter__(self):
+        """Use the reporter as a context manager."""
+        return self
+
+    def __exit__(self, *exc_info):
+        """Shut the thread pool down when leaving the context."""
+        self.close()
+
+    def forget(self, key=None):
+        """Forget what was reported to key (to every key if None)."""
+        with self._lock:
+            for reported in list(self._reported):
+                if key is None or reported[0] == key:
+                    del self._reported[reported]
+
+    def _report_key(self, key, reports):
+        """Send the reports of a key and return their FleetResult, by date."""
+        client = self.client if self.client is not None else get_default_client()
+        outcomes = {}
+        for arguments, payload in reports:
+            try:
+                result = client.report_weather(key, *arguments)
+            except Exception as exc:  # pylint: disable=broad-except
+                outcomes[arguments[0]] = FleetResult(key, None, exc)
+                continue
+            with self._lock:
+                self._reported[key, arguments[0]] = payload
+            outcomes[arguments[0]] = FleetResult(key, result, None)
+        return outcomes
+
+    def report(self, forecasts, keys):
+        """Report a WeatherForecast (or several ones) to every key.
+
+        Return the FleetResult of every report sent, by (key, date), the
+        reports identical to the last ones being skipped.
+        """
+        if isinstance(forecasts, WeatherForecast):
+            forecasts = (forecasts,)
+        arguments = [forecast.arguments() for forecast in forecasts]
+        keys = list(keys)
+        # the past days are not reported again (with one day of margin, the
+        # NPA dates being local ones)
+        horizon = (
+            (datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=2))
+            .date()
+            .isoformat()
+        )
+        pending = {}
+        with self._lock:
+            for reported in [
+                reported for reported in self._reported if reported[1] < horizon
+            ]:
+                del self._reported[reported]
+            for key in keys:
+                for forecast_arguments in arguments:
+                    payload = _weather_payload(key, *forecast_arguments)
+                    if self._reported.get((key, forecast_arguments[0])) != payload:
+                        pending.setdefault(key, []).append(
+                            (forecast_arguments, payload)
+                        )
+        logger.debug(
+            "reportWeather --> %s reports sent, %s unchanged",
+            sum(map(len, pending.values())),
+            len(arguments) * len(keys) - sum(map(len, pending.values())),
+        )
+        futures = [
+            self._executor.submit(self._report_key, key, reports)
+            for key, reports in pending.items()
+        ]
+        outcomes = {}
+        for future in futures:
+            for date, outcome in future.result().items():
+                outcomes[outcome.key, date] = outcome
+        return outcomes
+
+
+# client methods of the commands of a batch, by NPA endpoint and short name
+_BATCH_METHODS = dict(
+    _FLEET_METHODS,
+    **{
+        NETRO_POST_STATUS: "set_status",
+        NETRO_POST_REPORTWEATHER: "report_weather",
+        NETRO_POST_MOISTURE: "set_moisture",
+        NETRO_POST_WATER: "water",
+        NETRO_POST_STOPWATER: "stop_water",
+        NETRO_POST_NOWATER: "no_water",
+        "set_status": "set_status",
+        "report_weather": "report_weather",
+        "set_moisture": "set_moisture",
+        "water": "water",
+        "stop_water": "stop_water",
+        "no_water": "no_water",
+    },
+)
+
+BatchResult = collections.namedtuple("BatchResult", ["command", "result", "error"])
+BatchResult.__doc__ = (
+    """Outcome of a batch command: the command and its result or exception."""
+)
+
+
+def read_batch(lines):
+    """Yield the commands of a batch, one json object per line.
+
+    A command is {"endpoint": ..., "key": ..., "params": {...}} where endpoint
+    is a NPA endpoint ("info.json") or its short name ("info") and params the
+    extra arguments of the related client method; it may carry an "id" echoed
+    in its output. Blank and # comment lines are skipped; an invalid line is
+    yielded as a command of endpoint None and its "error" message.
+    """
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        try:
+            command = json.loads(line)
+            if not isinstance(command, dict):
+                raise ValueError("a command must be a json object")
+            if command.get("endpoint") not in _BATCH_METHODS:
+                raise ValueError(f"unknown endpoint {command.get('endpoint')!r}")
+            if not isinstance(command.get("key"), str):
+                raise ValueError("a command must have a device key")
+            if not isinstance(command.setdefault("params", {}), dict):
+                raise ValueError("the params of a command must be a json object")
+            if "stream" in command["params"]:
+                raise ValueError("a batch command cannot stream its result")
+        except ValueError as exc:
+            command = {"endpoint": None, "error": str(exc)}
+        command["line"] = number
+        yield command
+
+
+def run_batch(commands, client=None, max_workers=FLEET_MAX_WORKERS):
+    """Run batch commands concurrently and yield a BatchResult per command as
+    soon as it completes.
+
+    The commands of a key run one at a time in their order, so that a water
+    command and its stop_water are not swapped, and the keys concurrently in
+    a thread pool sharing the connection pool of `client` (default client if
+    None). `commands` is read by a thread of its own and each command is
+    submitted as soon as it is read, so that a batch piped on the standard
+    input is run before its end. An invalid command (see read_batch) gets a
+    ValueError.
+    """
+    client = client if client is not None else get_default_client()
+    results = queue.SimpleQueue()
+    # commands of the keys being run, waiting for the previous ones
+    waiting = {}
+    lock = threading.Lock()
+
+    def run_key(command):
+        key = command["key"]
+        while command is not None:
+            method = getattr(client, _BATCH_METHODS[command["endpoint"]])
+            try:
+                results.put(
+                    BatchResult(command, method(key, **command["params"]), None)
+                )
+            except Exception as exc:  # pylint: disable=broad-except
+                results.put(BatchResult(command, None, exc))
+            with lock:
+                command = waiting[key].popleft() if waiting[key] else None
+                if command is None:
+                    del waiting[key]
+
+    def read(executor):
+        count, error = 0, None
+        try:
+            for command in commands:
+                count += 1
+                if command["endpoint"] is None:
+                    results.put(
+                        BatchResult(command, None, ValueError(command["error"]))
+                    )
+                    continue
+                with lock:
+                    if command["key"] in waiting:
+                        waiting[command["key"]].append(command)
+                        continue
+                    waiting[command["key"]] = collections.deque()
+                executor.submit(run_key, command)
+        except Exception as exc:  # pylint: disable=broad-except
+            error = exc
+        # end of the commands: how many results to wait for
+        results.put((count, error))
+
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=max_workers, thread_name_prefix="netro-batch"
+    ) as executor:
+        threading.Thread(
+            target=read, args=(executor,), name="netro-batch-reader", daemon=True
+        ).start()
+        count, error, done = None, None, 0
+        while count is None or done < count:
+            outcome = results.get()
+            if isinstance(outcome, BatchResult):
+                done += 1
+                yield outcome
+            else:
+                count, error = outcome
+        if error is not None:
+            raise error
+
+
+def _batch_record(outcome):
+    """Return the json output record of a batch outcome."""
+    command, result, error = outcome
+    record = {
+        name: command[name]
+        for name in ("line", "id", "endpoint", "key")
+        if command.get(name) is not None
+    }
+    if error is None:
+        record.update(ok=True, result=result)
+    else:
+        record.update(
+            ok=False,
+            error={
+                "type": type(error).__name__,
+                "code": getattr(error, "code", None),
+                "message": str(error),
+            },
+        )
+    return record
+
+
+def main(argv=None):
+    """Run a batch of NPA commands and write their results as NDJSON."""
+    # only needed by the command line
+    import argparse  # pylint: disable=import-outside-toplevel
+
+    parser = argparse.ArgumentParser(
+        prog="python -m netrofunction",
+        description="Run a batch of Netro Public API commands (one json object "
+        'per line: {"endpoint": "info", "key": "...", "params": {}}) and write '
+        "one json result per line as soon as each command completes",
+    )
+    parser.add_argument(
+        "batch", nargs="?", default="-", help="batch file, standard input if -"
+    )
+    parser.add_argument("--output", default="-", help="output file, stdout if -")
+    parser.add_argument("--url", help="NPA base url")
+    parser.add_argument("--transport", default=TRANSPORT, choices=sorted(_TRANSPORTS))
+    parser.add_argument("--workers", type=int, default=FLEET_MAX_WORKERS)
+    parser.add_argument("--timeout", type=float, default=REQUESTS_TIMEOUT)
+    parser.add_argument(
+        "--quota", help="SQLite file of a token budget shared by the processes"
+    )
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args(argv)
+    logging.basicConfig(
+        format="%(asctime)s -- %(name)s:%(levelname)s:%(message)s",
+        level=logging.INFO if args.verbose else logging.WARNING,
+    )
+    limiter = SharedQuota(args.quota) if args.quota else RateLimiter()
+    client = NetroClient(
+        base_url=args.url,
+        timeout=args.timeout,
+        pool_maxsize=args.workers,
+        rate_limiter=limiter,
+        transport=args.transport,
+    )
+    failures = 0
+    with contextlib.ExitStack() as stack:
+        stack.callback(client.close)
+        if args.quota:
+            stack.callback(limiter.close)
+        batch = (
+            sys.stdin
+            if args.batch == "-"
+            else stack.enter_context(open(args.batch, encoding="utf-8"))
+        )
+        output = (
+            sys.stdout
+            if args.output == "-"
+            else stack.enter_context(open(args.output, "w", encoding="utf-8"))
+        )
+        for outcome in run_batch(read_batch(batch), client, args.workers):
+            try:
+                record = json.dumps(_batch_record(outcome))
+            except (TypeError, ValueError) as exc:
+                # a result that is not json is a failure, not a string
+                outcome = BatchResult(outcome.command, None, exc)
+                record = json.dumps(_batch_record(outcome))
+            failures += outcome.error is not None
+            output.write(record + "\n")
+            output.flush()
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,757 @@
+"""In-process stand-in of the Netro Public API (NPA).
+
+It serves every NPA endpoint used by netrofunction from a simulated fleet of
+controllers and sensors, with token accounting, configurable latency and
+error injection, so that integrations may be tested and benchmarked without
+a real device nor burning real tokens:
+
+    with NetroSimulator() as simulator:
+        ctrl_key = simulator.add_controller(zones=3)
+        netrofunction.set_netro_base_url(simulator.url)
+        netrofunction.get_info(ctrl_key)
+
+or, without http server, through an in-memory transport:
+
+    simulator = NetroSimulator()
+    client = netrofunction.NetroClient(transport=simulator.transport())
+
+Devices are simulated in UTC, their local dates and times are UTC ones.
+"""
+
+import argparse
+import asyncio
+import datetime
+import itertools
+import json
+import logging
+import random
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import netrofunction
+
+logger = logging.getLogger(__name__)
+logging.getLogger(__name__).addHandler(logging.NullHandler())
+
+# simulated devices
+SIMU_ZONE_RUN_HOUR = 5
+SIMU_ZONE_RUN_MINUTES = 10
+SIMU_SENSOR_PERIOD = 3600
+SIMU_DEFAULT_DAYS = 7
+
+NPA_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+
+def constant_latency(seconds):
+    """Return a latency distribution always giving the same delay."""
+    return lambda rng: seconds
+
+
+def uniform_latency(low, high):
+    """Return a latency distribution uniform between low and high seconds."""
+    return lambda rng: rng.uniform(low, high)
+
+
+def lognormal_latency(median, sigma=0.5):
+    """Return a log-normal latency distribution of the given median (seconds)."""
+    return lambda rng: rng.lognormvariate(0, sigma) * median
+
+
+def _npa_time(timestamp):
+    """Return the NPA format of a UTC datetime."""
+    return timestamp.strftime(NPA_TIME_FORMAT)
+
+
+def _utcnow():
+    """Return the current UTC time, without microseconds."""
+    return datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0)
+
+
+class SimulationError(Exception):
+    """NPA error answered to the request being simulated."""
+
+    def __init__(self, code, message) -> None:
+        """Make an NPA error of the given code and message."""
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+
+class _SimulatedDevice:  # pylint: disable=too-few-public-methods
+    """Device of the simulated fleet, with its token budget."""
+
+    def __init__(self, key, name, token_limit) -> None:
+        """Create a device."""
+        self.key = key
+        self.name = name
+        self.status = "ONLINE"
+        self.version = "1.0"
+        self.sw_version = "1.1.1"
+        self.token_limit = token_limit
+        self.token_remaining = token_limit
+        self.token_reset = None
+        self.last_active = _utcnow()
+        self.events = []
+
+
+class _SimulatedController(_SimulatedDevice):
+    """Simulated Netro controller."""
+
+    def __init__(self, key, name, token_limit, zones) -> None:
+        """Create a controller with the given number of zones."""
+        super().__init__(key, name, token_limit)
+        self.zones = {
+            ith: {"name": f"zone {ith}", "ith": ith, "enabled": True, "smart": "SMART"}
+            for ith in range(1, zones + 1)
+        }
+        self.moisture_overrides = {}
+        self.manual_schedules = []
+        self.no_water_until = None
+        self.weather = {}
+
+
+class _SimulatedSensor(_SimulatedDevice):  # pylint: disable=too-few-public-methods
+    """Simulated Netro soil sensor."""
+
+    def __init__(self, key, name, token_limit) -> None:
+        """Create a sensor."""
+        super().__init__(key, name, token_limit)
+        self.battery_level = 0.9
+
+
+class NetroSimulator:  # pylint: disable=too-many-instance-attributes
+    """Local http server simulating the NPA for a fleet of devices.
+
+    `latency` is a distribution (see constant_latency, uniform_latency and
+    lognormal_latency) of the delay added to every response, and a random
+    NPA error of `error_codes` is answered with the probability `error_rate`.
+    Errors may also be injected request by request with inject_error and
+    inject_http_error. Random values are drawn from a generator seeded with
+    `seed`, so that a simulation may be reproduced.
+    """
+
+    def __init__(
+        self,
+        host="127.0.0.1",
+        port=0,
+        latency=None,
+        error_rate=0.0,
+        error_codes=(netrofunction.NETRO_ERROR_CODE_INTERNAL_ERROR,),
+        token_limit=netrofunction.NETRO_DAILY_TOKEN_LIMIT,
+        seed=0,
+    ) -> None:
+        """Create a simulator listening on host and port (any free port if 0)."""
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_codes = tuple(error_codes)
+        self.token_limit = token_limit
+        self.devices = {}
+        # endpoint -> number of requests received
+        self.requests = {}
+        self._rng = random.Random(seed)
+        self._injected = []
+        self._ids = itertools.count(10_000_000)
+        self._lock = threading.Lock()
+        self._address = (host, port)
+        # http server, bound when its url is first needed
+        self._server = None
+        self._thread = None
+
+    def _http_server(self):
+        """Return the http server, bound to its address if not yet."""
+        if self._server is None:
+            self._server = ThreadingHTTPServer(self._address, _Handler)
+            self._server.daemon_threads = True
+            self._server.simulator = self
+        return self._server
+
+    @property
+    def url(self):
+        """Return the NPA url to give to netrofunction.set_netro_base_url."""
+        host, port = self._http_server().server_address[:2]
+        return f"http://{host}:{port}/npa/v1/"
+
+    def start(self):
+        """Serve the requests in a background thread and return the NPA url."""
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._http_server().serve_forever,
+                name="netro-simulator",
+                daemon=True,
+            )
+            self._thread.start()
+        return self.url
+
+    def transport(self, asynchronous=False):
+        """Return an in-memory transport of netrofunction serving the requests
+        without http server, for a NetroClient or, if `asynchronous`, for an
+        AsyncNetroClient. The simulator needs not be started."""
+
+        def handler(method, url, params):
+            del method
+            status, response, latency = self.handle(url.rsplit("/", 1)[-1], params)
+            if latency > 0:
+                time.sleep(latency)
+            return status, response
+
+        async def async_handler(method, url, params):
+            del method
+            status, response, latency = self.handle(url.rsplit("/", 1)[-1], params)
+            if latency > 0:
+                await asyncio.sleep(latency)
+            return status, response
+
+        if asynchronous:
+            return netrofunction.AsyncMemoryTransport(async_handler)
+        return netrofunction.MemoryTransport(handler)
+
+    def stop(self):
+        """Stop serving the requests."""
+        if self._thread is not None:
+            self._server.shutdown()
+            self._thread.join()
+            self._thread = None
+        if self._server is not None:
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        """Start the simulator as a context manager."""
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        """Stop the simulator when leaving the context."""
+        self.stop()
+
+    def _new_key(self, prefix):
+        """Return an unused device key."""
+        while True:
+            key = f"{prefix}{self._rng.getrandbits(48):012x}"
+            if key not in self.devices:
+                return key
+
+    def add_controller(self, key=None, name=None, zones=3):
+        """Add a controller with the given number of zones and return its key."""
+        with self._lock:
+            key = key or self._new_key("ctrl")
+            self.devices[key] = _SimulatedController(
+                key,
+                name or f"controller {len(self.devices) + 1}",
+                self.token_limit,
+                zones,
+            )
+        return key
+
+    def add_sensor(self, key=None, name=None):
+        """Add a soil sensor and return its key."""
+        with self._lock:
+            key = key or self._new_key("sens")
+            self.devices[key] = _SimulatedSensor(
+                key, name or f"sensor {len(self.devices) + 1}", self.token_limit
+            )
+        return key
+
+    def inject_error(self, code, endpoint=None, key=None, count=1):
+        """Answer the NPA error code to the next count matching requests.
+
+        The requests match if their endpoint and key are the given ones (any
+        endpoint or key if None).
+        """
+        with self._lock:
+            self._injected.append([endpoint, key, count, ("npa", code)])
+
+    def inject_http_error(self, status, endpoint=None, key=None, count=1):
+        """Answer the http error status to the next count matching requests."""
+        with self._lock:
+            self._injected.append([endpoint, key, count, ("http", status)])
+
+    def _injected_error(self, endpoint, key):
+        """Return the error injected for a request, None if any."""
+        for rule in self._injected:
+            if rule[0] in (None, endpoint) and rule[1] in (None, key):
+                rule[2] -= 1
+                if rule[2] <= 0:
+                    self._injected.remove(rule)
+                return rule[3]
+        if self.error_rate and self._rng.random() < self.error_rate:
+            return ("npa", self._rng.choice(self.error_codes))
+        return None
+
+    def _meta(self, device):
+        """Return the meta data of a response."""
+        meta = {
+            "time": _npa_time(_utcnow()),
+            "tid": f"{self._rng.getrandbits(64):016x}",
+            "version": "1.0",
+        }
+        if device is not None:
+            meta.update(
+                token_limit=device.token_limit,
+                token_remaining=device.token_remaining,
+                last_active=_npa_time(device.last_active),
+                token_reset=_npa_time(device.token_reset),
+            )
+        return meta
+
+    def handle(self, endpoint, params):
+        """Simulate a request.
+
+        Return the http status, the json response (the body of an http error)
+        and the latency to add.
+        """
+        with self._lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+            latency = self.latency(self._rng) if self.latency else 0
+            device = self.devices.get(params.get("key"))
+            injected = self._injected_error(endpoint, params.get("key"))
+            if injected is not None and injected[0] == "http":
+                return injected[1], b"injected http error", latency
+            try:
+                if device is None:
+                    raise SimulationError(
+                        netrofunction.NETRO_ERROR_CODE_INVALID_KEY, "Invalid key"
+                    )
+                self._spend_token(device)
+                if injected is not None:
+                    raise SimulationError(injected[1], "Injected error")
+                data = self._dispatch(device, endpoint, params)
+            except SimulationError as exc:
+                response = {
+                    "status": netrofunction.NETRO_ERROR,
+                    "meta": self._meta(device),
+                    "errors": [{"code": exc.code, "message": exc.message}],
+                }
+                return 200, response, latency
+            device.last_active = _utcnow()
+            return (
+                200,
+                {
+                    "status": netrofunction.NETRO_OK,
+                    "meta": self._meta(device),
+                    "data": data,
+                },
+                latency,
+            )
+
+    @staticmethod
+    def _spend_token(device):
+        """Charge a token to the device, raise an error if none is left."""
+        now = _utcnow()
+        if device.token_reset is None or device.token_reset <= now:
+            device.token_remaining = device.token_limit
+            device.token_reset = datetime.datetime.combine(
+                now.date() + datetime.timedelta(days=1),
+                datetime.time(),
+                datetime.timezone.utc,
+            )
+        if device.token_remaining <= 0:
+            raise SimulationError(
+                netrofunction.NETRO_ERROR_CODE_EXCEED_LIMIT, "Exceed limit"
+            )
+        device.token_remaining -= 1
+
+    def _dispatch(self, device, endpoint, params):
+        """Return the data of a request to an endpoint."""
+        handlers = {
+            netrofunction.NETRO_GET_INFO: self._info,
+            netrofunction.NETRO_GET_SCHEDULES: self._schedules,
+            netrofunction.NETRO_GET_MOISTURES: self._moistures,
+            netrofunction.NETRO_GET_SENSORDATA: self._sensor_data,
+            netrofunction.NETRO_GET_EVENTS: self._events,
+            netrofunction.NETRO_POST_WATER: self._water,
+            netrofunction.NETRO_POST_STOPWATER: self._stop_water,
+            netrofunction.NETRO_POST_NOWATER: self._no_water,
+            netrofunction.NETRO_POST_MOISTURE: self._set_moisture,
+            netrofunction.NETRO_POST_STATUS: self._set_status,
+            netrofunction.NETRO_POST_REPORTWEATHER: self._report_weather,
+        }
+        if endpoint not in handlers:
+            raise SimulationError(
+                netrofunction.NETRO_ERROR_CODE_PARAMETER_ERROR, "Unknown endpoint"
+            )
+        sensor_endpoint = endpoint in (
+            netrofunction.NETRO_GET_INFO,
+            netrofunction.NETRO_GET_SENSORDATA,
+        )
+        if isinstance(device, _SimulatedSensor) and not sensor_endpoint:
+            raise SimulationError(
+                netrofunction.NETRO_ERROR_CODE_INVALID_DEVICE_OR_SENSOR,
+                "Invalid device",
+            )
+        if endpoint == netrofunction.NETRO_GET_SENSORDATA and not isinstance(
+            device, _SimulatedSensor
+        ):
+            raise SimulationError(
+                netrofunction.NETRO_ERROR_CODE_INVALID_DEVICE_OR_SENSOR,
+                "Invalid sensor",
+            )
+        return handlers[endpoint](device, params)
+
+    @staticmethod
+    def _parameter_error(message):
+        """Return a parameter error."""
+        return SimulationError(netrofunction.NETRO_ERROR_CODE_PARAMETER_ERROR, message)
+
+    def _period(self, params, default_start, default_end):
+        """Return the start and end dates of a request."""
+        try:
+            start = datetime.date.fromisoformat(
+                params.get("start_date") or default_start.isoformat()
+            )
+            end = datetime.date.fromisoformat(
+                params.get("end_date") or default_end.isoformat()
+            )
+        except ValueError as exc:
+            raise self._parameter_error("Invalid date") from exc
+        if end < start:
+            raise self._parameter_error("Invalid period")
+        return start, end
+
+    def _zones(self, device, params):
+        """Return the zones of a request (all the zones if not specified)."""
+        if not params.get("zones"):
+            return sorted(device.zones)
+        try:
+            zones = json.loads(params["zones"])
+        except ValueError as exc:
+            raise self._parameter_error("Invalid zones") from exc
+        if not isinstance(zones, list) or any(
+            zone not in device.zones for zone in zones
+        ):
+            raise self._parameter_error("Invalid zones")
+        return zones
+
+    @staticmethod
+    def _days(start, end):
+        """Yield the days of a period."""
+        day = start
+        while day <= end:
+            yield day
+            day += datetime.timedelta(days=1)
+
+    def _event(self, device, event, message):
+        """Record an event of the device."""
+        device.events.append(
+            {
+                "id": next(self._ids),
+                "event": event,
+                "time": _npa_time(_utcnow()),
+                "message": message,
+            }
+        )
+
+    def _info(self, device, params):
+        """Simulate info.json."""
+        info = {
+            "name": device.name,
+            "serial": device.key,
+            "status": device.status,
+            "version": device.version,
+            "sw_version": device.sw_version,
+            "last_active": _npa_time(device.last_active),
+        }
+        if isinstance(device, _SimulatedSensor):
+            info["battery_level"] = device.battery_level
+            return {"sensor": info}
+        info["zone_num"] = len(device.zones)
+        info["zones"] = list(device.zones.values())
+        return {"device": info}
+
+    @staticmethod
+    def _schedule(schedule_id, zone, source, start, minutes, now):
+        """Return the NPA schedule of a run, its status depending on now."""
+        end = start + datetime.timedelta(minutes=minutes)
+        if end <= now:
+            status = netrofunction.NETRO_SCHEDULE_EXECUTED
+        elif start <= now:
+            status = netrofunction.NETRO_SCHEDULE_EXECUTING
+        else:
+            status = netrofunction.NETRO_SCHEDULE_VALID
+        return {
+            "id": schedule_id,
+            "zone": zone,
+            "source": source,
+            "status": status,
+            "start_time": _npa_time(start),
+            "end_time": _npa_time(end),
+            "local_date": start.date().isoformat(),
+            "local_start_time": start.strftime("%H:%M:%S"),
+            "local_end_time": end.strftime("%H:%M:%S"),
+        }
+
+    def _schedules(self, device, params):
+        """Simulate schedules.json, a smart run per zone and per day."""
+        today = _utcnow().date()
+        start, end = self._period(
+            params,
+            today - datetime.timedelta(days=1),
+            today + datetime.timedelta(days=1),
+        )
+        zones = self._zones(device, params)
+        now = _utcnow()
+        schedules = []
+        for day in self._days(start, end):
+            if device.no_water_until is not None and day <= device.no_water_until:
+                continue
+            for zone in zones:
+                run_start = datetime.datetime.combine(
+                    day,
+                    datetime.time(SIMU_ZONE_RUN_HOUR),
+                    datetime.timezone.utc,
+                ) + datetime.timedelta(minutes=(zone - 1) * SIMU_ZONE_RUN_MINUTES)
+                schedules.append(
+                    self._schedule(
+                        day.toordinal() * 100 + zone,
+                        zone,
+                        "SMART",
+                        run_start,
+                        SIMU_ZONE_RUN_MINUTES,
+                        now,
+                    )
+                )
+        for schedule_id, zone, run_start, minutes in device.manual_schedules:
+            if zone in zones and start <= run_start.date() <= end:
+                schedules.append(
+                    self._schedule(schedule_id, zone, "MANUAL", run_start, minutes, now)
+                )
+        return {"schedules": schedules}
+
+    def _moistures(self, device, params):
+        """Simulate moistures.json, a daily estimation per zone."""
+        today = _utcnow().date()
+        start, end = self._period(
+            params, today - datetime.timedelta(days=SIMU_DEFAULT_DAYS), today
+        )
+        moistures = []
+        for day in self._days(start, min(end, today)):
+            for zone in self._zones(device, params):
+                moisture = device.moisture_overrides.get((zone, day))
+                if moisture is None:
+                    moisture = 30 + (day.toordinal() * 7 + zone * 13) % 40
+                moistures.append(
+                    {
+                        "id": day.toordinal() * 100 + zone,
+                        "zone": zone,
+                        "date": day.isoformat(),
+                        "moisture": moisture,
+                    }
+                )
+        return {"moistures": moistures}
+
+    def _sensor_data(self, device, params):
+        """Simulate sensor_data.json, a reading per SIMU_SENSOR_PERIOD."""
+        now = _utcnow()
+        start, end = self._period(params, now.date(), now.date())
+        first = int(
+            datetime.datetime.combine(
+                start, datetime.time(), datetime.timezone.utc
+            ).timestamp()
+        )
+        last = min(
+            int(
+                datetime.datetime.combine(
+                    end + datetime.timedelta(days=1),
+                    datetime.time(),
+                    datetime.timezone.utc,
+                ).timestamp()
+            ),
+            int(now.timestamp()) + 1,
+        )
+        readings = []
+        for timestamp in range(first, last, SIMU_SENSOR_PERIOD):
+            reading_time = datetime.datetime.fromtimestamp(
+                timestamp, datetime.timezone.utc
+            )
+            hour = reading_time.hour
+            celsius = round(12 + 8 * (1 - abs(hour - 14) / 12), 1)
+            readings.append(
+                {
+                    "id": timestamp // SIMU_SENSOR_PERIOD,
+                    "time": _npa_time(reading_time),
+                    "local_date": reading_time.date().isoformat(),
+                    "local_time": reading_time.strftime("%H:%M:%S"),
+                    "moisture": 30 + (timestamp // SIMU_SENSOR_PERIOD) % 25,
+                    "sunlight": max(0, 1000 - abs(hour - 13) * 150),
+                    "celsius": celsius,
+                    "fahrenheit": round(celsius * 9 / 5 + 32, 1),
+                    "battery_level": device.battery_level,
+                }
+            )
+        return {"sensor_data": readings}
+
+    def _events(self, device, params):
+        """Simulate events.json from the events recorded for the device."""
+        today = _utcnow().date()
+        start, end = self._period(
+            params, today - datetime.timedelta(days=SIMU_DEFAULT_DAYS), today
+        )
+        try:
+            event_type = int(params.get("event", 0))
+        except ValueError as exc:
+            raise self._parameter_error("Invalid event") from exc
+        events = [
+            event
+            for event in device.events
+            if start.isoformat() <= event["time"][:10] <= end.isoformat()
+            and (event_type == 0 or event["event"] == event_type)
+        ]
+        return {"events": events[::-1]}
+
+    def _water(self, device, params):
+        """Simulate water.json, running the zones consecutively."""
+        try:
+            minutes = int(params["duration"])
+            delay = int(params.get("delay", 0))
+        except (KeyError, ValueError) as exc:
+            raise self._parameter_error("Invalid duration or delay") from exc
+        run_start = _utcnow() + datetime.timedelta(minutes=delay)
+        if params.get("start_time"):
+            try:
+                run_start = datetime.datetime.fromisoformat(
+                    params["start_time"]
+                ).replace(tzinfo=datetime.timezone.utc)
+            except ValueError as exc:
+                raise self._parameter_error("Invalid start time") from exc
+        for zone in self._zones(device, params):
+            device.manual_schedules.append((next(self._ids), zone, run_start, minutes))
+            self._event(
+                device, netrofunction.NETRO_EVENT_SCHEDULESTART, f"zone {zone} watering"
+            )
+            run_start += datetime.timedelta(minutes=minutes)
+        return {}
+
+    def _stop_water(self, device, params):
+        """Simulate stop_water.json, dropping the manual runs not executed."""
+        now = _utcnow()
+        device.manual_schedules = [
+            run
+            for run in device.manual_schedules
+            if run[2] + datetime.timedelta(minutes=run[3]) <= now
+        ]
+        self._event(device, netrofunction.NETRO_EVENT_SCHEDULEEND, "watering stopped")
+        return {}
+
+    def _no_water(self, device, params):
+        """Simulate no_water.json."""
+        try:
+            days = int(params.get("days", 1))
+        except ValueError as exc:
+            raise self._parameter_error("Invalid days") from exc
+        device.no_water_until = _utcnow().date() + datetime.timedelta(days=days - 1)
+        return {}
+
+    def _set_moisture(self, device, params):
+        """Simulate set_moisture.json for today."""
+        try:
+            moisture = int(params["moisture"])
+        except (KeyError, ValueError) as exc:
+            raise self._parameter_error("Invalid moisture") from exc
+        if not 0 <= moisture <= 100:
+            raise self._parameter_error("Invalid moisture")
+        for zone in self._zones(device, params):
+            device.moisture_overrides[(zone, _utcnow().date())] = moisture
+        return {}
+
+    def _set_status(self, device, params):
+        """Simulate set_status.json."""
+        if params.get("status") not in ("0", "1"):
+            raise self._parameter_error("Invalid status")
+        device.status = "ONLINE" if params["status"] == "1" else "STANDBY"
+        self._event(
+            device,
+            (
+                netrofunction.NETRO_EVENT_DEVICEONLINE
+                if params["status"] == "1"
+                else netrofunction.NETRO_EVENT_DEVICEOFFLINE
+            ),
+            f"status set to {device.status}",
+        )
+        return {}
+
+    def _report_weather(self, device, params):
+        """Simulate report_weather.json."""
+        try:
+            date = datetime.date.fromisoformat(params["date"])
+        except (KeyError, ValueError) as exc:
+            raise self._parameter_error("Invalid date") from exc
+        device.weather[date] = {
+            name: value for name, value in params.items() if name not in ("key", "date")
+        }
+        return {}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """http handler of the simulator."""
+
+    protocol_version = "HTTP/1.1"
+    # headers and body are written separately, do not let them wait for an ack
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        """Log the requests in the simulator logger."""
+        logger.debug(format, *args)
+
+    def _reply(self, params):
+        """Simulate the request and send its response."""
+        url = urllib.parse.urlsplit(self.path)
+        endpoint = url.path.rsplit("/", 1)[-1]
+        status, response, latency = self.server.simulator.handle(endpoint, params)
+        if latency > 0:
+            time.sleep(latency)
+        body = (
+            response if isinstance(response, bytes) else json.dumps(response).encode()
+        )
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Serve a GET request."""
+        query = urllib.parse.urlsplit(self.path).query
+        self._reply(dict(urllib.parse.parse_qsl(query)))
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """Serve a POST request."""
+        length = int(self.headers.get("Content-Length", 0))
+        form = self.rfile.read(length).decode()
+        self._reply(dict(urllib.parse.parse_qsl(form)))
+
+
+def main(argv=None):
+    """Run a simulator until interrupted."""
+    parser = argparse.ArgumentParser(description="Netro Public API simulator")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9080)
+    parser.add_argument("--controllers", type=int, default=1)
+    parser.add_argument("--sensors", type=int, default=1)
+    parser.add_argument("--zones", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args(argv)
+    simulator = NetroSimulator(
+        args.host,
+        args.port,
+        latency=constant_latency(args.latency) if args.latency else None,
+        error_rate=args.error_rate,
+    )
+    for _ in range(args.controllers):
+        print("controller", simulator.add_controller(zones=args.zones))
+    for _ in range(args.sensors):
+        print("sensor", simulator.add_sensor())
+    print("url", simulator.start(), flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        simulator.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Tests of the AsyncNetroClient, run against the NPA simulator so that no real
+token is spent
+usage : python -m pytest test_async.py
+"""
+
+import asyncio
+import datetime
+
+import pytest
+
+import netrofunction
+import netrosimulator
+
+
+def _client(simulator, **kwargs):
+    """Return an asyncio client of the simulator."""
+    return netrofunction.AsyncNetroClient(
+        transport=simulator.transport(asynchronous=True), **kwargs
+    )
+
+
+def test_every_endpoint(simulator):
+    controller = simulator.add_controller(zones=2)
+    sensor = simulator.add_sensor()
+    today = datetime.date.today().isoformat()
+
+    async def scenario():
+        async with _client(simulator) as client:
+            info = await client.get_info(controller)
+            await client.set_status(controller, netrofunction.NETRO_STATUS_ENABLE)
+            await client.get_schedules(controller, ["1"])
+            await client.get_moistures(controller)
+            await client.report_weather(
+                controller, today, 1, 0, 10, 20, 12, 25, 8, 3, 60, 1013
+            )
+            await client.set_moisture(controller, 50, ["1", "2"])
+            await client.water(controller, 5, ["2"])
+            await client.stop_water(controller)
+            await client.no_water(controller, 1)
+            await client.get_events(controller)
+            await client.get_sensor_data(sensor)
+            return info
+
+    info = asyncio.run(scenario())
+    assert len(info["data"]["device"]["zones"]) == 2
+    assert set(simulator.requests) == {
+        netrofunction.NETRO_GET_INFO,
+        netrofunction.NETRO_POST_STATUS,
+        netrofunction.NETRO_GET_SCHEDULES,
+        netrofunction.NETRO_GET_MOISTURES,
+        netrofunction.NETRO_POST_REPORTWEATHER,
+        netrofunction.NETRO_POST_MOISTURE,
+        netrofunction.NETRO_POST_WATER,
+        netrofunction.NETRO_POST_STOPWATER,
+        netrofunction.NETRO_POST_NOWATER,
+        netrofunction.NETRO_GET_EVENTS,
+        netrofunction.NETRO_GET_SENSORDATA,
+    }
+
+
+def test_concurrent_requests(simulator):
+    simulator.latency = netrosimulator.constant_latency(0.1)
+    keys = [simulator.add_controller() for _ in range(10)]
+
+    async def scenario():
+        async with _client(simulator) as client:
+            return await asyncio.gather(*(client.get_info(key) for key in keys))
+
+    results = asyncio.run(asyncio.wait_for(scenario(), 0.5))
+    assert [result["data"]["device"]["serial"] for result in results] == keys
+
+
+def test_npa_error(simulator):
+    key = simulator.add_controller()
+    simulator.inject_error(netrofunction.NETRO_ERROR_CODE_INVALID_KEY)
+
+    async def scenario():
+        async with _client(simulator) as client:
+            with pytest.raises(netrofunction.NetroException) as error:
+                await client.get_info(key)
+            assert error.value.code == netrofunction.NETRO_ERROR_CODE_INVALID_KEY
+            return await client.get_info(key)
+
+    assert asyncio.run(scenario())["status"] == netrofunction.NETRO_OK
+
+
+def test_cancelled_request(simulator):
+    key = simulator.add_controller()
+
+    async def scenario():
+        async with _client(simulator) as client:
+            simulator.latency = netrosimulator.constant_latency(1)
+            with pytest.raises(asyncio.TimeoutError):
+                await asyncio.wait_for(client.get_info(key), 0.05)
+            # the client is still usable
+            simulator.latency = netrosimulator.constant_latency(0)
+            return await client.get_info(key)
+
+    assert asyncio.run(scenario())["status"] == netrofunction.NETRO_OK
+
+
+@pytest.mark.parametrize("name", sorted(netrofunction._ASYNC_TRANSPORTS))
+def test_named_transport(simulator, name):
+    key = simulator.add_controller()
+    simulator.start()
+
+    async def scenario():
+        async with netrofunction.AsyncNetroClient(
+            base_url=simulator.url, transport=name
+        ) as client:
+            return await asyncio.gather(client.get_info(key), client.get_info(key))
+
+    assert [result["status"] for result in asyncio.run(scenario())] == [
+        netrofunction.NETRO_OK
+    ] * 2
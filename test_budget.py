@@ -0,0 +1,192 @@
+"""
+Tests of the token budgets (RateLimiter, SharedQuota, RefreshCoordinator),
+run against the NPA simulator so that no real token is spent
+usage : python -m pytest test_budget.py
+"""
+
+import threading
+import time
+
+import pytest
+
+import netrofunction
+
+
+def _client(simulator, **kwargs):
+    """Return a client of the simulator."""
+    return netrofunction.NetroClient(transport=simulator.transport(), **kwargs)
+
+
+def _meta(remaining):
+    """Return the meta data of a NPA response."""
+    return {"token_limit": 2000, "token_remaining": remaining}
+
+
+def test_rate_limiter_unknown_budget():
+    limiter = netrofunction.RateLimiter()
+    assert limiter.remaining("key") is None
+    assert limiter.reserve("key", netrofunction.NETRO_GET_INFO) == 0
+
+
+def test_rate_limiter_burst_then_pacing():
+    limiter = netrofunction.RateLimiter(burst=3, max_wait=10**6)
+    limiter.record("key", _meta(1000))
+    for _ in range(3):
+        assert limiter.reserve("key", netrofunction.NETRO_GET_INFO) == 0
+    assert limiter.reserve("key", netrofunction.NETRO_GET_INFO) > 0
+    assert limiter.usage("key")["used"] == 4
+    assert limiter.remaining("key") == 996
+
+
+def test_rate_limiter_max_wait():
+    limiter = netrofunction.RateLimiter(burst=1, max_wait=1)
+    limiter.record("key", _meta(1000))
+    limiter.reserve("key", netrofunction.NETRO_GET_INFO)
+    with pytest.raises(netrofunction.NetroRateLimitError):
+        limiter.reserve("key", netrofunction.NETRO_GET_INFO)
+
+
+def test_rate_limiter_write_reserve():
+    limiter = netrofunction.RateLimiter(write_reserve=20)
+    limiter.record("key", _meta(20))
+    with pytest.raises(netrofunction.NetroRateLimitError):
+        limiter.reserve("key", netrofunction.NETRO_GET_INFO)
+    assert limiter.reserve("key", netrofunction.NETRO_POST_WATER) == 0
+    assert limiter.remaining("key") == 19
+
+
+def test_rate_limiter_exhausted(simulator):
+    key = simulator.add_controller()
+    limiter = netrofunction.RateLimiter()
+    client = _client(simulator, rate_limiter=limiter)
+    limiter.record_error(
+        key,
+        netrofunction.NetroException(
+            {
+                "errors": [
+                    {"code": netrofunction.NETRO_ERROR_CODE_EXCEED_LIMIT, "message": ""}
+                ]
+            }
+        ),
+    )
+    with pytest.raises(netrofunction.NetroRateLimitError):
+        client.stop_water(key)
+    assert simulator.requests == {}
+
+
+def test_rate_limiter_records_responses(simulator):
+    key = simulator.add_controller()
+    limiter = netrofunction.RateLimiter()
+    client = _client(simulator, rate_limiter=limiter)
+    client.get_info(key)
+    assert limiter.remaining(key) == simulator.devices[key].token_remaining
+
+
+def test_shared_quota_budget(tmp_path):
+    path = tmp_path / "quota.db"
+    first = netrofunction.SharedQuota(path, burst=3, max_wait=1)
+    second = netrofunction.SharedQuota(path, burst=3, max_wait=1)
+    try:
+        first.record("key", _meta(1000))
+        assert second.remaining("key") == 1000
+        for quota in (first, second, first):
+            assert quota.reserve("key", netrofunction.NETRO_GET_INFO) == 0
+        # the burst is shared
+        with pytest.raises(netrofunction.NetroRateLimitError):
+            second.reserve("key", netrofunction.NETRO_GET_INFO)
+        assert first.usage("key")["used"] == 3
+        assert first.remaining("key") == 997
+    finally:
+        first.close()
+        second.close()
+
+
+def test_shared_quota_info_cache(tmp_path):
+    path = tmp_path / "quota.db"
+    first = netrofunction.SharedQuota(path)
+    second = netrofunction.SharedQuota(path)
+    payload = {"key": "key"}
+    result = {"status": "OK", "data": {}}
+    try:
+        first.put(netrofunction.NETRO_GET_INFO, payload, result)
+        assert second.get(netrofunction.NETRO_GET_INFO, payload) == result
+        generation = first.generation("key")
+        second.invalidate("key")
+        assert first.get(netrofunction.NETRO_GET_INFO, payload) is None
+        # a result read before the invalidation is not shared
+        first.put(netrofunction.NETRO_GET_INFO, payload, result, generation)
+        assert second.get(netrofunction.NETRO_GET_INFO, payload) is None
+    finally:
+        first.close()
+        second.close()
+
+
+def test_refresh_coordinator_refreshes_the_due_endpoints(simulator):
+    key = simulator.add_controller()
+    outcomes = []
+    coordinator = netrofunction.RefreshCoordinator(
+        _client(simulator),
+        callback=lambda endpoint, outcome: outcomes.append((endpoint, outcome)),
+        stagger=0,
+    )
+    coordinator.add(key, {netrofunction.NETRO_GET_INFO: 600})
+    now = time.time() + 1
+    assert [endpoint for endpoint, _ in coordinator.refresh_due(now)] == [
+        netrofunction.NETRO_GET_INFO
+    ]
+    assert outcomes[0][1].error is None
+    assert coordinator.remaining(key) == simulator.devices[key].token_remaining
+    # not due again before its period
+    assert not coordinator.refresh_due(now + 1)
+    assert 0 < coordinator.next_due() <= 600
+
+
+def test_refresh_coordinator_plan_follows_the_budget():
+    coordinator = netrofunction.RefreshCoordinator(
+        netrofunction.NetroClient(transport=netrofunction.MemoryTransport(None)),
+        reserve=20,
+    )
+    coordinator.add("key", {netrofunction.NETRO_GET_INFO: 60})
+    # five minutes before the daily reset: 5 refreshes needed
+    now = time.time() // 86400 * 86400 + 86400 - 300
+    coordinator._remaining["key"] = 1000  # pylint: disable=protected-access
+    assert coordinator.periods("key", now) == {netrofunction.NETRO_GET_INFO: 60}
+    # half the tokens needed: twice the period
+    coordinator._remaining["key"] = 22.5  # pylint: disable=protected-access
+    assert coordinator.periods("key", now) == {netrofunction.NETRO_GET_INFO: 120}
+    # only the reserve left: suspended
+    coordinator._remaining["key"] = 20  # pylint: disable=protected-access
+    assert coordinator.periods("key", now) == {netrofunction.NETRO_GET_INFO: None}
+
+
+def test_refresh_coordinator_removed_key(simulator):
+    keys = [simulator.add_controller() for _ in range(2)]
+    coordinator = netrofunction.RefreshCoordinator(
+        _client(simulator),
+        # the first refresh removes the other key
+        callback=lambda endpoint, outcome: coordinator.remove(
+            keys[1] if outcome.key == keys[0] else keys[0]
+        ),
+        stagger=0,
+    )
+    for key in keys:
+        coordinator.add(key, {netrofunction.NETRO_GET_INFO: 600})
+    assert len(coordinator.refresh_due(time.time() + 1)) == 1
+    assert len(coordinator.plan()) == 1
+
+
+def test_refresh_coordinator_thread_survives_a_failure(simulator, caplog):
+    key = simulator.add_controller()
+    coordinator = netrofunction.RefreshCoordinator(_client(simulator), stagger=0)
+    refresh_due = coordinator.refresh_due
+    refreshed = threading.Event()
+
+    def failing_once():
+        coordinator.refresh_due = lambda: refreshed.set() or refresh_due()
+        raise RuntimeError("refresh failure")
+
+    coordinator.refresh_due = failing_once
+    with coordinator:
+        coordinator.add(key, {netrofunction.NETRO_GET_INFO: 600})
+        assert refreshed.wait(5)
+    assert "refresh of the keys failed" in caplog.text
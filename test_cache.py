@@ -0,0 +1,73 @@
+"""
+Tests of the response cache (ResponseCache), run against the NPA
+simulator so that no real token is spent
+usage : python -m pytest test_cache.py
+"""
+
+import time
+
+import pytest
+
+import netrofunction
+
+
+def _client(simulator, **kwargs):
+    """Return a client of the simulator."""
+    return netrofunction.NetroClient(transport=simulator.transport(), **kwargs)
+
+
+def test_cache_invalidated_by_writes(simulator):
+    key = simulator.add_controller()
+    client = _client(simulator, cache=netrofunction.ResponseCache())
+    first = client.get_info(key)
+    assert client.get_info(key) is first
+    assert simulator.requests[netrofunction.NETRO_GET_INFO] == 1
+    client.set_status(key, 0)
+    assert (
+        client.get_info(key)["data"]["device"]["status"]
+        != first["data"]["device"]["status"]
+    )
+    assert simulator.requests[netrofunction.NETRO_GET_INFO] == 2
+
+
+def test_cache_invalidated_by_failed_writes(simulator):
+    key = simulator.add_controller()
+    client = _client(simulator, cache=netrofunction.ResponseCache())
+    client.get_info(key)
+    simulator.inject_http_error(500)
+    with pytest.raises(netrofunction.NetroHTTPError):
+        client.stop_water(key)
+    client.get_info(key)
+    assert simulator.requests[netrofunction.NETRO_GET_INFO] == 2
+
+
+def test_cache_ttl_and_size():
+    cache = netrofunction.ResponseCache(
+        ttls={netrofunction.NETRO_GET_INFO: 0.05}, maxsize=2
+    )
+    for key in ("a", "b", "c"):
+        cache.put(netrofunction.NETRO_GET_INFO, {"key": key}, key)
+    assert cache.get(netrofunction.NETRO_GET_INFO, {"key": "a"}) is None
+    assert cache.get(netrofunction.NETRO_GET_INFO, {"key": "c"}) == "c"
+    # endpoints without ttl are not cached
+    cache.put(netrofunction.NETRO_GET_EVENTS, {"key": "c"}, "c")
+    assert cache.get(netrofunction.NETRO_GET_EVENTS, {"key": "c"}) is None
+    time.sleep(0.06)
+    assert cache.get(netrofunction.NETRO_GET_INFO, {"key": "c"}) is None
+
+
+def test_cache_read_completed_after_write():
+    cache = netrofunction.ResponseCache()
+    payload = {"key": "a"}
+    generation = cache.generation("a")
+    cache.invalidate("a")
+    cache.put(netrofunction.NETRO_GET_INFO, payload, "stale", generation)
+    assert cache.get(netrofunction.NETRO_GET_INFO, payload) is None
+    generation = cache.generation("a")
+    cache.invalidate("b")
+    cache.put(netrofunction.NETRO_GET_INFO, payload, "fresh", generation)
+    assert cache.get(netrofunction.NETRO_GET_INFO, payload) == "fresh"
+    generation = cache.generation("a")
+    cache.invalidate()
+    cache.put(netrofunction.NETRO_GET_INFO, payload, "stale", generation)
+    assert cache.get(netrofunction.NETRO_GET_INFO, payload) is None
@@ -0,0 +1,136 @@
+"""
+Tests of the batch command line (read_batch, run_batch and main), run against
+the NPA simulator so that no real token is spent
+usage : python -m pytest test_cli.py
+"""
+
+import json
+import threading
+
+import netrofunction
+import netrosimulator
+
+
+def _batch(tmp_path, *commands):
+    path = tmp_path / "batch.ndjson"
+    path.write_text(
+        "\n".join(
+            command if isinstance(command, str) else json.dumps(command)
+            for command in commands
+        )
+        + "\n",
+        encoding="utf-8",
+    )
+    return path
+
+
+def _records(path):
+    return [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+
+
+def test_read_batch_validation():
+    commands = list(
+        netrofunction.read_batch(
+            [
+                "# a comment",
+                "",
+                '{"endpoint": "info", "key": "k1", "id": 7}',
+                "not json",
+                '{"endpoint": "unknown", "key": "k1"}',
+                '{"endpoint": "info"}',
+                '{"endpoint": "info", "key": "k1", "params": []}',
+                '{"endpoint": "events", "key": "k1", "params": {"stream": true}}',
+            ]
+        )
+    )
+    assert [command["line"] for command in commands] == [3, 4, 5, 6, 7, 8]
+    assert commands[0] == {
+        "endpoint": "info",
+        "key": "k1",
+        "id": 7,
+        "params": {},
+        "line": 3,
+    }
+    assert all(command["endpoint"] is None for command in commands[1:])
+    assert "stream" in commands[-1]["error"]
+
+
+def test_run_batch_keeps_the_order_of_a_key(simulator):
+    simulator.latency = netrosimulator.constant_latency(0.005)
+    keys = [simulator.add_controller() for _ in range(3)]
+    commands = [
+        {"endpoint": "info", "key": key, "params": {}, "line": line, "id": line}
+        for line, key in enumerate(keys * 4)
+    ]
+    client = netrofunction.NetroClient(transport=simulator.transport())
+    outcomes = list(netrofunction.run_batch(iter(commands), client, max_workers=3))
+    assert sorted(outcome.command["line"] for outcome in outcomes) == list(range(12))
+    for key in keys:
+        lines = [
+            outcome.command["line"]
+            for outcome in outcomes
+            if outcome.command["key"] == key
+        ]
+        assert lines == sorted(lines)
+
+
+def test_run_batch_runs_the_commands_as_they_are_read(simulator):
+    key = simulator.add_controller()
+    first_done = threading.Event()
+
+    def commands():
+        yield {"endpoint": "info", "key": key, "params": {}, "line": 1}
+        # the rest of the batch is not read yet: like a pipe still open
+        assert first_done.wait(5)
+        yield {"endpoint": "schedules", "key": key, "params": {}, "line": 2}
+
+    client = netrofunction.NetroClient(transport=simulator.transport())
+    lines = []
+    for outcome in netrofunction.run_batch(commands(), client):
+        assert outcome.error is None
+        lines.append(outcome.command["line"])
+        first_done.set()
+    assert lines == [1, 2]
+
+
+def test_main_writes_a_record_per_command(simulator, tmp_path):
+    key = simulator.add_controller(zones=2)
+    simulator.start()
+    batch = _batch(
+        tmp_path,
+        {"endpoint": "info", "key": key, "id": "a"},
+        {"endpoint": "schedules", "key": key},
+        {"endpoint": "info", "key": key, "params": {"stream": True}},
+    )
+    output = tmp_path / "output.ndjson"
+    status = netrofunction.main(
+        [str(batch), "--output", str(output), "--url", simulator.url]
+    )
+    records = sorted(_records(output), key=lambda record: record["line"])
+    assert status == 1
+    assert [record["ok"] for record in records] == [True, True, False]
+    assert records[0]["id"] == "a"
+    assert len(records[0]["result"]["data"]["device"]["zones"]) == 2
+    assert records[2]["error"]["type"] == "ValueError"
+
+
+def test_main_reports_a_result_that_is_not_json(simulator, tmp_path, monkeypatch):
+    key = simulator.add_controller()
+    simulator.start()
+    monkeypatch.setattr(
+        netrofunction.NetroClient, "get_info", lambda self, key: object()
+    )
+    output = tmp_path / "output.ndjson"
+    status = netrofunction.main(
+        [
+            str(_batch(tmp_path, {"endpoint": "info", "key": key})),
+            "--output",
+            str(output),
+            "--url",
+            simulator.url,
+        ]
+    )
+    (record,) = _records(output)
+    assert status == 1
+    assert not record["ok"]
+    assert record["error"]["type"] == "TypeError"
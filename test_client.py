@@ -0,0 +1,152 @@
+"""
+Tests of the NetroClient, run against the NPA simulator or an in-memory
+transport so that no real token is spent
+usage : python -m pytest test_client.py
+"""
+
+import asyncio
+import json
+import sys
+
+import pytest
+import requests
+
+import netrofunction
+
+
+def _answering(*responses):
+    """Return a client whose requests get the given (status, body) responses."""
+    responses = list(responses)
+    return netrofunction.NetroClient(
+        transport=netrofunction.MemoryTransport(lambda *request: responses.pop(0)),
+        retry_policy=netrofunction.RetryPolicy(backoff=0.001),
+    )
+
+
+def _ok(data):
+    """Return a NPA response of the given data."""
+    return {"status": netrofunction.NETRO_OK, "meta": {}, "data": data}
+
+
+# pooled session
+
+
+def test_calls_share_a_keep_alive_connection(simulator):
+    key = simulator.add_controller()
+    simulator.start()
+    pools = set()
+    with netrofunction.NetroClient(base_url=simulator.url) as client:
+        client.session.hooks["response"].append(
+            lambda response, **kwargs: pools.add(
+                response.raw._pool  # pylint: disable=protected-access
+            )
+        )
+        for _ in range(5):
+            client.get_info(key)
+        (pool,) = pools
+        assert pool.num_connections == 1
+    assert simulator.requests == {netrofunction.NETRO_GET_INFO: 5}
+
+
+def test_provided_session(simulator):
+    key = simulator.add_controller()
+    simulator.start()
+    session = requests.Session()
+    client = netrofunction.NetroClient(base_url=simulator.url, session=session)
+    assert client.session is session
+    assert client.get_info(key)["status"] == netrofunction.NETRO_OK
+    session.close()
+
+
+def test_default_client_of_the_module_functions(simulator):
+    key = simulator.add_controller()
+    previous = netrofunction.get_default_client()
+    netrofunction.set_default_client(
+        netrofunction.NetroClient(transport=simulator.transport())
+    )
+    try:
+        assert netrofunction.get_default_client() is netrofunction.get_default_client()
+        assert netrofunction.get_info(key)["status"] == netrofunction.NETRO_OK
+    finally:
+        netrofunction.set_default_client(previous)
+    assert simulator.requests == {netrofunction.NETRO_GET_INFO: 1}
+
+
+# response processing
+
+
+def test_npa_error_envelope():
+    client = _answering(
+        (200, {"status": "ERROR", "errors": [{"code": 1, "message": "Invalid key"}]})
+    )
+    with pytest.raises(netrofunction.NetroException) as error:
+        client.get_info("key")
+    assert (error.value.code, error.value.message) == (1, "Invalid key")
+
+
+def test_http_error_of_a_gateway_is_retried():
+    gateway = (503, {"message": "Service Unavailable"})
+    client = _answering(gateway, (502, "<html>bad gateway</html>"), (200, _ok({})))
+    assert client.get_info("key") == _ok({})
+    assert len(client.transport.requests) == 3
+    client = _answering(gateway, gateway, gateway)
+    with pytest.raises(netrofunction.NetroHTTPError) as error:
+        client.get_info("key")
+    assert error.value.status == 503
+
+
+def test_not_a_npa_response():
+    with pytest.raises(ValueError):
+        _answering((200, [1, 2])).get_info("key")
+    with pytest.raises(ValueError):
+        _answering((200, "not json")).get_info("key")
+
+
+def test_pluggable_json_decoder():
+    decoded = []
+
+    def decoder(content):
+        decoded.append(content)
+        return json.loads(content)
+
+    netrofunction.set_json_decoder(decoder)
+    try:
+        assert _answering((200, _ok({"device": {}}))).get_info("key") == _ok(
+            {"device": {}}
+        )
+    finally:
+        netrofunction.set_json_decoder()
+    assert len(decoded) == 1
+
+
+# transports
+
+
+@pytest.mark.parametrize("name", sorted(netrofunction._TRANSPORTS))
+def test_named_transport(simulator, name):
+    key = simulator.add_controller(zones=2)
+    simulator.start()
+    with netrofunction.NetroClient(base_url=simulator.url, transport=name) as client:
+        assert len(client.get_info(key)["data"]["device"]["zones"]) == 2
+        client.water(key, 1, zone_ids=["1"])
+    assert simulator.requests[netrofunction.NETRO_POST_WATER] == 1
+
+
+def test_httpx_transports_without_h2(simulator, monkeypatch):
+    # as if the h2 package was not installed
+    monkeypatch.setitem(sys.modules, "h2", None)
+    key = simulator.add_controller()
+    simulator.start()
+    transport = netrofunction.HttpxTransport()
+    with netrofunction.NetroClient(
+        base_url=simulator.url, transport=transport
+    ) as client:
+        assert client.get_info(key)["status"] == netrofunction.NETRO_OK
+
+    async def scenario():
+        async with netrofunction.AsyncNetroClient(
+            base_url=simulator.url, transport=netrofunction.AsyncHttpxTransport()
+        ) as client:
+            return await client.get_info(key)
+
+    assert asyncio.run(scenario())["status"] == netrofunction.NETRO_OK
@@ -0,0 +1,88 @@
+"""
+Tests of the coalescing of identical in-flight reads, run against the NPA
+simulator so that no real token is spent
+usage : python -m pytest test_coalescing.py
+"""
+
+import asyncio
+import concurrent.futures
+
+import pytest
+
+import netrofunction
+import netrosimulator
+
+
+def test_identical_reads_share_a_request(simulator):
+    key = simulator.add_controller()
+    simulator.latency = netrosimulator.constant_latency(0.1)
+    client = netrofunction.NetroClient(transport=simulator.transport(), coalesce=True)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
+        results = list(executor.map(lambda _: client.get_info(key), range(5)))
+        # different parameters, different requests
+        list(executor.map(lambda zone: client.get_moistures(key, [zone]), "12"))
+    assert all(result is results[0] for result in results)
+    assert simulator.requests == {
+        netrofunction.NETRO_GET_INFO: 1,
+        netrofunction.NETRO_GET_MOISTURES: 2,
+    }
+
+
+def test_identical_reads_share_an_error(simulator):
+    key = simulator.add_controller()
+    simulator.latency = netrosimulator.constant_latency(0.1)
+    simulator.inject_error(netrofunction.NETRO_ERROR_CODE_INTERNAL_ERROR)
+    client = netrofunction.NetroClient(transport=simulator.transport(), coalesce=True)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
+        futures = [executor.submit(client.get_info, key) for _ in range(3)]
+    for future in futures:
+        assert isinstance(future.exception(), netrofunction.NetroException)
+    assert simulator.requests == {netrofunction.NETRO_GET_INFO: 1}
+
+
+def test_writes_are_not_coalesced(simulator):
+    key = simulator.add_controller()
+    simulator.latency = netrosimulator.constant_latency(0.05)
+    client = netrofunction.NetroClient(transport=simulator.transport(), coalesce=True)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        list(executor.map(lambda _: client.stop_water(key), range(2)))
+    assert simulator.requests == {netrofunction.NETRO_POST_STOPWATER: 2}
+
+
+def _async_client(simulator):
+    """Return a coalescing async client of the simulator."""
+    return netrofunction.AsyncNetroClient(
+        transport=simulator.transport(asynchronous=True), coalesce=True
+    )
+
+
+def test_async_identical_reads_share_a_request(simulator):
+    key = simulator.add_controller()
+    simulator.latency = netrosimulator.constant_latency(0.05)
+
+    async def scenario():
+        async with _async_client(simulator) as client:
+            return await asyncio.gather(*(client.get_info(key) for _ in range(5)))
+
+    results = asyncio.run(scenario())
+    assert all(result is results[0] for result in results)
+    assert simulator.requests == {netrofunction.NETRO_GET_INFO: 1}
+
+
+def test_async_cancelled_caller(simulator):
+    key = simulator.add_controller()
+    simulator.latency = netrosimulator.constant_latency(0.1)
+
+    async def scenario():
+        async with _async_client(simulator) as client:
+            leader = asyncio.create_task(client.get_info(key))
+            await asyncio.sleep(0.01)
+            follower = asyncio.create_task(client.get_info(key))
+            await asyncio.sleep(0.01)
+            leader.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await leader
+            return await follower
+
+    assert asyncio.run(scenario())["status"] == netrofunction.NETRO_OK
+    assert simulator.requests == {netrofunction.NETRO_GET_INFO: 1}
@@ -0,0 +1,96 @@
+"""
+Tests of the event change feed (EventWatcher), run against the NPA simulator
+so that no real token is spent
+usage : python -m pytest test_events.py
+"""
+
+import datetime
+import threading
+
+import netrofunction
+
+
+def _client(simulator, **kwargs):
+    """Return a client of the simulator."""
+    return netrofunction.NetroClient(transport=simulator.transport(), **kwargs)
+
+
+def _second_ago():
+    """Return the UTC datetime of the previous second."""
+    return datetime.datetime.now(datetime.timezone.utc).replace(
+        microsecond=0
+    ) - datetime.timedelta(seconds=1)
+
+
+def test_poll_dispatches_the_new_events_once(simulator):
+    key = simulator.add_controller(zones=2)
+    client = _client(simulator)
+    watcher = netrofunction.EventWatcher(client, schedule_refresh=None)
+    received, ends = [], []
+    watcher.subscribe(lambda key, event: received.append((key, event)))
+    watcher.subscribe(
+        lambda key, event: ends.append(event),
+        [netrofunction.NETRO_EVENT_SCHEDULEEND],
+    )
+    watcher.watch(key, since=_second_ago())
+    client.water(key, 5, ["1"])
+    (start,) = watcher.poll(key)
+    assert isinstance(start, netrofunction.Event)
+    assert start.event == netrofunction.NETRO_EVENT_SCHEDULESTART
+    assert not watcher.poll(key)
+    client.stop_water(key)
+    (end,) = watcher.poll(key)
+    assert end.event == netrofunction.NETRO_EVENT_SCHEDULEEND
+    assert received == [(key, start), (key, end)]
+    assert ends == [end]
+    assert watcher.last_event(key) == end
+
+
+def test_events_before_watching_are_not_dispatched(simulator):
+    key = simulator.add_controller()
+    client = _client(simulator)
+    client.set_status(key, netrofunction.NETRO_STATUS_DISABLE)
+    watcher = netrofunction.EventWatcher(client, schedule_refresh=None)
+    watcher.watch(key, since=_second_ago() + datetime.timedelta(hours=1))
+    assert not watcher.poll(key)
+    assert watcher.last_event(key).event == netrofunction.NETRO_EVENT_DEVICEOFFLINE
+
+
+def test_polling_interval_adapts(simulator):
+    key = simulator.add_controller(zones=2)
+    client = _client(simulator)
+    watcher = netrofunction.EventWatcher(
+        client, min_interval=10, max_interval=60, schedule_refresh=None
+    )
+    watcher.watch(key)
+    intervals = []
+    for _ in range(4):
+        watcher.poll(key)
+        intervals.append(watcher.next_interval(key))
+    # less and less often while nothing happens
+    assert intervals == [20, 40, 60, 60]
+    client.set_status(key, netrofunction.NETRO_STATUS_DISABLE)
+    watcher.poll(key)
+    assert watcher.next_interval(key) == 10
+    # as often as possible while watering
+    watcher = netrofunction.EventWatcher(
+        client, min_interval=10, max_interval=60, schedule_refresh=0
+    )
+    watcher.watch(key)
+    client.water(key, 5, ["2"])
+    for _ in range(3):
+        watcher.poll(key)
+    assert watcher.next_interval(key) == 10
+
+
+def test_background_polling(simulator):
+    key = simulator.add_controller()
+    client = _client(simulator)
+    received = threading.Event()
+    with netrofunction.EventWatcher(
+        client, min_interval=0.01, max_interval=0.05, schedule_refresh=None
+    ) as watcher:
+        watcher.subscribe(lambda key, event: received.set())
+        watcher.watch(key, since=_second_ago())
+        client.set_status(key, netrofunction.NETRO_STATUS_ENABLE)
+        assert received.wait(5)
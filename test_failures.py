@@ -0,0 +1,173 @@
+"""
+Tests of the retries and of the circuit breaker (RetryPolicy,
+CircuitBreaker), run against the NPA simulator so that no real token is spent
+usage : python -m pytest test_failures.py
+"""
+
+import asyncio
+import time
+
+import pytest
+
+import netrofunction
+import netrosimulator
+
+# host of the circuit of the clients using the in-memory transport
+NPA_HOST = "api.netrohome.com"
+
+
+def _client(simulator, **kwargs):
+    """Return a client of the simulator."""
+    return netrofunction.NetroClient(transport=simulator.transport(), **kwargs)
+
+
+def _meta(remaining):
+    """Return the meta data of a NPA response."""
+    return {"token_limit": 2000, "token_remaining": remaining}
+
+
+def test_retry_transient_errors(simulator):
+    key = simulator.add_controller()
+    client = _client(simulator, retry_policy=netrofunction.RetryPolicy(backoff=0.001))
+    simulator.inject_http_error(503, count=2)
+    assert client.get_info(key)["status"] == netrofunction.NETRO_OK
+    assert simulator.requests[netrofunction.NETRO_GET_INFO] == 3
+
+
+def test_retry_gives_up(simulator):
+    key = simulator.add_controller()
+    client = _client(
+        simulator, retry_policy=netrofunction.RetryPolicy(max_attempts=2, backoff=0.001)
+    )
+    simulator.inject_error(netrofunction.NETRO_ERROR_CODE_INTERNAL_ERROR, count=2)
+    with pytest.raises(netrofunction.NetroException):
+        client.get_info(key)
+    assert simulator.requests[netrofunction.NETRO_GET_INFO] == 2
+
+
+def test_retry_not_for_sent_water_nor_client_errors(simulator):
+    key = simulator.add_controller()
+    client = _client(simulator, retry_policy=netrofunction.RetryPolicy(backoff=0.001))
+    simulator.inject_http_error(503)
+    with pytest.raises(netrofunction.NetroHTTPError):
+        client.water(key, 1, ["1"])
+    assert simulator.requests[netrofunction.NETRO_POST_WATER] == 1
+    with pytest.raises(netrofunction.NetroException):
+        client.get_info("unknown")
+    assert simulator.requests[netrofunction.NETRO_GET_INFO] == 1
+
+
+def test_retry_delay():
+    policy = netrofunction.RetryPolicy(max_attempts=3, backoff=1, max_backoff=1.5)
+    error = netrofunction.NetroHTTPError(503, "url")
+    assert 0 <= policy.retry_delay(netrofunction.NETRO_GET_INFO, error, 2) <= 1.5
+    assert policy.retry_delay(netrofunction.NETRO_GET_INFO, error, 3) is None
+    assert (
+        policy.retry_delay(
+            netrofunction.NETRO_GET_INFO, netrofunction.NetroHTTPError(404, "url"), 1
+        )
+        is None
+    )
+
+
+def test_circuit_breaker_opens_without_spending_tokens(simulator):
+    key = simulator.add_controller()
+    limiter = netrofunction.RateLimiter(max_wait=3)
+    breaker = netrofunction.CircuitBreaker(failure_threshold=3, reset_timeout=60)
+    client = _client(simulator, rate_limiter=limiter, circuit_breaker=breaker)
+    client.get_info(key)
+    simulator.inject_http_error(503, count=3)
+    for _ in range(3):
+        with pytest.raises(netrofunction.NetroHTTPError):
+            client.get_info(key)
+    assert breaker.is_open(NPA_HOST)
+    used = limiter.usage(key)["used"]
+    for _ in range(5):
+        with pytest.raises(netrofunction.NetroCircuitOpenError):
+            client.get_info(key)
+    assert limiter.usage(key)["used"] == used
+    assert simulator.requests[netrofunction.NETRO_GET_INFO] == 4
+
+
+def test_circuit_breaker_trial(simulator):
+    key = simulator.add_controller()
+    breaker = netrofunction.CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    client = _client(simulator, circuit_breaker=breaker)
+    simulator.inject_http_error(503)
+    with pytest.raises(netrofunction.NetroHTTPError):
+        client.get_info(key)
+    with pytest.raises(netrofunction.NetroCircuitOpenError):
+        client.get_info(key)
+    time.sleep(0.06)
+    # the trial fails, the circuit opens again
+    simulator.inject_http_error(503)
+    with pytest.raises(netrofunction.NetroHTTPError):
+        client.get_info(key)
+    assert breaker.is_open(NPA_HOST)
+    time.sleep(0.06)
+    client.get_info(key)
+    assert not breaker.is_open(NPA_HOST)
+
+
+def test_circuit_breaker_trial_refused_by_limiter(simulator):
+    key = simulator.add_controller()
+    limiter = netrofunction.RateLimiter()
+    breaker = netrofunction.CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    client = _client(simulator, rate_limiter=limiter, circuit_breaker=breaker)
+    simulator.inject_http_error(503)
+    with pytest.raises(netrofunction.NetroHTTPError):
+        client.get_info(key)
+    time.sleep(0.06)
+    limiter.record(key, _meta(0))
+    with pytest.raises(netrofunction.NetroRateLimitError):
+        client.get_info(key)
+    # the trial is given back
+    assert not breaker.is_open(NPA_HOST)
+    limiter.record(key, _meta(1000))
+    client.get_info(key)
+    assert not breaker.is_open(NPA_HOST)
+
+
+def test_circuit_breaker_trial_cancelled(simulator):
+    key = simulator.add_controller()
+    breaker = netrofunction.CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+
+    async def scenario():
+        async with netrofunction.AsyncNetroClient(
+            transport=simulator.transport(asynchronous=True), circuit_breaker=breaker
+        ) as client:
+            simulator.inject_http_error(503)
+            with pytest.raises(netrofunction.NetroHTTPError):
+                await client.get_info(key)
+            await asyncio.sleep(0.06)
+            # the trial is cancelled before its response
+            simulator.latency = netrosimulator.constant_latency(1)
+            with pytest.raises(asyncio.TimeoutError):
+                await asyncio.wait_for(client.get_info(key), 0.05)
+            assert not breaker.is_open(NPA_HOST)
+            simulator.latency = None
+            await client.get_info(key)
+
+    asyncio.run(scenario())
+    assert not breaker.is_open(NPA_HOST)
+
+
+def test_circuit_breaker_trial_interrupted(simulator):
+    key = simulator.add_controller()
+    breaker = netrofunction.CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    client = _client(simulator, circuit_breaker=breaker)
+    simulator.inject_http_error(503)
+    with pytest.raises(netrofunction.NetroHTTPError):
+        client.get_info(key)
+    time.sleep(0.06)
+
+    def interrupt(rng):
+        raise KeyboardInterrupt
+
+    simulator.latency = interrupt
+    with pytest.raises(KeyboardInterrupt):
+        client.get_info(key)
+    assert not breaker.is_open(NPA_HOST)
+    simulator.latency = None
+    client.get_info(key)
+    assert not breaker.is_open(NPA_HOST)
@@ -0,0 +1,87 @@
+"""
+Tests of the concurrent requests over a fleet of devices (Fleet), run against
+the NPA simulator so that no real token is spent
+usage : python -m pytest test_fleet.py
+"""
+
+import threading
+
+import netrofunction
+
+
+def _blocking_client(released):
+    """Return a client whose requests of the "slow" key wait for released,
+    and the concurrency it reached by key."""
+    lock = threading.Lock()
+    running, reached = {}, {}
+
+    def handler(method, url, params):
+        del method, url
+        key = params["key"]
+        with lock:
+            running[key] = running.get(key, 0) + 1
+            reached[key] = max(reached.get(key, 0), running[key])
+        if key == "slow":
+            released.wait(5)
+        with lock:
+            running[key] -= 1
+        return 200, {"status": netrofunction.NETRO_OK, "meta": {}, "data": {}}
+
+    client = netrofunction.NetroClient(transport=netrofunction.MemoryTransport(handler))
+    return client, reached
+
+
+def test_fleet_fetch(simulator):
+    keys = [simulator.add_controller(zones=zones) for zones in (1, 2, 3)]
+    simulator.inject_error(netrofunction.NETRO_ERROR_CODE_INVALID_KEY, key=keys[1])
+    client = netrofunction.NetroClient(transport=simulator.transport())
+    with netrofunction.Fleet(client, max_workers=2) as fleet:
+        outcomes = fleet.fetch("info", keys)
+    assert sorted(outcomes) == sorted(keys)
+    assert len(outcomes[keys[2]].result["data"]["device"]["zones"]) == 3
+    assert isinstance(outcomes[keys[1]].error, netrofunction.NetroException)
+    assert outcomes[keys[1]].result is None
+
+
+def test_fleet_queued_requests_of_a_key_hold_no_worker():
+    released = threading.Event()
+    client, reached = _blocking_client(released)
+    try:
+        with netrofunction.Fleet(client, max_workers=2) as fleet:
+            slow = fleet.submit("info", ["slow"] * 4)
+            # the other key gets the second worker
+            (fast,) = fleet.submit("info", ["fast"])
+            assert fast.result(timeout=5)["status"] == netrofunction.NETRO_OK
+            assert not any(future.done() for future in slow)
+            released.set()
+            for future in slow:
+                future.result(timeout=5)
+    finally:
+        released.set()
+    assert reached == {"slow": 1, "fast": 1}
+
+
+def test_fleet_per_key_limit():
+    released = threading.Event()
+    client, reached = _blocking_client(released)
+    try:
+        with netrofunction.Fleet(client, max_workers=4, per_key_limit=2) as fleet:
+            futures = fleet.submit("info", ["slow"] * 5)
+            released.set()
+            for future in futures:
+                future.result(timeout=5)
+    finally:
+        released.set()
+    assert reached == {"slow": 2}
+
+
+def test_fleet_timeout():
+    released = threading.Event()
+    client, _ = _blocking_client(released)
+    try:
+        with netrofunction.Fleet(client, max_workers=2) as fleet:
+            outcomes = fleet.fetch("info", ["slow", "fast", "slow"], timeout=0.2)
+    finally:
+        released.set()
+    assert outcomes["fast"].error is None
+    assert isinstance(outcomes["slow"].error, TimeoutError)
@@ -0,0 +1,113 @@
+"""
+Tests of the local history (HistoryStore), run against the NPA
+simulator so that no real token is spent
+usage : python -m pytest test_history.py
+"""
+
+import datetime
+
+import pytest
+
+import netrofunction
+
+
+def _client(simulator, **kwargs):
+    """Return a client of the simulator."""
+    return netrofunction.NetroClient(transport=simulator.transport(), **kwargs)
+
+
+def _days_ago(days):
+    """Return the yyyy-mm-dd date of days ago."""
+    return (datetime.date.today() - datetime.timedelta(days=days)).isoformat()
+
+
+def _meta(remaining):
+    """Return the meta data of a NPA response."""
+    return {"token_limit": 2000, "token_remaining": remaining}
+
+
+def test_history_fetches_missing_days_only(simulator):
+    key = simulator.add_sensor()
+    store = netrofunction.HistoryStore(client=_client(simulator))
+    try:
+        records = store.get_sensor_data(key, _days_ago(20), _days_ago(10))
+        assert records
+        assert simulator.requests[netrofunction.NETRO_GET_SENSORDATA] == 1
+        # served locally, only the missing days are requested
+        assert store.get_sensor_data(key, _days_ago(15), _days_ago(10)) == [
+            record for record in records if record["local_date"] >= _days_ago(15)
+        ]
+        assert simulator.requests[netrofunction.NETRO_GET_SENSORDATA] == 1
+        store.get_sensor_data(key, _days_ago(25), _days_ago(5))
+        assert simulator.requests[netrofunction.NETRO_GET_SENSORDATA] == 3
+        # the open days are fetched again
+        store.get_sensor_data(key, _days_ago(1))
+        store.get_sensor_data(key, _days_ago(1))
+        assert simulator.requests[netrofunction.NETRO_GET_SENSORDATA] == 5
+    finally:
+        store.close()
+
+
+def test_history_events_of_local_days():
+    # events every 7 hours of a device 10 hours ahead of UTC
+    offset = datetime.timedelta(hours=10)
+    start = datetime.datetime.combine(
+        datetime.date.today() - datetime.timedelta(days=30), datetime.time()
+    )
+    events = [
+        {
+            "id": i,
+            "event": netrofunction.NETRO_EVENT_SCHEDULESTART,
+            "time": (start + datetime.timedelta(hours=7 * i)).isoformat(),
+            "message": "",
+        }
+        for i in range(60)
+    ]
+
+    def local_date(event):
+        return (datetime.datetime.fromisoformat(event["time"]) + offset).date()
+
+    def handler(method, url, params):
+        del method, url
+        period = (params["start_date"], params["end_date"])
+        data = [
+            event
+            for event in events
+            if period[0] <= local_date(event).isoformat() <= period[1]
+        ]
+        return 200, {"status": "OK", "meta": _meta(1000), "data": {"events": data}}
+
+    client = netrofunction.NetroClient(transport=netrofunction.MemoryTransport(handler))
+    store = netrofunction.HistoryStore(client=client)
+    try:
+        store.get_events("key", _days_ago(30), _days_ago(20))
+        day = _days_ago(25)
+        assert [event["id"] for event in store.get_events("key", day, day)] == [
+            event["id"] for event in events if local_date(event).isoformat() == day
+        ]
+        assert len(client.transport.requests) == 11
+    finally:
+        store.close()
+
+
+def test_history_moistures(simulator, tmp_path):
+    key = simulator.add_controller(zones=3)
+    path = tmp_path / "history.db"
+    store = netrofunction.HistoryStore(path, client=_client(simulator, typed=True))
+    try:
+        simulator.inject_error(netrofunction.NETRO_ERROR_CODE_INTERNAL_ERROR)
+        with pytest.raises(netrofunction.NetroException):
+            store.get_moistures(key, _days_ago(10), _days_ago(5))
+        moistures = store.get_moistures(key, _days_ago(10), _days_ago(5), ["2"])
+        assert all(isinstance(record, netrofunction.Moisture) for record in moistures)
+        assert [record.zone for record in moistures] == [2] * 6
+    finally:
+        store.close()
+    # the failed request was not recorded as fetched, the other one was kept
+    assert simulator.requests == {netrofunction.NETRO_GET_MOISTURES: 2}
+    store = netrofunction.HistoryStore(path, client=_client(simulator))
+    try:
+        assert len(store.get_moistures(key, _days_ago(10), _days_ago(5))) == 18
+    finally:
+        store.close()
+    assert simulator.requests == {netrofunction.NETRO_GET_MOISTURES: 2}
@@ -12,7 +12,6 @@ import os
 import sys
 import getopt
 import datetime
-from time import gmtime, strftime
 import netrofunction
 
 # get the device keys from the environment variables
@@ -130,62 +129,30 @@ def getschedules(key):
     schedules = netrofunction.get_schedules(key)["data"]["schedules"]
     for schedule in schedules:
         logging.debug("schedule[%s] : %s", type(schedule), schedule)
-    # split par zone et tri par start date
+    # index par zone et tri par start date
+    index = netrofunction.ScheduleIndex(schedules)
     if not zones:
         getinfo(key)
     for zone_key in zones:
-        #    for i in range(1, 4):
-        past_schedules_of_zone = list(
-            filter(
-                lambda schedule: schedule["zone"]
-                == zone_key  # pylint: disable=cell-var-from-loop
-                and schedule["status"] in ["EXECUTED", "EXECUTING"],
-                schedules,
-            )
-        )
-        logging.debug("past schedules pour la zone %s", zone_key)
-        past_schedules_of_zone_sorted = sorted(
-            past_schedules_of_zone,
-            key=(lambda schedule_of_zone: schedule_of_zone["start_time"]),
-            reverse=True,
-        )
-        for schedule in past_schedules_of_zone_sorted:
-            # tri par start_date
-            logging.debug(schedule)
-        post_schedules_of_zone = list(
-            filter(
-                lambda schedule: schedule["zone"]
-                == zone_key  # pylint: disable=cell-var-from-loop
-                and schedule["status"] == "VALID"
-                and schedule["start_time"] > strftime("%Y-%m-%dT%H:%M:%S", gmtime()),
-                schedules,
-            )
-        )
-        logging.debug("post schedules pour la zone %s", zone_key)
-        post_schedules_of_zone_sorted = sorted(
-            post_schedules_of_zone,
-            key=(lambda schedule_of_zone: schedule_of_zone["start_time"]),
-            reverse=False,
-        )
-        for schedule in post_schedules_of_zone_sorted:
-            # tri par start_date
+        logging.debug("schedules pour la zone %s", zone_key)
+        for schedule in index.schedules(zone_key):
             logging.debug(schedule)
-        if past_schedules_of_zone_sorted:
+        last_run = index.last_run(zone_key)
+        if last_run:
             logging.info(
                 "le dernier arrosage pour la zone %s était le %s (UTC)",
                 zone_key,
-                datetime.datetime.fromisoformat(
-                    past_schedules_of_zone_sorted[0]["start_time"]
-                ),
+                datetime.datetime.fromisoformat(last_run["start_time"]),
             )
         else:
             logging.info("pas d'info sur le dernier arrosage de la zone %s", zone_key)
-        if post_schedules_of_zone_sorted:
+        next_run = index.next_run(zone_key)
+        if next_run:
             logging.info(
                 "le prochain arrosage pour la zone %s sera le %s à %s",
                 zone_key,
-                post_schedules_of_zone_sorted[0]["local_date"],
-                post_schedules_of_zone_sorted[0]["local_start_time"],
+                next_run["local_date"],
+                next_run["local_start_time"],
             )
         else:
             logging.info("pas d'info sur le prochain arrosage de la zone %s", zone_key)
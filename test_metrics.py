@@ -0,0 +1,142 @@
+"""
+Tests of the request hooks (RequestEvent, MetricsRegistry, TracingHook), run
+against the NPA simulator so that no real token is spent
+usage : python -m pytest test_metrics.py
+"""
+
+import asyncio
+
+import netrofunction
+
+
+def _client(simulator, **kwargs):
+    """Return a client of the simulator retrying at once."""
+    return netrofunction.NetroClient(
+        transport=simulator.transport(),
+        retry_policy=netrofunction.RetryPolicy(backoff=0.001),
+        **kwargs,
+    )
+
+
+class _Tracer:
+    """Tracer keeping its spans, with the methods used by TracingHook."""
+
+    def __init__(self):
+        """Create a tracer without spans."""
+        self.spans = []
+
+    def start_span(self, name, attributes, start_time, **kwargs):
+        """Start and keep a span."""
+        span = _Span(name, attributes, start_time, kwargs)
+        self.spans.append(span)
+        return span
+
+
+class _Span:
+    """Span keeping what is recorded."""
+
+    def __init__(self, name, attributes, start_time, kwargs):
+        """Create a started span."""
+        self.name = name
+        self.attributes = attributes
+        self.start_time = start_time
+        self.kwargs = kwargs
+        self.exceptions = []
+        self.status = None
+        self.end_time = None
+
+    def record_exception(self, exception):
+        """Keep an exception."""
+        self.exceptions.append(exception)
+
+    def set_status(self, status):
+        """Keep the status."""
+        self.status = status
+
+    def end(self, end_time):
+        """Keep the end time."""
+        self.end_time = end_time
+
+
+def test_hooks_get_every_attempt(simulator):
+    key = simulator.add_controller()
+    events = []
+    client = _client(simulator, hooks=[events.append])
+    simulator.inject_error(netrofunction.NETRO_ERROR_CODE_INTERNAL_ERROR)
+    client.get_info(key)
+    first, second = events
+    assert (first.attempt, second.attempt) == (1, 2)
+    assert first.error_code == netrofunction.NETRO_ERROR_CODE_INTERNAL_ERROR
+    assert isinstance(first.error, netrofunction.NetroException)
+    assert second.error is None
+    assert (second.name, second.method, second.key) == ("getInfo", "GET", key)
+    assert second.endpoint == netrofunction.NETRO_GET_INFO
+    assert second.status == 200 and second.size > 0
+    assert second.token_remaining == simulator.devices[key].token_remaining
+
+
+def test_failing_hook(simulator, caplog):
+    key = simulator.add_controller()
+
+    def failing(event):
+        raise RuntimeError(event)
+
+    client = _client(simulator, hooks=[failing])
+    assert client.get_info(key)["status"] == netrofunction.NETRO_OK
+    assert "request hook" in caplog.text
+
+
+def test_metrics_registry(simulator):
+    key = simulator.add_controller()
+    registry = netrofunction.MetricsRegistry(buckets=(0.5, 0.1))
+    client = _client(simulator, hooks=[registry])
+    simulator.inject_http_error(503)
+    client.get_info(key)
+    client.get_schedules(key)
+    snapshot = registry.snapshot()
+    info = snapshot["endpoints"][netrofunction.NETRO_GET_INFO]
+    assert (info["requests"], info["retries"]) == (2, 1)
+    assert info["statuses"] == {"503": 1, "200": 1}
+    assert [bound for bound, _ in info["latency_histogram"]] == [0.1, 0.5, "+Inf"]
+    assert info["latency_histogram"][-1][1] == 2
+    assert snapshot["endpoints"][netrofunction.NETRO_GET_SCHEDULES]["requests"] == 1
+    assert registry.token_remaining(key) == simulator.devices[key].token_remaining
+    assert snapshot["token_remaining"] == {key: registry.token_remaining(key)}
+    registry.reset()
+    assert registry.snapshot() == {"endpoints": {}, "token_remaining": {}}
+
+
+def test_async_client_hooks(simulator):
+    key = simulator.add_controller()
+    registry = netrofunction.MetricsRegistry()
+
+    async def scenario():
+        async with netrofunction.AsyncNetroClient(
+            transport=simulator.transport(asynchronous=True), hooks=[registry]
+        ) as client:
+            await asyncio.gather(client.get_info(key), client.get_info(key))
+
+    asyncio.run(scenario())
+    assert (
+        registry.snapshot()["endpoints"][netrofunction.NETRO_GET_INFO]["requests"] == 2
+    )
+
+
+def test_tracing_hook(simulator):
+    key = simulator.add_controller()
+    tracer = _Tracer()
+    client = _client(simulator, hooks=[netrofunction.TracingHook(tracer)])
+    simulator.inject_error(netrofunction.NETRO_ERROR_CODE_INTERNAL_ERROR)
+    client.get_info(key)
+    failed, succeeded = tracer.spans
+    assert failed.name == "NPA getInfo"
+    assert failed.attributes["netro.error_code"] == (
+        netrofunction.NETRO_ERROR_CODE_INTERNAL_ERROR
+    )
+    assert isinstance(failed.exceptions[0], netrofunction.NetroException)
+    assert succeeded.attributes["netro.attempt"] == 2
+    assert succeeded.attributes["http.response.status_code"] == 200
+    assert not succeeded.exceptions
+    assert succeeded.end_time >= succeeded.start_time
+    # the device keys are not recorded
+    assert key not in str([span.attributes for span in tracer.spans])
@@ -0,0 +1,174 @@
+"""
+Tests of the models and data structures (typed models, ScheduleIndex,
+SensorSeries), run against the NPA simulator so that no real token is spent
+usage : python -m pytest test_models.py
+"""
+
+import asyncio
+import dataclasses
+import datetime
+
+import pytest
+
+import netrofunction
+
+
+def _client(simulator, **kwargs):
+    """Return a client of the simulator."""
+    return netrofunction.NetroClient(transport=simulator.transport(), **kwargs)
+
+
+def _days_ago(days):
+    """Return the yyyy-mm-dd date of days ago."""
+    return (datetime.date.today() - datetime.timedelta(days=days)).isoformat()
+
+
+def _schedule(schedule_id, zone, hour, status, minutes=10):
+    """Return a NPA schedule of zone starting at hour of 2024-06-01 (UTC)."""
+    return {
+        "id": schedule_id,
+        "zone": zone,
+        "status": status,
+        "source": "SMART",
+        "start_time": f"2024-06-01T{hour:02}:00:00",
+        "end_time": f"2024-06-01T{hour:02}:{minutes:02}:00",
+    }
+
+
+def _at(hour, minute=0):
+    """Return the aware datetime of hour:minute on 2024-06-01 (UTC)."""
+    return datetime.datetime(2024, 6, 1, hour, minute, tzinfo=datetime.timezone.utc)
+
+
+# typed models
+
+
+def test_typed_info(simulator):
+    controller = simulator.add_controller(zones=3)
+    sensor = simulator.add_sensor()
+    client = _client(simulator, typed=True)
+    device = client.get_info(controller)
+    assert isinstance(device, netrofunction.Device)
+    assert device.serial == controller
+    assert [zone.ith for zone in device.zones] == [1, 2, 3]
+    assert all(isinstance(zone, netrofunction.Zone) for zone in device.zones)
+    assert isinstance(client.get_info(sensor), netrofunction.Sensor)
+    # compact and immutable
+    assert not hasattr(device, "__dict__")
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        device.name = "renamed"
+
+
+def test_typed_records_are_the_converted_json(simulator):
+    controller = simulator.add_controller(zones=2)
+    sensor = simulator.add_sensor()
+    client = _client(simulator)
+    typed = _client(simulator, typed=True)
+    start_date = _days_ago(3)
+    for endpoint, method, key in (
+        (netrofunction.NETRO_GET_SCHEDULES, "get_schedules", controller),
+        (netrofunction.NETRO_GET_MOISTURES, "get_moistures", controller),
+        (netrofunction.NETRO_GET_SENSORDATA, "get_sensor_data", sensor),
+        (netrofunction.NETRO_GET_EVENTS, "get_events", controller),
+    ):
+        result = getattr(client, method)(key, start_date=start_date)
+        records = getattr(typed, method)(key, start_date=start_date)
+        assert records == netrofunction.to_typed(endpoint, result)
+    schedule = typed.get_schedules(controller)[0]
+    assert isinstance(schedule.start_time, datetime.datetime)
+    moisture = typed.get_moistures(controller, start_date=start_date)[0]
+    assert isinstance(moisture.date, datetime.date)
+
+
+def test_async_typed_info(simulator):
+    key = simulator.add_controller()
+
+    async def scenario():
+        async with netrofunction.AsyncNetroClient(
+            transport=simulator.transport(asynchronous=True), typed=True
+        ) as client:
+            return await client.get_info(key)
+
+    assert asyncio.run(scenario()).serial == key
+
+
+# schedule index
+
+
+def test_schedule_index_lookups():
+    executed = netrofunction.NETRO_SCHEDULE_EXECUTED
+    valid = netrofunction.NETRO_SCHEDULE_VALID
+    index = netrofunction.ScheduleIndex(
+        [
+            _schedule(1, 1, 6, executed),
+            _schedule(2, 1, 8, "NONE"),
+            _schedule(3, 1, 12, valid),
+            _schedule(4, 1, 18, valid),
+            _schedule(5, 2, 9, executed, minutes=30),
+        ]
+    )
+    assert index.zones() == [1, 2]
+    assert index.last_run(1, _at(10))["id"] == 1
+    assert index.next_run(1, _at(10))["id"] == 3
+    assert index.next_run(1, _at(12))["id"] == 4
+    assert index.next_run(1, _at(19)) is None
+    assert index.last_run(2, _at(8)) is None
+    assert index.last_run(3, _at(8)) is None
+    assert {zone: run["id"] for zone, run in index.running(_at(9, 20)).items()} == {
+        2: 5
+    }
+    assert not index.running(_at(9, 40))
+
+
+def test_schedule_index_update_replaces_a_schedule():
+    index = netrofunction.ScheduleIndex([_schedule(1, 1, 12, "VALID")])
+    # executed earlier than planned
+    index.update([_schedule(1, 1, 7, netrofunction.NETRO_SCHEDULE_EXECUTED)])
+    assert [schedule["start_time"] for schedule in index.schedules(1)] == [
+        "2024-06-01T07:00:00"
+    ]
+    assert index.next_run(1, _at(8)) is None
+    assert index.last_run(1, _at(8))["id"] == 1
+    # moved to another zone
+    index.update([_schedule(1, 2, 7, netrofunction.NETRO_SCHEDULE_EXECUTED)])
+    assert index.schedules(1) == []
+    assert len(index.schedules(2)) == 1
+
+
+def test_schedule_index_of_results(simulator):
+    key = simulator.add_controller(zones=2)
+    result = _client(simulator).get_schedules(key)
+    index = netrofunction.ScheduleIndex(result)
+    typed = netrofunction.ScheduleIndex(
+        _client(simulator, typed=True).get_schedules(key)
+    )
+    assert index.zones() == typed.zones()
+    for zone in index.zones():
+        assert [schedule["id"] for schedule in index.schedules(zone)] == [
+            schedule.id for schedule in typed.schedules(zone)
+        ]
+        next_run = typed.next_run(zone)
+        assert next_run is None or next_run.status == netrofunction.NETRO_SCHEDULE_VALID
+
+
+# columnar series
+
+
+def test_sensor_series_of_typed_records(simulator):
+    numpy = pytest.importorskip("numpy")
+    key = simulator.add_sensor()
+    start_date = _days_ago(5)
+    series = netrofunction.SensorSeries.from_npa(
+        _client(simulator).get_sensor_data(key, start_date)
+    )
+    typed = _client(simulator, typed=True)
+    for records in (
+        typed.get_sensor_data(key, start_date),
+        typed.get_sensor_data(key, start_date, stream=True),
+    ):
+        typed_series = netrofunction.SensorSeries.from_npa(records)
+        assert numpy.array_equal(typed_series.time, series.time)
+        for field in netrofunction.SensorSeries.FIELDS:
+            assert numpy.array_equal(
+                getattr(typed_series, field), getattr(series, field), equal_nan=True
+            )
@@ -0,0 +1,54 @@
+"""
+Tests of the NPA simulator (netrosimulator)
+usage : python -m pytest test_simulator.py
+"""
+
+import pytest
+
+import netrofunction
+import netrosimulator
+
+
+def test_in_memory_simulator_binds_no_socket(simulator):
+    key = simulator.add_controller()
+    client = netrofunction.NetroClient(transport=simulator.transport())
+    assert client.get_info(key)["status"] == netrofunction.NETRO_OK
+    assert simulator._server is None  # pylint: disable=protected-access
+
+
+def test_http_simulator():
+    with netrosimulator.NetroSimulator() as simulator:
+        key = simulator.add_controller(zones=2)
+        with netrofunction.NetroClient(base_url=simulator.url) as client:
+            result = client.get_info(key)
+    assert len(result["data"]["device"]["zones"]) == 2
+    assert simulator.requests == {netrofunction.NETRO_GET_INFO: 1}
+
+
+def test_token_accounting():
+    simulator = netrosimulator.NetroSimulator(token_limit=2)
+    key = simulator.add_controller()
+    client = netrofunction.NetroClient(transport=simulator.transport())
+    assert client.get_info(key)["meta"]["token_remaining"] == 1
+    client.get_info(key)
+    with pytest.raises(netrofunction.NetroException) as error:
+        client.get_info(key)
+    assert error.value.code == netrofunction.NETRO_ERROR_CODE_EXCEED_LIMIT
+
+
+def test_injected_errors(simulator):
+    key = simulator.add_controller()
+    client = netrofunction.NetroClient(transport=simulator.transport())
+    simulator.inject_error(
+        netrofunction.NETRO_ERROR_CODE_INTERNAL_ERROR, netrofunction.NETRO_GET_INFO
+    )
+    # only the matching requests get the error
+    client.get_schedules(key)
+    with pytest.raises(netrofunction.NetroException):
+        client.get_info(key)
+    client.get_info(key)
+    simulator.inject_http_error(502, count=2)
+    for _ in range(2):
+        with pytest.raises(netrofunction.NetroHTTPError):
+            client.get_info(key)
+    client.get_info(key)
@@ -0,0 +1,166 @@
+"""
+Tests of the streamed responses (_JsonScanner, _iter_json_records) and of
+the chunked iterators (iter_sensor_data, iter_moistures, iter_events), run
+against the NPA simulator so that no real token is spent
+usage : python -m pytest test_streaming.py
+"""
+
+import datetime
+import json
+
+import pytest
+
+import netrofunction
+
+# host of the circuit of the clients using the in-memory transport
+NPA_HOST = "api.netrohome.com"
+
+
+def _client(simulator, **kwargs):
+    """Return a client of the simulator."""
+    return netrofunction.NetroClient(transport=simulator.transport(), **kwargs)
+
+
+def _days_ago(days):
+    """Return the yyyy-mm-dd date of days ago."""
+    return (datetime.date.today() - datetime.timedelta(days=days)).isoformat()
+
+
+def _chunks(body, size):
+    """Split a body in chunks of size bytes."""
+    return [body[position : position + size] for position in range(0, len(body), size)]
+
+
+def _records(body, size, data_name):
+    """Return the records and the envelope of a body read by chunks."""
+    envelope = {}
+    scanner = netrofunction._JsonScanner(  # pylint: disable=protected-access
+        _chunks(body, size)
+    )
+    records = list(
+        netrofunction._iter_json_records(  # pylint: disable=protected-access
+            scanner, data_name, envelope
+        )
+    )
+    assert scanner.size == len(body)
+    return records, envelope
+
+
+def test_stream_records_whatever_the_chunk_size():
+    response = {
+        "status": "OK",
+        "meta": {"token_remaining": 5, "values": [1, 2.5e3, "é"]},
+        "data": {
+            "first": 1,
+            "sensor_data": [
+                {"id": i, "celsius": i * 1.25, "name": "ü" * i} for i in range(20)
+            ],
+            "last": [],
+        },
+    }
+    body = json.dumps(response, indent=1, ensure_ascii=False).encode()
+    for size in (1, 2, 3, 7, 64, len(body)):
+        records, envelope = _records(body, size, "sensor_data")
+        assert records == response["data"]["sensor_data"]
+        assert envelope == {
+            "status": "OK",
+            "meta": response["meta"],
+            "data": {"first": 1, "last": []},
+        }
+
+
+def test_stream_numbers_cut_by_chunks():
+    body = b'{"data": {"events": [123, -0.5e10, 1.5e3, 2.25E-2, true, null]}}'
+    for size in range(1, len(body) + 1):
+        records, _ = _records(body, size, "events")
+        assert records == [123, -0.5e10, 1.5e3, 2.25e-2, True, None]
+
+
+def test_stream_invalid_document():
+    with pytest.raises(ValueError):
+        _records(b'{"data": {"events": [1 2]}}', 4, "events")
+    with pytest.raises(ValueError):
+        _records(b'{"data": {"events": []}} {}', 4, "events")
+
+
+def test_stream_same_records_as_buffered(simulator):
+    key = simulator.add_sensor()
+    client = _client(simulator)
+    start_date = _days_ago(10)
+    records = client.get_sensor_data(key, start_date)["data"]["sensor_data"]
+    assert records
+    assert list(client.get_sensor_data(key, start_date, stream=True)) == records
+
+
+def test_stream_typed_records(simulator):
+    key = simulator.add_sensor()
+    records = list(_client(simulator, typed=True).get_sensor_data(key, stream=True))
+    assert records
+    assert all(isinstance(record, netrofunction.SensorReading) for record in records)
+
+
+def test_stream_errors(simulator):
+    key = simulator.add_controller()
+    client = _client(simulator)
+    simulator.inject_error(netrofunction.NETRO_ERROR_CODE_INVALID_DEVICE_OR_SENSOR)
+    with pytest.raises(netrofunction.NetroException) as error:
+        list(client.get_events(key, stream=True))
+    assert error.value.code == netrofunction.NETRO_ERROR_CODE_INVALID_DEVICE_OR_SENSOR
+    simulator.inject_http_error(500)
+    with pytest.raises(netrofunction.NetroHTTPError) as error:
+        list(client.get_events(key, stream=True))
+    assert error.value.status == 500
+
+
+def test_stream_early_close(simulator):
+    key = simulator.add_sensor()
+    breaker = netrofunction.CircuitBreaker()
+    client = _client(simulator, circuit_breaker=breaker)
+    records = client.get_sensor_data(key, _days_ago(10), stream=True)
+    next(records)
+    records.close()
+    assert not breaker.is_open(NPA_HOST)
+
+
+def test_iter_sensor_data_by_chunks(simulator):
+    key = simulator.add_sensor()
+    client = _client(simulator)
+    start_date = _days_ago(9)
+    records = client.get_sensor_data(key, start_date)["data"]["sensor_data"]
+    assert list(client.iter_sensor_data(key, start_date, chunk_days=3)) == records
+    # 10 days in windows of 3 days, after the whole period
+    assert simulator.requests == {netrofunction.NETRO_GET_SENSORDATA: 1 + 4}
+
+
+def test_iter_moistures_prefetch(simulator):
+    key = simulator.add_controller(zones=2)
+    start_date = _days_ago(6)
+    client = _client(simulator)
+    prefetched = list(
+        client.iter_moistures(key, start_date, zone_ids=["2"], chunk_days=2)
+    )
+    assert prefetched == list(
+        client.iter_moistures(
+            key, start_date, zone_ids=["2"], chunk_days=2, prefetch=False
+        )
+    )
+    assert [record["date"] for record in prefetched] == [
+        _days_ago(days) for days in range(6, -1, -1)
+    ]
+    assert {record["zone"] for record in prefetched} == {2}
+    typed = list(
+        _client(simulator, typed=True).iter_moistures(key, start_date, chunk_days=2)
+    )
+    assert all(isinstance(record, netrofunction.Moisture) for record in typed)
+
+
+def test_iter_error_of_a_later_window(simulator):
+    key = simulator.add_sensor()
+    records = _client(simulator).iter_sensor_data(
+        key, _days_ago(6), chunk_days=2, prefetch=False
+    )
+    next(records)
+    simulator.inject_error(netrofunction.NETRO_ERROR_CODE_INTERNAL_ERROR)
+    with pytest.raises(netrofunction.NetroException):
+        list(records)
+    assert simulator.requests == {netrofunction.NETRO_GET_SENSORDATA: 2}
@@ -0,0 +1,119 @@
+"""
+Tests of the write commands (CommandBatcher, Reconciler, WeatherReporter),
+run against the NPA simulator so that no real token is spent
+usage : python -m pytest test_writes.py
+"""
+
+import datetime
+
+import pytest
+
+import netrofunction
+
+
+def _client(simulator, **kwargs):
+    """Return a client of the simulator."""
+    return netrofunction.NetroClient(transport=simulator.transport(), **kwargs)
+
+
+def test_batcher_merges_zones(simulator):
+    key = simulator.add_controller(zones=3)
+    with netrofunction.CommandBatcher(_client(simulator), window=0.01) as batcher:
+        with pytest.raises(ValueError):
+            batcher.set_moisture(key, 40, "a")
+        futures = [batcher.water(key, 1, zone_id) for zone_id in (1, "2", 3)]
+    results = [future.result(timeout=1) for future in futures]
+    assert results[0]["status"] == netrofunction.NETRO_OK
+    assert all(result is results[0] for result in results)
+    assert simulator.requests == {netrofunction.NETRO_POST_WATER: 1}
+
+
+def test_reconciler_sends_only_the_needed_calls(simulator):
+    key = simulator.add_controller(zones=3)
+    reconciler = netrofunction.Reconciler(_client(simulator))
+    reconciler.declare(
+        key,
+        netrofunction.DesiredState(
+            enabled=False, no_water_days=2, moistures={1: 40, 2: 40, 3: 70}
+        ),
+    )
+    planned = reconciler.reconcile(key, dry_run=True)
+    assert [(call.method, call.params) for call in planned] == [
+        ("no_water", {"days": 2}),
+        ("set_moisture", {"moisture": 40, "zone_ids": ["1", "2"]}),
+        ("set_moisture", {"moisture": 70, "zone_ids": ["3"]}),
+        # standby once the other settings are sent
+        ("set_status", {"status": netrofunction.NETRO_STATUS_DISABLE}),
+    ]
+    assert netrofunction.NETRO_POST_MOISTURE not in simulator.requests
+    sent = reconciler.reconcile(key)
+    assert [call.method for call in sent] == [call.method for call in planned]
+    assert all(call.error is None for call in sent)
+    # converged
+    assert not reconciler.plan(key)
+    reconciler.declare(
+        key, netrofunction.DesiredState(enabled=True, moistures={1: 40, 2: 45})
+    )
+    assert [(call.method, call.params) for call in reconciler.plan(key)] == [
+        ("set_status", {"status": netrofunction.NETRO_STATUS_ENABLE}),
+        ("set_moisture", {"moisture": 45, "zone_ids": ["2"]}),
+    ]
+
+
+def test_reconciler_failures(simulator):
+    key = simulator.add_controller(zones=2)
+    reconciler = netrofunction.Reconciler(_client(simulator))
+    reconciler.declare(
+        key, netrofunction.DesiredState(no_water_days=1, moistures={1: 30})
+    )
+    reconciler.declare("unknown", netrofunction.DesiredState(enabled=True))
+    simulator.inject_error(
+        netrofunction.NETRO_ERROR_CODE_INTERNAL_ERROR, netrofunction.NETRO_POST_MOISTURE
+    )
+    outcomes = reconciler.reconcile_all()
+    assert isinstance(outcomes["unknown"], netrofunction.NetroException)
+    no_water, set_moisture = outcomes[key]
+    assert no_water.error is None
+    assert isinstance(set_moisture.error, netrofunction.NetroException)
+    # only the failed call is sent again
+    assert [call.method for call in reconciler.plan(key)] == ["set_moisture"]
+
+
+def test_weather_reporter_suppresses_unchanged_reports(simulator):
+    keys = [simulator.add_controller() for _ in range(3)]
+    today = datetime.date.today()
+    tomorrow = today + datetime.timedelta(days=1)
+    forecasts = [
+        netrofunction.WeatherForecast(today, condition=1, rain=2.5, temp=18),
+        netrofunction.WeatherForecast(tomorrow.isoformat(), condition=0, temp=21),
+    ]
+    with netrofunction.WeatherReporter(_client(simulator), max_workers=2) as reporter:
+        outcomes = reporter.report(forecasts, keys)
+        assert sorted(outcomes) == sorted(
+            (key, str(date)) for key in keys for date in (today, tomorrow)
+        )
+        assert all(outcome.error is None for outcome in outcomes.values())
+        # unchanged: nothing sent
+        assert not reporter.report(forecasts, keys)
+        changed = netrofunction.WeatherForecast(tomorrow, condition=0, temp=23)
+        assert sorted(reporter.report(changed, keys)) == [
+            (key, tomorrow.isoformat()) for key in sorted(keys)
+        ]
+        reporter.forget(keys[0])
+        assert sorted(reporter.report(forecasts, keys[:2])) == sorted(
+            [(keys[0], str(today)), (keys[0], str(tomorrow))]
+            + [(keys[1], str(tomorrow))]
+        )
+    assert simulator.requests == {netrofunction.NETRO_POST_REPORTWEATHER: 6 + 3 + 3}
+
+
+def test_weather_reporter_retries_failed_reports(simulator):
+    key = simulator.add_controller()
+    forecast = netrofunction.WeatherForecast(datetime.date.today(), temp=15)
+    simulator.inject_error(netrofunction.NETRO_ERROR_CODE_INTERNAL_ERROR)
+    with netrofunction.WeatherReporter(_client(simulator)) as reporter:
+        (outcome,) = reporter.report(forecast, [key]).values()
+        assert isinstance(outcome.error, netrofunction.NetroException)
+        (outcome,) = reporter.report(forecast, [key]).values()
+        assert outcome.error is None
+        assert not reporter.report(forecast, [key])